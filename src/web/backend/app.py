@@ -6,8 +6,8 @@ import wtforms.validators as vali
 import flask_wtf
 import flask_login
 
-from . import commands, core, nextcloud, rocket_chat, ldap, actions, saml
-from . import extensions, utils
+from . import commands, core, nextcloud, rocket_chat, ldap, actions, jobs, saml
+from . import extensions, metrics, utils
 
 from werkzeug.middleware.proxy_fix import ProxyFix
 
@@ -33,6 +33,9 @@ def create_app(config_object='backend.settings'):
 
 def initialize_modules(app):
     rocket_chat.initialize_module(app)
+    ldap.initialize_module(app)
+    jobs.initialize_module(app)
+    metrics.initialize_module(app)
     return None
 
 
@@ -158,6 +161,7 @@ def register_blueprints(app):
         rocket_chat.api.blueprint,
         ldap.api.blueprint,
         actions.api.blueprint,
+        jobs.api.blueprint,
     ]
     for bp in bps:
         bp.before_request(utils.check_route_access)
@@ -201,3 +205,4 @@ def register_commands(app):
     app.cli.add_command(commands.bootstrap)
     app.cli.add_command(commands.saml)
     app.cli.add_command(commands.maintain)
+    app.cli.add_command(commands.import_users)
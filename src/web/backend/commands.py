@@ -51,7 +51,9 @@ def maintain():
         rocket = rutils.RocketChatService()
         edap = lutils.get_edap()
 
-        return model.maintain(edap, rocket)
+        report = model.maintain(edap, rocket)
+        click.echo(f"Rooms reconciled: {report}")
+        return report
 
 
 @click.command()
@@ -159,8 +161,27 @@ def urls(url, order):
 
 
 @click.command()
+@click.option('--teams', 'teams_only', default=False, is_flag=True,
+              help='Only compare teams with franchises and divisions, print the report as JSON')
 @with_appcontext
-def check_services_consistency():
+def check_services_consistency(teams_only):
+    if teams_only:
+        import json
+        from .edap import get_teams_consistency
+        from .ldap.models import LdapTeam
+        from .ldap.utils import get_edap
+
+        consistency = get_teams_consistency(
+            get_edap(), ignore=(LdapTeam.EVERYBODY_MACHINE_NAME, LdapTeam.INTERNATIONAL_MACHINE_NAME))
+        for key in ("orphans", "mismatched"):
+            consistency[key] = [
+                dict(machine_name=team["cn"][0].decode("UTF-8"),
+                     display_name=team["description"][0].decode("UTF-8") if team.get("description") else None)
+                for team in consistency[key]]
+        consistency["missing"] = [dict(machine_name=machine_name, display_name=display_name)
+                                  for machine_name, display_name in consistency["missing"]]
+        click.echo(json.dumps(consistency, indent=2))
+        return
     check_ldap_consistency()
     check_nextcloud_consistency()
 
@@ -168,8 +189,31 @@ def check_services_consistency():
 @click.command()
 @with_appcontext
 def bootstrap():
-    """Create initial structures in controlled services."""
-    bootstrap_ldap()
+    """Create initial structures in controlled services, print what has been created."""
+    import json
+    click.echo(json.dumps(bootstrap_ldap(), indent=2))
+
+
+@click.command('import-users')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None,
+              help='Format of the source, guessed from its extension if not given')
+@click.option('--batch-size', default=None, type=int, help='Rows validated and created together')
+@click.option('--no-chat', default=False, is_flag=True, help="Don't create Rocket.Chat accounts")
+@with_appcontext
+def import_users(source, fmt, batch_size, no_chat):
+    """Create users from CSV (uid,name,surname,mail,password,teams) or JSON lines, print result of every row."""
+    import json
+    from .ldap.importer import UserImporter, parse_rows
+    from .ldap.utils import get_edap
+
+    fmt = fmt or ('jsonl' if source.name.endswith(('.jsonl', '.ndjson')) else 'csv')
+    importer = UserImporter(get_edap(),
+                            batch_size=batch_size or current_app.config.get('IMPORT_BATCH_SIZE', 100),
+                            workers=current_app.config.get('ROCKETCHAT_WORKERS', 8),
+                            create_chat_accounts=not no_chat)
+    for result in importer.run(parse_rows(source, fmt)):
+        click.echo(json.dumps(result))
 
 
 @click.command()
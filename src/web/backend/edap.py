@@ -3,9 +3,18 @@ import os
 import codecs
 import argparse
 import base64
+import collections
+import contextlib
+import threading
+import time
 
 import ldap
+import ldap.dn
 import ldap.modlist
+from ldap.controls import SimplePagedResultsControl
+from ldap.controls.sss import SSSRequestControl, SSSResponseControl
+
+from .filters import and_, any_of, contains, eq, or_, present, to_filter
 
 
 COUNTRIES_CODES = {
@@ -297,6 +306,46 @@ def ldap_tuple_to_object(ldap_tuple):
     }
 
 
+def parenthesize(search):
+    """ Enclose search filter in parentheses unless it already is, e.g. 'cn=pl' -> '(cn=pl)' """
+    return str(to_filter(search))
+
+
+# attributes searched by free text user queries
+USER_QUERY_ATTRIBUTES = ("uid", "givenName", "sn", "mail")
+
+
+def user_query_filter(query):
+    """
+    Make search filter matching users with query contained in any of USER_QUERY_ATTRIBUTES
+
+    Args:
+        query (str): free text
+
+    Returns (Filter): search filter, None if there is nothing to search for
+    """
+    if not query:
+        return None
+    return or_(*(contains(attr, query) for attr in USER_QUERY_ATTRIBUTES))
+
+
+def sort_entries(entries, sort):
+    """
+    Sort objects in place, the way server side sorting would
+
+    Args:
+        entries (list): dicts with attributes
+        sort (str): attribute to sort by, prefixed by '-' for descending order
+    """
+    attr = sort.lstrip("-")
+
+    def key(entry):
+        values = entry.get(attr) or [b""]
+        return get_str(values[0]).lower(), get_str((entry.get("uid") or [b""])[0])
+
+    entries.sort(key=key, reverse=sort.startswith("-"))
+
+
 class ConstraintError(RuntimeError):
     pass
 
@@ -311,6 +360,340 @@ class MultipleObjectsFound(Exception):
     pass
 
 
+class PoolExhausted(RuntimeError):
+    """ Raised if no connection could be checked out of the pool in time """
+    pass
+
+
+class LdapConnectionPool(object):
+    """
+    Bounded, thread-safe pool of bound LDAP connections, meant to be shared by all Edap instances of a process.
+
+    Connections are bound once and handed out repeatedly, so that an Edap doesn't pay for a TCP connect
+    and a bind every time it is constructed. Connections that have been idle for too long are closed,
+    the ones that have been idle for a while are checked by a cheap whoami before they are handed out.
+    """
+
+    def __init__(self, uri, bind_dn, password, max_size=10, idle_timeout=300, checkout_timeout=10,
+                 health_check_interval=30, network_timeout=5):
+        self.uri = uri
+        self.bind_dn = bind_dn
+        self.password = password
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.network_timeout = network_timeout
+
+        self._idle = collections.deque()  # (connection, time of checkin) pairs, the most recently used last
+        self._size = 0
+        self._checked_out = 0
+        self._cond = threading.Condition()
+        self._counters = collections.Counter()
+
+    def _connect(self):
+        conn = ldap.initialize(self.uri)
+        conn.set_option(ldap.OPT_NETWORK_TIMEOUT, self.network_timeout)
+        conn.bind_s(self.bind_dn, self.password)
+        self._counters["created"] += 1
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.whoami_s()
+        except ldap.LDAPError:
+            return False
+        return True
+
+    def _pop_expired(self):
+        """ Remove connections idle for longer than idle_timeout, has to be called with the lock held """
+        expired = []
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            expired.append(self._idle.popleft()[0])
+        self._size -= len(expired)
+        self._counters["expired"] += len(expired)
+        return expired
+
+    def _forget(self, conn=None):
+        """ Give up a checked out slot, e.g. when a connection couldn't be (re)established """
+        with self._cond:
+            self._size -= 1
+            self._checked_out -= 1
+            self._cond.notify()
+        if conn is not None:
+            self._close(conn)
+
+    def checkout(self):
+        """
+        Get a bound connection, waiting at most checkout_timeout seconds for one to be returned to the pool
+
+        Returns (LDAPObject):
+        """
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._cond:
+            while True:
+                expired = self._pop_expired()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    raise PoolExhausted(f"No LDAP connection available within {self.checkout_timeout}s")
+                self._counters["waits"] += 1
+                self._cond.wait(remaining)
+            self._checked_out += 1
+            self._counters["checkouts"] += 1
+
+        for each in expired:
+            self._close(each)
+
+        if conn is not None and time.monotonic() - last_used > self.health_check_interval:
+            if not self._is_healthy(conn):
+                self._counters["health_check_failures"] += 1
+                return self.replace(conn)
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._forget()
+                raise
+        return conn
+
+    def checkin(self, conn, discard=False):
+        """
+        Return a connection obtained by checkout to the pool
+
+        Args:
+            conn (LDAPObject): connection to return
+            discard (bool): close the connection instead of keeping it for reuse
+        """
+        if discard:
+            self._forget(conn)
+            return
+        with self._cond:
+            self._checked_out -= 1
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def replace(self, conn):
+        """
+        Close a broken checked out connection and get a freshly bound one in its place,
+        e.g. after the server has been restarted
+
+        Returns (LDAPObject):
+        """
+        self._close(conn)
+        try:
+            new_conn = self._connect()
+        except Exception:
+            self._forget()
+            raise
+        self._counters["reconnects"] += 1
+        return new_conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        """ Context manager that checks a connection out and returns it to the pool afterwards """
+        conn = self.checkout()
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    def close_all(self):
+        """ Close all idle connections, checked out connections are closed when they are returned """
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self):
+        """ Get pool usage statistics as a dict """
+        with self._cond:
+            return dict(
+                max_size=self.max_size,
+                size=self._size,
+                idle=len(self._idle),
+                checked_out=self._checked_out,
+                **self._counters,
+            )
+
+
+membership_change = collections.namedtuple("membership_change", ("added", "removed", "missing"))
+pipeline_result = collections.namedtuple("pipeline_result", ("operation", "dn", "error"))
+
+
+class LdapPipeline(object):
+    """
+    Write operations sent on the connection of an Edap without waiting for the reply of each,
+    so that N operations cost about one round trip. Replies are collected by results(), in order of sending.
+
+    Use as context manager, replies not collected when the block is left are collected and dropped.
+    """
+
+    def __init__(self, edap):
+        self.edap = edap
+        self._sent = []  # (operation, dn, connection, msgid)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._sent:
+            self.results()
+
+    def __len__(self):
+        return len(self._sent)
+
+    def _send(self, operation, dn, *args):
+        msgid = self.edap._call(operation, dn, *args)
+        # the connection may have been replaced by _call, replies are read from the one the operation went to
+        self._sent.append((operation, dn, self.edap.ldap, msgid))
+
+    def add(self, dn, modlist):
+        self._send("add", dn, modlist)
+
+    def modify(self, dn, modlist):
+        self._send("modify", dn, modlist)
+
+    def delete(self, dn):
+        self._send("delete", dn)
+
+    def results(self, raise_errors=False):
+        """
+        Wait for replies of all operations sent since the previous call
+
+        Args:
+            raise_errors (bool): raise the python-ldap exception of the first failed operation,
+                after all replies were collected
+
+        Returns (list): pipeline_result of every operation, error is the python-ldap exception or None
+        """
+        sent, self._sent = self._sent, []
+        results = []
+        for operation, dn, conn, msgid in sent:
+            try:
+                self.edap._observed("result3", (msgid,), lambda: conn.result3(msgid))
+            except ldap.LDAPError as e:
+                results.append(pipeline_result(operation, dn, e))
+                continue
+            self.edap._notify_write(dn)
+            results.append(pipeline_result(operation, dn, None))
+        if raise_errors:
+            for result in results:
+                if result.error is not None:
+                    raise result.error
+        return results
+
+
+def _normalize_dn(dn):
+    return ",".join(rdn.strip() for rdn in dn.lower().split(","))
+
+
+class SearchCache(object):
+    """
+    Results of search_s calls of an edap, meant to live as long as one request. Identical searches are sent once,
+    results are dropped when the edap writes an object they may include: the base DN of the search, an object above it
+    or, unless the search is base scoped, below it.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # (base, scope, filter, attrlist, attrsonly) -> entries, or NO_SUCH_OBJECT the search raised
+        self._results = collections.OrderedDict()
+
+    @staticmethod
+    def _copy(entries):
+        """ Copy entries deep enough that callers changing them don't change the cached ones """
+        return [(dn, {attr: list(values) for attr, values in attrs.items()} if isinstance(attrs, dict) else attrs)
+                for dn, attrs in entries]
+
+    def _put(self, key, result):
+        self._results[key] = result
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    def search(self, call, base, scope, filterstr="(objectClass=*)", attrlist=None, attrsonly=0):
+        """
+        Get result of search with the given arguments, calling call() to send it if it isn't cached
+
+        Args:
+            call (callable): sends the search, returns its entries
+            base, scope, filterstr, attrlist, attrsonly: arguments of search_s
+
+        Returns (list): (dn, attributes) tuples
+        """
+        key = (_normalize_dn(base), scope, filterstr, tuple(attrlist) if attrlist is not None else None, attrsonly)
+        if key in self._results:
+            self.hits += 1
+            result = self._results[key]
+            if isinstance(result, ldap.NO_SUCH_OBJECT):
+                raise result
+            return self._copy(result)
+        self.misses += 1
+        try:
+            result = call()
+        except ldap.NO_SUCH_OBJECT as e:
+            self._put(key, e)
+            raise
+        self._put(key, self._copy(result))
+        return result
+
+    def invalidate(self, dn):
+        """ Drop results that may include the object at dn, registered as write listener """
+        dn = _normalize_dn(dn)
+
+        def is_stale(base, scope):
+            # the object is the base or above it, or it's below the base of a search that isn't base scoped
+            if base == dn or base.endswith("," + dn):
+                return True
+            return scope != ldap.SCOPE_BASE and dn.endswith("," + base)
+
+        stale = [key for key in self._results if is_stale(key[0], key[1])]
+        for key in stale:
+            del self._results[key]
+
+    def clear(self):
+        self._results.clear()
+
+    def __len__(self):
+        return len(self._results)
+
+
+def _chunks(items, size):
+    """ Split list into consecutive lists of at most `size` items """
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def ldap_error_message(error):
+    """ Get readable message of python-ldap exception, e.g. 'Already exists: entry exists' """
+    details = error.args[0] if error.args and isinstance(error.args[0], dict) else {}
+    desc = details.get("desc")
+    info = details.get("info")
+    if not desc:
+        return str(error)
+    return f"{desc}: {info}" if info else desc
+
+
 def get_single_object(data):
     """ Get first element of a list, or raise Exception if list length > 1 or equals 0 """
     if len(data) == 0:
@@ -350,20 +733,28 @@ def check_password(tagged_digest_salt, password):
     return digest == sha.digest()
 
 
+# attribute list requesting no attributes (RFC 4511), for searches that only check existence of entries
+NO_ATTRIBUTES = ["1.1"]
+
+ALL_OBJECTS = present("objectClass")
+POSIX_GROUPS = eq("objectClass", "posixGroup")
+ORG_UNITS = eq("objectClass", "organizationalUnit")
+
+
 class LdapObjectsMixin(object):
+    # How many entries to request per page of a paged search
+    PAGE_SIZE = 500
 
     def object_exists(self, search, obj_class=None):
         if obj_class is not None:
-            search = f"&({search})(objectClass={obj_class})"
-        found = self.search_s(self.BASE_DN, ldap.SCOPE_SUBTREE, f"({search})")
+            search = and_(eq("objectClass", obj_class), search)
+        found = self.search_s(self.BASE_DN, ldap.SCOPE_SUBTREE, str(to_filter(search)), attrlist=NO_ATTRIBUTES)
         return len(found)
 
     def object_exists_at(self, root, obj_class, additional_search=None):
-        search = f"objectClass={obj_class}"
-        if additional_search is not None:
-            search = f"&({search})({additional_search})"
+        search = and_(eq("objectClass", obj_class), additional_search)
         try:
-            found = self.search_s(root, ldap.SCOPE_BASE, f"({search})")
+            found = self.search_s(root, ldap.SCOPE_BASE, str(search), attrlist=NO_ATTRIBUTES)
         except Exception:
             return 0
         return len(found)
@@ -372,19 +763,62 @@ class LdapObjectsMixin(object):
         root = f"{relative_pos},{self.BASE_DN}"
         return self.object_exists_at(root, obj_class, additional_search)
 
-    def get_objects(self, search=None, relative_pos=None, obj_class=None):
+    def search_paged(self, base, scope, search, attrlist=None, page_size=None):
+        """
+        Search using the simple paged results control (RFC 2696), so that results are not limited by server size limit
+        and only one page of them is held in memory at a time
+
+        Args:
+            base (str): dn to search from
+            scope (int): ldap scope
+            search (str): search filter
+            attrlist (list): attributes to fetch, all if None
+            page_size (int): how many entries to request per page, PAGE_SIZE by default
+
+        Returns (generator): (dn, attributes) tuples
+        """
+        # not critical, servers without paging support return all results at once
+        control = SimplePagedResultsControl(criticality=False, size=page_size or self.page_size, cookie="")
+        while True:
+            msgid = self.search_ext(base, scope, search, attrlist=attrlist, serverctrls=[control])
+            _, data, _, response_controls = self.result3(msgid)
+            for dn, attrs in data:
+                # skip search references
+                if dn is not None:
+                    yield dn, attrs
+            cookie = next((each.cookie for each in response_controls
+                           if each.controlType == SimplePagedResultsControl.controlType), None)
+            if not cookie:
+                break
+            control.cookie = cookie
+
+    def iter_objects(self, search=None, relative_pos=None, obj_class=None, page_size=None, attrlist=None):
+        """
+        Iterate over objects fetched page by page
+
+        Args:
+            search (Filter or str): search filter
+            relative_pos (str): position relative to base dn to search from
+            obj_class (str): object class of objects
+            page_size (int): how many entries to request per page
+            attrlist (list): attributes to fetch, all if None
+
+        Returns (generator): dicts with attributes and dn as fqdn
+        """
         root = self.BASE_DN
-        if obj_class is not None:
-            if search:
-                search = f"(&({search})(objectClass={obj_class}))"
-            else:
-                search = f"(objectClass={obj_class})"
+        search = and_(eq("objectClass", obj_class) if obj_class is not None else None, search)
         if relative_pos:
             root = f"{relative_pos},{root}"
-        return transform_ldap_response(self.search_s(root, ldap.SCOPE_SUBTREE, search))
+        for each in self.search_paged(root, ldap.SCOPE_SUBTREE, str(search or ALL_OBJECTS), attrlist=attrlist,
+                                      page_size=page_size):
+            yield ldap_tuple_to_object(each)
 
-    def get_subobjects(self, relative_pos, search=None, obj_class=None):
-        return self.get_objects(search=search, relative_pos=relative_pos, obj_class=obj_class)
+    def get_objects(self, search=None, relative_pos=None, obj_class=None, attrlist=None):
+        return list(self.iter_objects(search=search, relative_pos=relative_pos, obj_class=obj_class,
+                                      attrlist=attrlist))
+
+    def get_subobjects(self, relative_pos, search=None, obj_class=None, attrlist=None):
+        return self.get_objects(search=search, relative_pos=relative_pos, obj_class=obj_class, attrlist=attrlist)
 
     def delete_object(self, dn):
         """ Delete object by dn """
@@ -392,6 +826,9 @@ class LdapObjectsMixin(object):
 
 
 class LdapUserMixin:
+    # How many values to OR together in a single search filter when validating in bulk
+    FILTER_BATCH_SIZE = 200
+
     def add_user(self, uid, name, surname, password, mail, picture_bytes=b"", mail_aliases=None):
         if not mail_aliases:
             mail_aliases = []
@@ -402,29 +839,126 @@ class LdapUserMixin:
         modlist = self._mk_add_user_modlist(uid, name, surname, password, mail, picture_bytes, mail_aliases)
         self.add_s(f"uid={uid},{self.ACTIVE_PEOPLE_GROUP}", modlist)
 
-    def get_users(self, search=None):
+    def add_users(self, users):
+        """
+        Add several users, checking the people OU and existing uids once and sending all adds
+        before waiting for the result of any of them
+
+        Args:
+            users (list): dicts of add_user arguments - uid, name, surname, password, mail and optionally
+                picture_bytes and mail_aliases
+
+        Returns (dict): uid -> None if the user was added, error message otherwise
+        """
+        if self.subobject_exists_at("ou=active,ou=people", "organizationalUnit") == 0:
+            raise ConstraintError(f"The people group '{self.ACTIVE_PEOPLE_GROUP}' doesn't exist.")
+        existing = self.get_existing_uids(user["uid"] for user in users)
+        results = dict()
+        sent = []
+        with self.pipeline() as pipeline:
+            for user in users:
+                uid = user["uid"]
+                if uid in existing:
+                    results[uid] = f"User of uid '{uid}' already exists."
+                    continue
+                modlist = self._mk_add_user_modlist(uid, user["name"], user["surname"], user["password"],
+                                                    user["mail"], user.get("picture_bytes", b""),
+                                                    user.get("mail_aliases") or [])
+                pipeline.add(f"uid={uid},{self.ACTIVE_PEOPLE_GROUP}", modlist)
+                sent.append(uid)
+            for uid, result in zip(sent, pipeline.results()):
+                results[uid] = ldap_error_message(result.error) if result.error is not None else None
+        return results
+
+    def get_users(self, search=None, attrlist=None):
         """
         Get subobjects of organizational unit "people"
 
         Args:
-            search (str): search filter
+            search (Filter or str): search filter
+            attrlist (list): attributes to fetch, all if None
 
         Returns:
         """
-        return self.get_subobjects('ou=active,ou=people', search, obj_class='inetOrgPerson')
+        return self.get_subobjects('ou=active,ou=people', search, obj_class='inetOrgPerson', attrlist=attrlist)
+
+    def iter_users(self, search=None, page_size=None, attrlist=None):
+        """
+        Iterate over subobjects of organizational unit "people", fetched page by page
+
+        Args:
+            search (Filter or str): search filter
+            page_size (int): how many users to request per page
+            attrlist (list): attributes to fetch, all if None
+
+        Returns (generator):
+        """
+        return self.iter_objects(search=search, relative_pos='ou=active,ou=people', obj_class='inetOrgPerson',
+                                 page_size=page_size, attrlist=attrlist)
 
-    def get_user(self, uid):
+    def get_users_page(self, offset=0, limit=50, sort=None, query=None, attrlist=None):
+        """
+        Get a window of users, sorted by the server if it supports server side sorting (RFC 2891)
+        and fetched with the paged results control, so that only users up to the window's end are transferred
+
+        Args:
+            offset (int): how many users to skip
+            limit (int): max number of users to return
+            sort (str): attribute to sort by, prefixed by '-' for descending order
+            query (str): text to be contained in one of USER_QUERY_ATTRIBUTES
+            attrlist (list): attributes to fetch, all if None
+
+        Returns (tuple): list of users, estimated total count - a lower bound if the server doesn't estimate it
+        """
+        query_filter = user_query_filter(query)
+        search = str(and_(eq("objectClass", "inetOrgPerson"), query_filter))
+        sort_controls = [SSSRequestControl(criticality=True, ordering_rules=[sort])] if sort else []
+        page = SimplePagedResultsControl(criticality=False, size=offset or limit, cookie="")
+        to_skip, results, estimate = offset, [], 0
+        try:
+            while True:
+                msgid = self.search_ext(self.ACTIVE_PEOPLE_GROUP, ldap.SCOPE_ONELEVEL, search, attrlist=attrlist,
+                                        serverctrls=[page] + sort_controls)
+                _, data, _, response_controls = self.result3(msgid)
+                data = [each for each in data if each[0] is not None]
+                controls = {each.controlType: each for each in response_controls}
+                if getattr(controls.get(SSSResponseControl.controlType), "sortResult", 0):
+                    # the server can't sort by this attribute
+                    raise ldap.UNAVAILABLE_CRITICAL_EXTENSION(sort)
+                paged = controls.get(SimplePagedResultsControl.controlType)
+                if paged is None:
+                    # paging is not supported, the server returned everything at once
+                    return transform_ldap_response(data[offset:offset + limit]), len(data)
+
+                estimate = max(estimate, paged.size)
+                skipped = min(to_skip, len(data))
+                to_skip -= skipped
+                results.extend(data[skipped:])
+                if len(results) >= limit or not paged.cookie:
+                    break
+                page.cookie = paged.cookie
+                page.size = to_skip or limit - len(results)
+        except ldap.UNAVAILABLE_CRITICAL_EXTENSION:
+            users = self.get_users(query_filter, attrlist=attrlist)
+            sort_entries(users, sort)
+            return users[offset:offset + limit], len(users)
+
+        # the rest of the paged search is left to the server, next paged search on the connection replaces it
+        more = 1 if paged.cookie else 0
+        return transform_ldap_response(results[:limit]), max(estimate, offset + len(results) + more)
+
+    def get_user(self, uid, attrlist=None):
         """
         Search in subobjects of organizational unit "people" by uid
         Args:
             uid (str):
+            attrlist (list): attributes to fetch, all if None
 
         Returns:
         """
-        return get_single_object(self.get_users(search=f"uid={uid}"))
+        return get_single_object(self.get_users(search=eq("uid", uid), attrlist=attrlist))
 
     def get_user_as_good_dict(self, uid):
-        user_dict = self.get_user(uid)
         transform = dict(
                 givenName=lambda x: x[0].decode("UTF-8"),
                 sn=lambda x: x[0].decode("UTF-8"),
@@ -433,27 +967,40 @@ class LdapUserMixin:
                 jpegPhoto=lambda x: x[0],
                 mailAlias=lambda x: [a.decode("UTF-8") for a in x],
         )
+        user_dict = self.get_user(uid, attrlist=list(transform))
         res = dict()
         for key, t in transform.items():
             res[key] = t(user_dict.get(key, [b""]))
         return res
 
-    def get_user_groups(self, uid):
+    def get_user_groups(self, uid, attrlist=None):
         """
         Get groups where user is a member
 
         Args:
             uid (str): user id
+            attrlist (list): attributes to fetch, all if None
 
         Returns (list):
         """
-        search = f"(&(memberUid={uid})(objectClass=posixGroup))"
-        return transform_ldap_response(self.search_s(self.BASE_DN, ldap.SCOPE_SUBTREE, search))
+        search = and_(eq("objectClass", "posixGroup"), eq("memberUid", uid))
+        return transform_ldap_response(self.search_s(self.BASE_DN, ldap.SCOPE_SUBTREE, str(search), attrlist=attrlist))
 
     def verify_user_password(self, uid, password):
-        user_dict = self.get_user(uid)
-        existing_hashed_password = user_dict["userPassword"][0].decode("ASCII")
-        return check_password(existing_hashed_password, password)
+        """
+        Check password of active user, fetching only the password hash by a base-scope lookup of the user's DN
+
+        Returns (bool): False also if the user doesn't exist or has no password
+        """
+        dn = f"uid={ldap.dn.escape_dn_chars(uid)},{self.ACTIVE_PEOPLE_GROUP}"
+        try:
+            found = self.search_s(dn, ldap.SCOPE_BASE, "(objectClass=inetOrgPerson)", attrlist=["userPassword"])
+        except ldap.NO_SUCH_OBJECT:
+            return False
+        hashes = found[0][1].get("userPassword") if found else None
+        if not hashes:
+            return False
+        return check_password(hashes[0].decode("ASCII"), password)
 
     def _mk_add_user_dict(self, uid, name, surname, password, mail, picture_bytes, mail_aliases):
         mail = mail.encode("ASCII")
@@ -489,7 +1036,8 @@ class LdapUserMixin:
     def user_of_uid_exists(self, uid):
         if self.subobject_exists_at("ou=active,ou=people", "organizationalUnit") == 0:
             raise ConstraintError(f"The people group '{self.ACTIVE_PEOPLE_GROUP}' doesn't exist.")
-        found = self.search_s(f"{self.ACTIVE_PEOPLE_GROUP}", ldap.SCOPE_ONELEVEL, f"(uid={uid})")
+        found = self.search_s(self.ACTIVE_PEOPLE_GROUP, ldap.SCOPE_ONELEVEL, str(eq("uid", uid)),
+                              attrlist=NO_ATTRIBUTES)
         return len(found)
 
     def _extract_attr_from_search_results(self, results, attr):
@@ -503,23 +1051,21 @@ class LdapUserMixin:
 
     def get_uids_member_of_ou(self, ou_name):
         root = f"ou={ou_name},{self.BASE_DN}"
-        search = f"(&(objectClass=posixGroup))"
-        res = self.search_s(root, ldap.SCOPE_SUBTREE, search, attrlist=["memberUid"])
+        res = self.search_s(root, ldap.SCOPE_SUBTREE, str(POSIX_GROUPS), attrlist=["memberUid"])
 
         members = self._extract_attr_from_search_results(res, "memberUid")
         return [u.decode("UTF-8") for u in members]
 
     def get_uids_member_of_group(self, parent_ou_name, group_cn):
         root = f"ou={parent_ou_name},{self.BASE_DN}"
-        search = f"(&(objectClass=posixGroup)(cn={group_cn}))"
-        res = self.search_s(root, ldap.SCOPE_SUBTREE, search, attrlist=["memberUid"])
+        search = and_(POSIX_GROUPS, eq("cn", group_cn))
+        res = self.search_s(root, ldap.SCOPE_SUBTREE, str(search), attrlist=["memberUid"])
 
         members = self._extract_attr_from_search_results(res, "memberUid")
         return [u.decode("UTF-8") for u in members]
 
     def uid_is_member_of_group(self, group_fqdn, uid):
-        search = f"memberUid={uid}"
-        found = self.search_s(group_fqdn, ldap.SCOPE_BASE, f"({search})")
+        found = self.search_s(group_fqdn, ldap.SCOPE_BASE, str(eq("memberUid", uid)), attrlist=NO_ATTRIBUTES)
         return len(found)
 
     def uid_is_member_of_special_group(self, uid, name):
@@ -537,6 +1083,143 @@ class LdapUserMixin:
         modlist = [(ldap.MOD_ADD, "memberUid", [uid.encode("ASCII")])]
         self.modify_s(group_fqdn, modlist)
 
+    def get_existing_uids(self, uids):
+        """
+        Find out which of given uids belong to existing users, using a single search per FILTER_BATCH_SIZE uids
+
+        Args:
+            uids (iterable): user uids to check
+
+        Returns (set): uids of existing users
+        """
+        uids = set(uids)
+        found_uids = set()
+        for chunk in _chunks(sorted(uids), self.FILTER_BATCH_SIZE):
+            search = any_of("uid", chunk)
+            try:
+                found = self.search_s(self.ACTIVE_PEOPLE_GROUP, ldap.SCOPE_ONELEVEL, str(search), attrlist=["uid"])
+            except ldap.NO_SUCH_OBJECT:
+                raise ConstraintError(f"The people group '{self.ACTIVE_PEOPLE_GROUP}' doesn't exist.")
+            found_uids.update(u.decode("UTF-8").lower() for u in self._extract_attr_from_search_results(found, "uid"))
+        return {uid for uid in uids if uid.lower() in found_uids}
+
+    def get_members_of_groups(self, group_fqdns):
+        """
+        Get memberUids of several posix groups, using a single search per FILTER_BATCH_SIZE groups
+
+        Args:
+            group_fqdns (iterable): fqdns of posix groups
+
+        Returns (dict): group fqdn -> set of member uids, raises ConstraintError if any of the groups doesn't exist
+        """
+        wanted = {fqdn.lower(): fqdn for fqdn in group_fqdns}
+        members = dict()
+        rdns = sorted({tuple(ldap.dn.str2dn(fqdn)[0][0][:2]) for fqdn in wanted.values()})
+        for chunk in _chunks(rdns, self.FILTER_BATCH_SIZE):
+            search = and_(POSIX_GROUPS, or_(*(eq(attr, value) for attr, value in chunk)))
+            found = self.search_s(self.BASE_DN, ldap.SCOPE_SUBTREE, str(search), attrlist=["memberUid"])
+            for dn, attrs in found:
+                # the same cn can exist under several ous, referrals come without dn
+                if dn is None or dn.lower() not in wanted:
+                    continue
+                members[wanted[dn.lower()]] = {u.decode("UTF-8") for u in attrs.get("memberUid", [])}
+        missing = set(wanted.values()).difference(members)
+        if missing:
+            raise ConstraintError(f"Group(s) {', '.join(sorted(missing))} don't exist.")
+        return members
+
+    def make_uid_member_of_many(self, uid, group_fqdns):
+        """
+        Make user member of several groups, sending a single modify to every group the user isn't member of yet
+
+        Args:
+            uid (str): user uid
+            group_fqdns (iterable): fqdns of posix groups
+
+        Returns (list): fqdns of groups the user has been added to
+        """
+        members = self.get_members_of_groups(group_fqdns)
+        if not members:
+            return []
+        if not self.get_existing_uids([uid]):
+            msg = f"User of uid '{uid}' doesn't exist, so we can't add it to any group."
+            raise ConstraintError(msg)
+        added = []
+        for group_fqdn, group_members in members.items():
+            if uid in group_members:
+                continue
+            self.modify_s(group_fqdn, [(ldap.MOD_ADD, "memberUid", [uid.encode("ASCII")])])
+            added.append(group_fqdn)
+        return added
+
+    def remove_uid_member_of_many(self, uid, group_fqdns):
+        """
+        Remove user from several groups, sending a single modify to every group the user is member of
+
+        Args:
+            uid (str): user uid
+            group_fqdns (iterable): fqdns of posix groups
+
+        Returns (list): fqdns of groups the user has been removed from
+        """
+        members = self.get_members_of_groups(group_fqdns)
+        groups_to_leave = [group_fqdn for group_fqdn, group_members in members.items() if uid in group_members]
+        if not groups_to_leave:
+            return []
+        if not self.get_existing_uids([uid]):
+            msg = f"User of uid '{uid}' doesn't exist, so we can't add it to any group."
+            raise ConstraintError(msg)
+        for group_fqdn in groups_to_leave:
+            self.modify_s(group_fqdn, [(ldap.MOD_DELETE, "memberUid", [uid.encode("ASCII")])])
+        return groups_to_leave
+
+    def add_group_members(self, group_fqdn, uids, ignore_missing=False):
+        """
+        Make users members of a group with a single modify carrying all new memberUids
+
+        Args:
+            group_fqdn (str): fqdn of posix group
+            uids (iterable): uids of users to add
+            ignore_missing (bool): skip uids of non-existing users instead of raising ConstraintError
+
+        Returns (membership_change):
+        """
+        return self._update_group_members(group_fqdn, uids, remove_others=False, ignore_missing=ignore_missing)
+
+    def set_group_members(self, group_fqdn, uids, ignore_missing=False):
+        """
+        Make exactly the given users members of a group with a single modify, removing everybody else
+
+        Args:
+            group_fqdn (str): fqdn of posix group
+            uids (iterable): uids of intended members
+            ignore_missing (bool): skip uids of non-existing users instead of raising ConstraintError
+
+        Returns (membership_change):
+        """
+        return self._update_group_members(group_fqdn, uids, remove_others=True, ignore_missing=ignore_missing)
+
+    def _update_group_members(self, group_fqdn, uids, remove_others, ignore_missing):
+        uids = set(uids)
+        current_members = self.get_members_of_groups([group_fqdn])[group_fqdn]
+
+        to_add = uids.difference(current_members)
+        missing = to_add.difference(self.get_existing_uids(to_add)) if to_add else set()
+        if missing and not ignore_missing:
+            msg = f"Users of uids {', '.join(sorted(missing))} don't exist, so we can't add them to any group."
+            raise ConstraintError(msg)
+        to_add.difference_update(missing)
+        to_remove = current_members.difference(uids) if remove_others else set()
+
+        modlist = []
+        if to_add:
+            modlist.append((ldap.MOD_ADD, "memberUid", [u.encode("ASCII") for u in sorted(to_add)]))
+        if to_remove:
+            modlist.append((ldap.MOD_DELETE, "memberUid", [u.encode("ASCII") for u in sorted(to_remove)]))
+        if modlist:
+            self.modify_s(group_fqdn, modlist)
+        return membership_change(added=to_add, removed=to_remove, missing=missing)
+
     def make_uid_member_of_division(self, uid, name):
         group_fqdn = f"cn={name},{self.DIVISIONS_GROUP}"
         return self.make_uid_member_of(uid, group_fqdn)
@@ -680,8 +1363,37 @@ class OrganizationalUnitMixin(object):
         if not self.org_unit_exists(name):
             self.create_org_unit(name)
 
+    def ensure_org_units_exist(self, names, base=None):
+        """
+        Create those of organizational units that don't exist, finding existing ones by a single search
+        and sending all adds in a pipeline
+
+        Args:
+            names (iterable): names of organizational units
+            base (str): dn the units are directly below, the base DN if None
+
+        Returns (list): names of units created by this call
+        """
+        if base is None:
+            base = self.BASE_DN
+        found = self.search_s(base, ldap.SCOPE_ONELEVEL, "(objectClass=organizationalUnit)", attrlist=["ou"])
+        existing = {get_str(ou).lower() for _, attrs in found if attrs for ou in attrs.get("ou", [])}
+        missing = [name for name in dict.fromkeys(names) if name.lower() not in existing]
+        modlist = ldap.modlist.addModlist(dict(objectClass=(b"organizationalUnit", b"top")))
+        created = []
+        with self.pipeline() as pipeline:
+            for name in missing:
+                pipeline.add(f"ou={name},{base}", modlist)
+            for name, result in zip(missing, pipeline.results()):
+                if result.error is None:
+                    created.append(name)
+                # created concurrently by someone else in the meantime is fine
+                elif not isinstance(result.error, ldap.ALREADY_EXISTS):
+                    raise result.error
+        return created
+
     def get_org_unit(self, name):
-        return self.get_objects(search=f'ou={name}')
+        return self.get_objects(search=eq("ou", name))
 
     def org_unit_exists(self, name):
         return self.subobject_exists_at(f"ou={name}", "organizationalUnit")
@@ -690,9 +1402,19 @@ class OrganizationalUnitMixin(object):
 class LdapGroupMixin(object):
 
     def create_group(self, name, organizational_unit, description=None):
+        """
+        Create group below organizational unit, creating the unit first if it doesn't exist.
+        Both are checked by a single search of the unit's children.
+        """
         org_unit_dn = f"ou={organizational_unit}"
-        self.ensure_org_unit_exists(organizational_unit)
-        if self.group_exists(name, organizational_unit):
+        search = and_(POSIX_GROUPS, eq("cn", name))
+        try:
+            found = self.search_s(f"{org_unit_dn},{self.BASE_DN}", ldap.SCOPE_ONELEVEL, str(search),
+                                  attrlist=NO_ATTRIBUTES)
+        except ldap.NO_SUCH_OBJECT:
+            self.create_org_unit(organizational_unit)
+            found = []
+        if found:
             raise ConstraintError("Group with such name under this organizational unit already exists")
         dic = self.create_group_dict(f"{name}")
         if description:
@@ -706,27 +1428,106 @@ class LdapGroupMixin(object):
             if "already exists" not in str(exc):
                 raise
 
-    def get_groups(self, search=None, organizational_unit=None):
+    def ensure_structure(self, org_units=(), groups=()):
+        """
+        Create those of organizational units just below the base DN and of groups below them that don't exist.
+
+        Existing ones are found by a single search, one more per FILTER_BATCH_SIZE groups, and the missing ones
+        are added in pipelines, units before groups as the groups are added below them.
+
+        Args:
+            org_units (iterable): names of organizational units
+            groups (iterable): (name, organizational unit, description) tuples, their units are ensured as well
+
+        Returns (dict): DNs relative to the base DN, e.g. 'cn=pl,ou=franchises', of "created" and already "existing"
+            objects, "failed" maps relative DN to error
+        """
+        groups = list(groups)
+        org_units = list(dict.fromkeys(list(org_units) + [org_unit for _, org_unit, _ in groups]))
+        report = dict(created=[], existing=[], failed=dict())
+        if not org_units:
+            return report
+
+        base = _normalize_dn(self.BASE_DN)
+        existing = set()  # lowercase relative DNs
+        name_filters = [any_of("cn", [name for name, _, _ in chunk])
+                        for chunk in _chunks(groups, self.FILTER_BATCH_SIZE)]
+        for i, names in enumerate(name_filters or [None]):
+            search = or_(ORG_UNITS if i == 0 else None, and_(POSIX_GROUPS, names) if names else None)
+            for dn, _ in self.search_s(self.BASE_DN, ldap.SCOPE_SUBTREE, str(search), attrlist=NO_ATTRIBUTES):
+                if dn is not None and _normalize_dn(dn).endswith("," + base):
+                    existing.add(_normalize_dn(dn)[:-len(base) - 1])
+
+        def add_missing(pipeline, entries):
+            """ Add entries of (relative DN, attributes) that don't exist, recording outcomes in report """
+            missing = []
+            for relative_dn, attrs in entries:
+                if relative_dn.lower() in existing:
+                    report["existing"].append(relative_dn)
+                else:
+                    missing.append(relative_dn)
+                    existing.add(relative_dn.lower())
+                    pipeline.add(f"{relative_dn},{self.BASE_DN}", ldap.modlist.addModlist(attrs))
+            for relative_dn, result in zip(missing, pipeline.results()):
+                if result.error is None:
+                    report["created"].append(relative_dn)
+                elif isinstance(result.error, ldap.ALREADY_EXISTS):
+                    report["existing"].append(relative_dn)
+                else:
+                    report["failed"][relative_dn] = ldap_error_message(result.error)
+
+        with self.pipeline() as pipeline:
+            add_missing(pipeline, [(f"ou={name}", dict(objectClass=(b"organizationalUnit", b"top")))
+                                   for name in org_units])
+            group_entries = []
+            for name, org_unit, description in groups:
+                dic = self.create_group_dict(name)
+                if description:
+                    dic["description"] = description.encode("utf-8") if isinstance(description, str) else description
+                group_entries.append((f"cn={name},ou={org_unit}", dic))
+            add_missing(pipeline, group_entries)
+        return report
+
+    def get_groups(self, search=None, organizational_unit=None, attrlist=None):
         """
         Get objects with object class "posixGroup"
 
         Args:
-            search (str): search filter
+            search (Filter or str): search filter
+            attrlist (list): attributes to fetch, all if None
 
         Returns (list):
         """
         relative_pos = f"ou={organizational_unit}" if organizational_unit else None
-        return self.get_objects(search=search, relative_pos=relative_pos, obj_class='posixGroup')
+        return self.get_objects(search=search, relative_pos=relative_pos, obj_class='posixGroup', attrlist=attrlist)
+
+    def iter_groups(self, search=None, organizational_unit=None, page_size=None, attrlist=None):
+        """
+        Iterate over objects with object class "posixGroup", fetched page by page
+
+        Args:
+            search (Filter or str): search filter
+            organizational_unit (str): name of organizational unit to search in
+            page_size (int): how many groups to request per page
+            attrlist (list): attributes to fetch, all if None
+
+        Returns (generator):
+        """
+        relative_pos = f"ou={organizational_unit}" if organizational_unit else None
+        return self.iter_objects(search=search, relative_pos=relative_pos, obj_class='posixGroup',
+                                 page_size=page_size, attrlist=attrlist)
 
-    def get_group(self, cname, organizational_unit):
+    def get_group(self, cname, organizational_unit, attrlist=None):
         """
         Get group by cname
         Args:
             cname (str): cname of a group
+            attrlist (list): attributes to fetch, all if None
 
         Returns:
         """
-        return get_single_object(self.get_groups(f"cn={cname}", organizational_unit=organizational_unit))
+        return get_single_object(self.get_groups(eq("cn", cname), organizational_unit=organizational_unit,
+                                                 attrlist=attrlist))
 
     def create_group_dict(self, name):
         dic = dict(
@@ -772,11 +1573,11 @@ class LdapSpecialMixin(object):
     The group's gidNumber is not important.
     """
 
-    def get_specials(self, search=None):
+    def get_specials(self, search=None, attrlist=None):
         """ Get objects (of posixGroup class) with organizational unit 'special' by given search """
-        return self.get_groups(search=search, organizational_unit=self.SPECIAL_GROUP_NAME)
+        return self.get_groups(search=search, organizational_unit=self.SPECIAL_GROUP_NAME, attrlist=attrlist)
 
-    def get_special(self, machine_name):
+    def get_special(self, machine_name, attrlist=None):
         """
         Get special by cname
 
@@ -786,7 +1587,7 @@ class LdapSpecialMixin(object):
         Returns:
 
         """
-        return get_single_object(self.get_specials(f'cn={machine_name}'))
+        return get_single_object(self.get_specials(eq("cn", machine_name), attrlist=attrlist))
 
     def create_special(self, machine_name, display_name=None):
         """
@@ -830,11 +1631,11 @@ class LdapDdeaMixin(LdapPostfixUserMixin):
     The group's gidNumber is not important.
     """
 
-    def get_ddeas(self, search=None):
+    def get_ddeas(self, search=None, attrlist=None):
         """ Get objects (of posixGroup class) with organizational unit 'ddea' by given search """
-        return self.get_groups(search=search, organizational_unit=self.DDEA_GROUP_NAME)
+        return self.get_groups(search=search, organizational_unit=self.DDEA_GROUP_NAME, attrlist=attrlist)
 
-    def get_ddea(self, machine_name):
+    def get_ddea(self, machine_name, attrlist=None):
         """
         Get ddea by cname
 
@@ -844,7 +1645,7 @@ class LdapDdeaMixin(LdapPostfixUserMixin):
         Returns:
 
         """
-        return get_single_object(self.get_ddeas(f'cn={machine_name}'))
+        return get_single_object(self.get_ddeas(eq("cn", machine_name), attrlist=attrlist))
 
     def create_ddea(self, machine_name, display_name=None):
         """
@@ -888,11 +1689,11 @@ class LdapCdeaMixin(object):
     The group's gidNumber is not important.
     """
 
-    def get_cdeas(self, search=None):
+    def get_cdeas(self, search=None, attrlist=None):
         """ Get objects (of posixGroup class) with organizational unit 'cdea' by given search """
-        return self.get_groups(search=search, organizational_unit=self.CDEA_GROUP_NAME)
+        return self.get_groups(search=search, organizational_unit=self.CDEA_GROUP_NAME, attrlist=attrlist)
 
-    def get_cdea(self, machine_name):
+    def get_cdea(self, machine_name, attrlist=None):
         """
         Get cdea by cname
 
@@ -902,7 +1703,7 @@ class LdapCdeaMixin(object):
         Returns:
 
         """
-        return get_single_object(self.get_cdeas(f'cn={machine_name}'))
+        return get_single_object(self.get_cdeas(eq("cn", machine_name), attrlist=attrlist))
 
     def create_cdea(self, machine_name, display_name=None):
         """
@@ -946,11 +1747,11 @@ class LdapLmMixin(object):
     The group's gidNumber is not important.
     """
 
-    def get_lms(self, search=None):
+    def get_lms(self, search=None, attrlist=None):
         """ Get objects (of posixGroup class) with organizational unit 'lm' by given search """
-        return self.get_groups(search=search, organizational_unit=self.LM_GROUP_NAME)
+        return self.get_groups(search=search, organizational_unit=self.LM_GROUP_NAME, attrlist=attrlist)
 
-    def get_lm(self, machine_name):
+    def get_lm(self, machine_name, attrlist=None):
         """
         Get lm by cname
 
@@ -960,7 +1761,7 @@ class LdapLmMixin(object):
         Returns:
 
         """
-        return get_single_object(self.get_lms(f'cn={machine_name}'))
+        return get_single_object(self.get_lms(eq("cn", machine_name), attrlist=attrlist))
 
     def create_lm(self, machine_name, display_name=None):
         """
@@ -1003,11 +1804,11 @@ class LdapDivisionMixin(object):
     The group's gidNumber is not important.
     """
 
-    def get_divisions(self, search=None):
+    def get_divisions(self, search=None, attrlist=None):
         """ Get objects (of posixGroup class) with organizational unit 'divisions' by given search """
-        return self.get_groups(search=search, organizational_unit=self.DIVISIONS_GROUP_NAME)
+        return self.get_groups(search=search, organizational_unit=self.DIVISIONS_GROUP_NAME, attrlist=attrlist)
 
-    def get_division(self, machine_name):
+    def get_division(self, machine_name, attrlist=None):
         """
         Get division by cname
 
@@ -1017,7 +1818,7 @@ class LdapDivisionMixin(object):
         Returns:
 
         """
-        return get_single_object(self.get_divisions(f'cn={machine_name}'))
+        return get_single_object(self.get_divisions(eq("cn", machine_name), attrlist=attrlist))
 
     def create_division(self, machine_name, display_name=None):
         """
@@ -1056,10 +1857,10 @@ class LdapFranchiseMixin(object):
     Franchise code is `<country_code>_<something>` where country_code is ISO3166-1-Alpha-2 code
     """
 
-    def get_franchises(self, search=None):
-        return self.get_groups(search=search, organizational_unit=self.FRANCHISES_GROUP_NAME)
+    def get_franchises(self, search=None, attrlist=None):
+        return self.get_groups(search=search, organizational_unit=self.FRANCHISES_GROUP_NAME, attrlist=attrlist)
 
-    def get_franchise(self, code):
+    def get_franchise(self, code, attrlist=None):
         """
         Get franchise by code
         Args:
@@ -1067,7 +1868,7 @@ class LdapFranchiseMixin(object):
 
         Returns (dict): franchise data dict or raise error if not found or found more than 1 franchise
         """
-        return get_single_object(self.get_franchises(f'cn={code}'))
+        return get_single_object(self.get_franchises(eq("cn", code), attrlist=attrlist))
 
     def create_franchise(self, machine_name, display_name=None):
         """
@@ -1130,11 +1931,11 @@ class LdapTeamMixin(object):
     The group's gidNumber is not important.
     """
 
-    def get_teams(self, search=None):
+    def get_teams(self, search=None, attrlist=None):
         """ Get objects (of posixGroup class) with organizational unit 'teams' by given search """
-        return self.get_groups(search=search, organizational_unit=self.TEAMS_GROUP_NAME)
+        return self.get_groups(search=search, organizational_unit=self.TEAMS_GROUP_NAME, attrlist=attrlist)
 
-    def get_team(self, name):
+    def get_team(self, name, attrlist=None):
         """
         Get team by cname
 
@@ -1144,7 +1945,7 @@ class LdapTeamMixin(object):
         Returns:
 
         """
-        return get_single_object(self.get_teams(f'cn={name}'))
+        return get_single_object(self.get_teams(eq("cn", name), attrlist=attrlist))
 
     def create_team(self, machine_name, display_name=None):
         """
@@ -1160,6 +1961,47 @@ class LdapTeamMixin(object):
         display_name_bytes = display_name.encode('utf-8') if isinstance(display_name, str) else display_name
         return self.create_group(name=machine_name, organizational_unit="teams", description=display_name_bytes)
 
+    def ensure_team_exists(self, machine_name, display_name=None):
+        """ Create team unless it already exists """
+        display_name_bytes = display_name.encode('utf-8') if isinstance(display_name, str) else display_name
+        return self.ensure_group_exists(machine_name, self.TEAMS_GROUP_NAME, description=display_name_bytes)
+
+    def ensure_teams_exist(self, teams):
+        """
+        Create those of teams that don't exist yet.
+
+        The teams organizational unit is checked once, existing teams are fetched by a single search
+        and adds of the missing ones are pipelined.
+
+        Args:
+            teams (iterable): (machine name, display name) tuples
+
+        Returns (dict): machine names of "created" and already "existing" teams, "failed" maps machine name to error
+        """
+        teams = dict(teams)
+        self.ensure_org_units_exist([self.TEAMS_GROUP_NAME])
+        existing = {get_str(team["cn"][0]).lower() for team in self.get_teams(attrlist=["cn"])}
+        summary = dict(created=[], existing=[], failed=dict())
+        sent = []
+        with self.pipeline() as pipeline:
+            for machine_name, display_name in teams.items():
+                if machine_name.lower() in existing:
+                    summary["existing"].append(machine_name)
+                    continue
+                dic = self.create_group_dict(machine_name)
+                if display_name:
+                    dic["description"] = display_name.encode("utf-8") if isinstance(display_name, str) else display_name
+                pipeline.add(f"cn={machine_name},{self.TEAMS_GROUP}", ldap.modlist.addModlist(dic))
+                sent.append(machine_name)
+            for machine_name, result in zip(sent, pipeline.results()):
+                if result.error is None:
+                    summary["created"].append(machine_name)
+                elif isinstance(result.error, ldap.ALREADY_EXISTS):
+                    summary["existing"].append(machine_name)
+                else:
+                    summary["failed"][machine_name] = ldap_error_message(result.error)
+        return summary
+
     def delete_team(self, machine_name):
         """
         Delete team by cname
@@ -1216,22 +2058,107 @@ class LdapTeamMixin(object):
 
 
 def ensure_org_sanity(edap, source=None):
+    """
+    Create organizational units of the app and divisions and franchises of source that don't exist,
+    see Edap.ensure_structure
+
+    Args:
+        edap (Edap): edap to create them with
+        source (dict): "divisions" and "franchises" lists of machine names
+
+    Returns (dict): report of ensure_structure
+    """
     if source is None:
         source = dict()
 
-    edap.ensure_org_unit_exists(edap.FRANCHISES_GROUP_NAME)
-    edap.ensure_org_unit_exists(edap.DIVISIONS_GROUP_NAME)
-    edap.ensure_org_unit_exists(edap.SERVICES_GROUP_NAME)
-    edap.ensure_org_unit_exists(edap.TEAMS_GROUP_NAME)
-    edap.ensure_org_unit_exists("people")
+    groups = [(name, edap.DIVISIONS_GROUP_NAME, None) for name in source.get("divisions", [])]
+    groups += [(code, edap.FRANCHISES_GROUP_NAME, edap.label_franchise(code))
+               for code in source.get("franchises", [])]
+    return edap.ensure_structure(org_units=[
+        edap.FRANCHISES_GROUP_NAME,
+        edap.DIVISIONS_GROUP_NAME,
+        edap.SERVICES_GROUP_NAME,
+        edap.TEAMS_GROUP_NAME,
+        "people",
+
+        edap.DDEA_GROUP_NAME,
+        edap.CDEA_GROUP_NAME,
+        edap.LM_GROUP_NAME,
+        edap.SPECIAL_GROUP_NAME,
+    ], groups=groups)
+
+
+def _index_by_cn(groups):
+    """ Map lowercase cn to group, groups of cn shared by several groups are left out as ambiguous """
+    index = dict()
+    ambiguous = set()
+    for group in groups:
+        cn = get_str(group["cn"][0]).lower()
+        if cn in index:
+            ambiguous.add(cn)
+        index[cn] = group
+    for cn in ambiguous:
+        del index[cn]
+    return index
+
+
+def get_teams_consistency(edap, ignore=()):
+    """
+    Compare teams with franchises and divisions, loading each of them by a single search.
 
-    edap.ensure_org_unit_exists(edap.DDEA_GROUP_NAME)
-    edap.ensure_org_unit_exists(edap.CDEA_GROUP_NAME)
-    edap.ensure_org_unit_exists(edap.LM_GROUP_NAME)
-    edap.ensure_org_unit_exists(edap.SPECIAL_GROUP_NAME)
+    Team cn must be constructed from existing franchise and division cns <franchise_cn>-<division_cn>
+    and team description from their descriptions, see make_team_machine_name and make_team_display_name.
 
-    edap.create_all_divisions(source.get("divisions", []))
-    edap.create_all_franchises(source.get("franchises", []))
+    Args:
+        edap (Edap): edap to search in
+        ignore (iterable): cns of teams that don't belong to any franchise and division, e.g. everybody
+
+    Returns (dict):
+        "orphans": teams whose cn doesn't correspond to an existing franchise and division,
+        "mismatched": teams of a franchise and division with a different description,
+        "missing": (machine name, display name) of franchise and division combinations without a team,
+        "timings": seconds spent by "load" and "compute"
+    """
+    start = time.monotonic()
+    attrlist = ["cn", "description"]
+    franchises = _index_by_cn(edap.get_franchises(attrlist=attrlist))
+    divisions = _index_by_cn(edap.get_divisions(attrlist=attrlist))
+    teams = edap.get_teams(attrlist=attrlist)
+    loaded = time.monotonic()
+
+    ignore = {cn.lower() for cn in ignore}
+    orphans = []
+    mismatched = []
+    present = set()
+    for team in teams:
+        machine_name = get_str(team["cn"][0])
+        if machine_name.lower() in ignore:
+            continue
+        franchise_name, _, division_name = machine_name.lower().partition("-")
+        franchise, division = franchises.get(franchise_name), divisions.get(division_name)
+        if franchise is None or division is None:
+            orphans.append(team)
+            continue
+        present.add((franchise_name, division_name))
+        expected_display_name = edap.make_team_display_name(
+            get_str(franchise.get("description", [b""])[0]), get_str(division.get("description", [b""])[0]))
+        if get_str(team.get("description", [b""])[0]) != expected_display_name:
+            mismatched.append(team)
+
+    missing = [
+        (edap.make_team_machine_name(franchise["cn"][0], division["cn"][0]),
+         edap.make_team_display_name(get_str(franchise.get("description", [b""])[0]),
+                                     get_str(division.get("description", [b""])[0])))
+        for franchise_name, franchise in franchises.items()
+        for division_name, division in divisions.items()
+        if (franchise_name, division_name) not in present
+    ]
+    return dict(
+        orphans=orphans,
+        mismatched=mismatched,
+        missing=missing,
+        timings=dict(load=round(loaded - start, 3), compute=round(time.monotonic() - loaded, 3)),
+    )
 
 
 def get_not_matching_teams_by_cn(edap):
@@ -1241,18 +2168,7 @@ def get_not_matching_teams_by_cn(edap):
     Team cn must be constructed from existing division and franchise cns <franchise_cn>_<division_cn>
     For example if there is PL-PUB team, then there needs to be a country PL and a division PUB
     """
-    not_corresponding_teams = []
-    teams = edap.get_teams()
-    for team in teams:
-
-        team_machine_name = team['cn'][0]
-        try:
-            edap.get_team_component_units(team_machine_name)
-        except (ObjectDoesNotExist, MultipleObjectsFound):
-            not_corresponding_teams.append(team)
-            continue
-
-    return not_corresponding_teams
+    return get_teams_consistency(edap)["orphans"]
 
 
 def get_not_matching_teams_by_description(edap):
@@ -1263,23 +2179,13 @@ def get_not_matching_teams_by_description(edap):
     <franchise_description>_<division_description>
     For example if there is Poland and Publishing, it should be 'Poland Publishing' team, but not 'Polish Publishing'
     """
-    not_corresponding_teams = []
-    teams = edap.get_teams()
-    for team in teams:
-        team_machine_name = team['cn'][0]
-        team_display_name = get_str(team['description'][0])
+    consistency = get_teams_consistency(edap)
+    return consistency["orphans"] + consistency["mismatched"]
 
-        try:
-            franchise, division = edap.get_team_component_units(team_machine_name)
-        except (ObjectDoesNotExist, MultipleObjectsFound):
-            not_corresponding_teams.append(team)
-            continue
 
-        expected_display_name = edap.make_team_display_name(franchise['description'][0], division['description'][0])
-        if team_display_name != expected_display_name:
-            not_corresponding_teams.append(team)
-
-    return not_corresponding_teams
+def make_base_dn(domain):
+    """ Compose base DN from a domain name, e.g. dc=example,dc=com from example.com """
+    return ",".join(f"dc={c}" for c in domain.split("."))
 
 
 def update_parser(parser=None):
@@ -1295,17 +2201,36 @@ class Edap(LdapObjectsMixin, LdapGroupMixin, OrganizationalUnitMixin,
            LdapTeamMixin, LdapFranchiseMixin, LdapDivisionMixin, LdapServiceMixin, LdapSpecialMixin,
            LdapDdeaMixin, LdapCdeaMixin, LdapLmMixin):
 
-    def __init__(self, hostname, admin_cn, password, domain=None):
+    def __init__(self, hostname, admin_cn, password, domain=None, pool=None, page_size=None):
+        """
+        Args:
+            hostname (str): LDAP server hostname
+            admin_cn (str): cn of the admin to bind as, relative to the base DN
+            password (str): admin password
+            domain (str): domain the base DN is derived from
+            pool (LdapConnectionPool): if given, a bound connection is checked out of it
+                instead of connecting and binding, call release() to return it
+            page_size (int): entries per page of paged searches, PAGE_SIZE if not given
+        """
         if domain is None:
             domain = "example.com"
-        domain_components = domain.split(".")
-        basedn_components = [f"dc={c}" for c in domain_components]
-        self.BASE_DN = ",".join(basedn_components)
+        self.BASE_DN = make_base_dn(domain)
 
         self.domain = domain
-        admin_dn = f"{admin_cn},{self.BASE_DN}"
-        self.ldap = ldap.initialize(f"ldap://{hostname}")
-        self.ldap.bind_s(admin_dn, password)
+        self.pool = pool
+        self.page_size = page_size or self.PAGE_SIZE
+        # callables notified with the dn of every object this edap adds, modifies or deletes
+        self.write_listeners = []
+        # callables notified of every call to the server: listener(method_name, args, seconds, result, error)
+        self.call_listeners = []
+        # SearchCache of search_s results, see enable_search_cache
+        self.search_cache = None
+        if pool is None:
+            admin_dn = f"{admin_cn},{self.BASE_DN}"
+            self.ldap = ldap.initialize(f"ldap://{hostname}")
+            self.ldap.bind_s(admin_dn, password)
+        else:
+            self.ldap = pool.checkout()
 
         self.PEOPLE_GROUP = f"ou=people,{self.BASE_DN}"
         self.ACTIVE_PEOPLE_GROUP = f"ou=active,{self.PEOPLE_GROUP}"
@@ -1342,20 +2267,94 @@ class Edap(LdapObjectsMixin, LdapGroupMixin, OrganizationalUnitMixin,
         self.SERVICES_OU = f"ou={self.SERVICES_GROUP_NAME}"
         self.SERVICES_GROUP = f"{self.SERVICES_OU},{self.BASE_DN}"
 
-    def add_s(self, *args, **kwargs):
-        return self.ldap.add_s(*args, **kwargs)
+    def _call(self, method_name, *args, **kwargs):
+        """ Call method of the ldap connection, reconnecting once if a pooled connection turns out to be dead """
+        def call():
+            try:
+                return getattr(self.ldap, method_name)(*args, **kwargs)
+            except ldap.SERVER_DOWN:
+                if self.pool is None:
+                    raise
+                dead, self.ldap = self.ldap, None
+                # replace() gives the slot of the dead connection up if it can't reconnect, there's nothing to release
+                self.ldap = self.pool.replace(dead)
+                return getattr(self.ldap, method_name)(*args, **kwargs)
+        return self._observed(method_name, args, call)
+
+    def _observed(self, method_name, args, call):
+        """ Return result of call(), notifying call listeners of how long it took and what it returned """
+        if not self.call_listeners:
+            return call()
+        start = time.perf_counter()
+        result = error = None
+        try:
+            result = call()
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            for listener in self.call_listeners:
+                listener(method_name, args, seconds, result, error)
+
+    def _notify_write(self, dn):
+        for listener in self.write_listeners:
+            listener(dn)
+
+    def add_s(self, dn, *args, **kwargs):
+        res = self._call("add_s", dn, *args, **kwargs)
+        self._notify_write(dn)
+        return res
 
-    def modify_s(self, *args, **kwargs):
-        return self.ldap.modify_s(*args, **kwargs)
+    def modify_s(self, dn, *args, **kwargs):
+        res = self._call("modify_s", dn, *args, **kwargs)
+        self._notify_write(dn)
+        return res
 
     def search_s(self, *args, **kwargs):
-        return self.ldap.search_s(*args, **kwargs)
+        if self.search_cache is None:
+            return self._call("search_s", *args, **kwargs)
+        return self.search_cache.search(lambda: self._call("search_s", *args, **kwargs), *args, **kwargs)
+
+    def enable_search_cache(self, maxsize=1000):
+        """
+        Send identical search_s calls only once, until this edap writes an object they may include.
+        Meant for edaps living as long as one request, as writes of others are not seen.
+
+        Args:
+            maxsize (int): max number of cached results, the oldest are dropped
+        """
+        self.search_cache = SearchCache(maxsize=maxsize)
+        self.write_listeners.append(self.search_cache.invalidate)
+
+    def search_ext(self, *args, **kwargs):
+        return self._call("search_ext", *args, **kwargs)
+
+    def result3(self, *args, **kwargs):
+        return self._observed("result3", args, lambda: self.ldap.result3(*args, **kwargs))
 
     def unbind_s(self):
         return self.ldap.unbind_s()
 
-    def delete_s(self, *args, **kwargs):
-        return self.ldap.delete_s(*args, **kwargs)
+    def delete_s(self, dn, *args, **kwargs):
+        res = self._call("delete_s", dn, *args, **kwargs)
+        self._notify_write(dn)
+        return res
+
+    def pipeline(self):
+        """ Get LdapPipeline to send several write operations on this edap's connection without waiting for replies """
+        return LdapPipeline(self)
+
+    def release(self):
+        """ Return the connection to the pool it came from, or unbind it if it isn't pooled """
+        if self.ldap is None:
+            return
+        if self.pool is None:
+            self.unbind_s()
+        else:
+            self.pool.checkin(self.ldap)
+        self.ldap = None
 
 
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+r"""
+Building LDAP search filters out of values, instead of formatting them into strings
+
+Values are escaped as RFC 4515 requires, so that user input can't add wildcards or change the structure of a filter.
+Filters are normalized as they are built: nested AND/OR are flattened, duplicates dropped and the parts sorted by
+how well the server can use an index for them - equality, prefix, presence and only then substring and composite
+parts - so that the same search always compiles to the same string. Compiled strings are cached.
+
+    >>> str(and_(contains("sn", "ov"), eq("objectClass", "inetOrgPerson"), prefix("uid", "a*")))
+    '(&(objectClass=inetOrgPerson)(uid=a\\2a*)(sn=*ov*))'
+"""
+import collections
+import functools
+import re
+
+import ldap.filter
+
+EQUAL = "="
+PREFIX = "prefix"
+PRESENT = "present"
+SUBSTRING = "substring"
+AND = "&"
+OR = "|"
+NOT = "!"
+RAW = "raw"
+
+# order of parts of AND/OR, by how well the server can use an index for them
+_RANK = {EQUAL: 0, PREFIX: 1, PRESENT: 2, SUBSTRING: 3}
+
+_ESCAPED_RE = re.compile(r"\\([0-9a-fA-F]{2})")
+
+
+class Filter(collections.namedtuple("Filter", ("op", "attr", "value", "children"))):
+    """
+    Node of a search filter: a comparison of attr with value, a composite of children or a raw filter string in value.
+    Nodes are hashable and compare equal if they compile to the same filter.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return compile_filter(self)
+
+    def __and__(self, other):
+        return and_(self, other)
+
+    def __or__(self, other):
+        return or_(self, other)
+
+    def __invert__(self):
+        return not_(self)
+
+
+def _value(value):
+    return value.decode("UTF-8") if isinstance(value, bytes) else str(value)
+
+
+def eq(attr, value):
+    """ attr equal to value, e.g. eq('uid', 'alice') -> '(uid=alice)' """
+    return Filter(EQUAL, attr, _value(value), ())
+
+
+def prefix(attr, value):
+    """ attr starting with value, e.g. prefix('description', 'Pol') -> '(description=Pol*)', presence if empty """
+    value = _value(value)
+    return Filter(PREFIX, attr, value, ()) if value else present(attr)
+
+
+def contains(attr, value):
+    """ attr containing value, e.g. contains('sn', 'ov') -> '(sn=*ov*)', presence if empty """
+    value = _value(value)
+    return Filter(SUBSTRING, attr, value, ()) if value else present(attr)
+
+
+def present(attr):
+    """ attr having any value, e.g. present('mail') -> '(mail=*)' """
+    return Filter(PRESENT, attr, None, ())
+
+
+def raw(search):
+    """ Filter given as string, e.g. by callers still passing 'cn=pl', it's used as it is """
+    return Filter(RAW, None, search if search.startswith("(") else f"({search})", ())
+
+
+def to_filter(search):
+    """
+    Make filter out of a search given either as Filter or as string
+
+    Args:
+        search (Filter or str): search filter, strings are taken as already escaped
+
+    Returns (Filter): filter, None if there is nothing to filter by
+    """
+    if search is None or isinstance(search, Filter):
+        return search
+    return raw(search) if search else None
+
+
+def _composite(op, parts):
+    children = []
+    for part in map(to_filter, parts):
+        if part is None:
+            continue
+        for child in part.children if part.op == op else (part,):
+            if child not in children:
+                children.append(child)
+    if len(children) < 2:
+        return children[0] if children else None
+    children.sort(key=lambda child: _RANK.get(child.op, len(_RANK)))
+    return Filter(op, None, None, tuple(children))
+
+
+def and_(*parts):
+    """ All of parts matching, None parts are left out and a single part is returned as it is """
+    return _composite(AND, parts)
+
+
+def or_(*parts):
+    """ Any of parts matching, None parts are left out and a single part is returned as it is """
+    return _composite(OR, parts)
+
+
+def not_(part):
+    """ part not matching, double negation is removed """
+    part = to_filter(part)
+    return part.children[0] if part.op == NOT else Filter(NOT, None, None, (part,))
+
+
+def any_of(attr, values):
+    """ attr equal to any of values, e.g. any_of('uid', ['a', 'b']) -> '(|(uid=a)(uid=b))' """
+    return or_(*(eq(attr, value) for value in values))
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_filter(search):
+    """
+    Compile filter to the string sent to the server
+
+    Args:
+        search (Filter): search filter
+
+    Returns (str): search filter string
+    """
+    if search.op == RAW:
+        return search.value
+    if search.op in (AND, OR, NOT):
+        return "({}{})".format(search.op, "".join(compile_filter(child) for child in search.children))
+    if search.op == PRESENT:
+        return f"({search.attr}=*)"
+    value = ldap.filter.escape_filter_chars(search.value)
+    if search.op == PREFIX:
+        return f"({search.attr}={value}*)"
+    if search.op == SUBSTRING:
+        return f"({search.attr}=*{value}*)"
+    return f"({search.attr}={value})"
+
+
+def unescape_value(value):
+    """ Reverse escaping of a filter value, e.g. 'a\\2ab' -> 'a*b' """
+    return _ESCAPED_RE.sub(lambda match: chr(int(match.group(1), 16)), value)
@@ -0,0 +1,7 @@
+from . import api
+
+
+def initialize_module(app):
+    from . import queue
+    queue.init_queue(app)
+    app.before_request(queue.recover_jobs)
@@ -0,0 +1,42 @@
+from flask import Blueprint, jsonify, request
+from flask.views import MethodView
+
+from .. import utils
+from . import queue
+
+blueprint = Blueprint('jobs_api', __name__, url_prefix='/api/jobs')
+blueprint.json_encoder = utils.EncoderWithBytes
+
+
+class JobViewSet(MethodView):
+
+    @utils.authorize_only_hr_admins()
+    def get(self, job_id):
+        """ Status of a job and its steps """
+        job = queue.job_queue.get(job_id)
+        if job is None:
+            return jsonify({'message': 'Job does not exist'}), 404
+        return jsonify(job)
+
+
+class JobRetryViewSet(MethodView):
+
+    @utils.authorize_only_hr_admins()
+    def post(self, job_id):
+        """
+        Retry failed steps of a job, or only the step given in json body as {"step": <name>}.
+        Creating a chat account needs the password of the user again, given as {"password": <password>}.
+        """
+        data = request.get_json(silent=True) or {}
+        step = data.get('step')
+        secrets = {'password': data['password']} if data.get('password') else None
+        job = queue.job_queue.get(job_id)
+        if job is None:
+            return jsonify({'message': 'Job does not exist'}), 404
+        if job['status'] != queue.STATUS_FAILED:
+            return jsonify({'message': f"Only failed jobs can be retried, the job is {job['status']}"}), 409
+        return jsonify(queue.job_queue.retry(job_id, step=step, secrets=secrets)), 202
+
+
+blueprint.add_url_rule('/<int:job_id>', view_func=JobViewSet.as_view('job_api'), methods=['GET'])
+blueprint.add_url_rule('/<int:job_id>/retry', view_func=JobRetryViewSet.as_view('job_retry_api'), methods=['POST'])
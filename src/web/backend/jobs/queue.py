@@ -0,0 +1,207 @@
+"""
+Queue running provisioning steps (chat accounts, group folders, ...) in worker threads, outside of http requests
+"""
+import logging
+import queue
+import threading
+import time
+
+from flask import current_app
+
+logger = logging.getLogger()
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# step name -> callable(args, secrets) returning json serializable result
+STEPS = dict()
+
+
+def job_step(name):
+    """ Register function as a job step of given name """
+    def decorator(func):
+        STEPS[name] = func
+        return func
+    return decorator
+
+
+class JobStepError(RuntimeError):
+    """ Raised by steps that failed in a way that retrying right away won't help """
+    pass
+
+
+class JobQueue(object):
+    """
+    Jobs are stored in JobStore and executed step by step in order, a failed step is attempted max_attempts times
+    before the job fails. Failed jobs can be retried, resuming from the failed step.
+
+    Secrets like passwords are kept in memory only until the job is done or failed, steps needing them can be
+    retried only if the secrets are passed to retry again.
+    A job is claimed by switching it from pending to running before it's run, so that it's run once even if it was
+    queued twice or by several processes sharing the store.
+    """
+
+    def __init__(self, app, store, workers=2, max_attempts=3, retry_delay=2):
+        self.app = app
+        self.store = store
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+        self._secrets = dict()  # job id -> dict
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._recovered = False
+
+    def submit(self, kind, args, steps, secrets=None, wait=False):
+        """
+        Create job and queue it, or run it right away
+
+        Args:
+            kind (str): what the job provisions
+            args (dict): json serializable arguments of steps
+            steps (list): names of registered steps to run in order
+            secrets (dict): arguments not to be stored, e.g. passwords
+            wait (bool): run the job in the current thread and return when it's finished
+
+        Returns (dict): the job
+        """
+        job = self.store.create(kind, args, steps, STATUS_PENDING)
+        if secrets:
+            self._secrets[job["id"]] = secrets
+        return self._schedule(job["id"], wait)
+
+    def retry(self, job_id, step=None, secrets=None, wait=False):
+        """
+        Run failed steps of a job again
+
+        Args:
+            job_id (int): id of the job
+            step (str): name of the only step to retry, all failed steps if not passed
+            secrets (dict): secrets the steps need, they aren't kept after the job failed
+            wait (bool): run the job in the current thread and return when it's finished
+
+        Returns (dict): the job
+        """
+        job = self.store.get(job_id)
+        if job is None or job["status"] in (STATUS_PENDING, STATUS_RUNNING):
+            return job
+        if secrets:
+            self._secrets[job_id] = secrets
+        for each in job["steps"]:
+            if each["status"] == STATUS_FAILED and step in (None, each["name"]):
+                each.update(status=STATUS_PENDING, attempts=0, error=None)
+        self.store.update(job_id, status=STATUS_PENDING, steps=job["steps"])
+        return self._schedule(job_id, wait)
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def _schedule(self, job_id, wait):
+        if wait:
+            return self.run(job_id)
+        self.start()
+        self._queue.put(job_id)
+        return self.store.get(job_id)
+
+    def start(self):
+        """ Start worker threads, unless they are running already """
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def recover(self, stale_after=600):
+        """
+        Queue jobs interrupted by restart of the process, only the first call does anything
+
+        Args:
+            stale_after (float): seconds after which a pending or running job that wasn't updated is taken as
+                interrupted, jobs updated more recently may be run by another process sharing the store
+        """
+        with self._lock:
+            if self._recovered:
+                return
+            self._recovered = True
+        cutoff = time.time() - stale_after
+        queued = 0
+        for job in self.store.get_by_status(STATUS_PENDING, STATUS_RUNNING):
+            if not self.store.set_status_if(job["id"], STATUS_PENDING, job["status"], updated_before=cutoff):
+                continue
+            self._queue.put(job["id"])
+            queued += 1
+        if queued:
+            logger.info(f"Recovered {queued} interrupted jobs")
+            self.start()
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                with self.app.app_context():
+                    self.run(job_id)
+            except Exception:
+                logger.exception(f"Job {job_id} crashed")
+            finally:
+                self._queue.task_done()
+
+    def run(self, job_id):
+        """
+        Run pending steps of a job in order, stop at the first step that fails.
+        The job is skipped if it isn't pending, e.g. it was queued twice and the other run claimed it.
+        """
+        if not self.store.set_status_if(job_id, STATUS_RUNNING, STATUS_PENDING):
+            logger.info(f"Job {job_id} is not pending, it's run or was run already")
+            return self.store.get(job_id)
+        job = self.store.get(job_id)
+        secrets = self._secrets.get(job_id, {})
+        for step in job["steps"]:
+            if step["status"] == STATUS_DONE:
+                continue
+            self._run_step(job, step, secrets)
+            if step["status"] == STATUS_FAILED:
+                self.store.update(job_id, status=STATUS_FAILED)
+                self._secrets.pop(job_id, None)
+                return self.store.get(job_id)
+        self.store.update(job_id, status=STATUS_DONE)
+        self._secrets.pop(job_id, None)
+        return self.store.get(job_id)
+
+    def _run_step(self, job, step, secrets):
+        func = STEPS[step["name"]]
+        while True:
+            step["attempts"] += 1
+            step["status"] = STATUS_RUNNING
+            self.store.update(job["id"], steps=job["steps"])
+            try:
+                step["result"] = func(job["args"], secrets)
+                step.update(status=STATUS_DONE, error=None)
+            except Exception as e:
+                logger.warning(f"Step {step['name']} of job {job['id']} failed: {e}")
+                step.update(status=STATUS_FAILED, error=str(e))
+                if not isinstance(e, JobStepError) and step["attempts"] < self.max_attempts:
+                    time.sleep(self.retry_delay * step["attempts"])
+                    continue
+            self.store.update(job["id"], steps=job["steps"])
+            return
+
+
+job_queue = None
+
+
+def init_queue(app):
+    global job_queue
+    from .store import JobStore
+    job_queue = JobQueue(app, JobStore(app.config.get("JOBS_DB_PATH", "teap-jobs.db")),
+                         workers=app.config.get("JOBS_WORKERS", 2))
+
+
+def recover_jobs():
+    """ Recover interrupted jobs when the first request is served, so that cli commands don't start workers """
+    job_queue.recover(stale_after=current_app.config.get("JOBS_STALE_AFTER", 600))
@@ -0,0 +1,119 @@
+"""
+SQLite storage of provisioning jobs, independent of the optional application database
+"""
+import json
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    args TEXT NOT NULL,
+    steps TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+
+class JobStore(object):
+    """ Jobs with their steps, every step is a dict of name, status, attempts, result and error """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute(SCHEMA)
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "args": json.loads(row["args"]),
+            "steps": json.loads(row["steps"]),
+            "created": row["created"],
+            "updated": row["updated"],
+        }
+
+    def create(self, kind, args, steps, status):
+        """
+        Store new job
+
+        Args:
+            kind (str): what the job provisions, e.g. 'user'
+            args (dict): json serializable arguments of the steps, never secrets
+            steps (list): names of steps in order of execution
+            status (str): initial status of the job and its steps
+
+        Returns (dict): the job
+        """
+        now = time.time()
+        steps = [dict(name=name, status=status, attempts=0, result=None, error=None) for name in steps]
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, status, args, steps, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, status, json.dumps(args), json.dumps(steps), now, now))
+            conn.commit()
+            job_id = cursor.lastrowid
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def get_by_status(self, *statuses):
+        placeholders = ", ".join("?" * len(statuses))
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT * FROM jobs WHERE status IN ({placeholders}) ORDER BY id", statuses).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def set_status_if(self, job_id, status, expected, updated_before=None):
+        """
+        Change status of a job atomically, only if it has the expected status
+
+        Args:
+            job_id (int): id of the job
+            status (str): new status
+            expected (str): status the job must have
+            updated_before (float): only if the job was last updated before this time as well
+
+        Returns (bool): True if the status was changed
+        """
+        query = "UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status = ?"
+        params = [status, time.time(), job_id, expected]
+        if updated_before is not None:
+            query += " AND updated < ?"
+            params.append(updated_before)
+        with self._lock:
+            conn = self._connection()
+            changed = conn.execute(query, params).rowcount
+            conn.commit()
+        return changed == 1
+
+    def update(self, job_id, status=None, steps=None):
+        """ Update status and/or steps of a job """
+        with self._lock:
+            conn = self._connection()
+            if status is not None:
+                conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ?", (status, time.time(), job_id))
+            if steps is not None:
+                conn.execute("UPDATE jobs SET steps = ?, updated = ? WHERE id = ?",
+                             (json.dumps(steps), time.time(), job_id))
+            conn.commit()
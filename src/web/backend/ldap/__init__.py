@@ -1 +1,6 @@
 from . import api
+
+
+def initialize_module(app):
+    from . import utils
+    app.teardown_appcontext(utils.release_edap)
@@ -1,18 +1,22 @@
+import json
 import time
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 from flask.views import MethodView
 from ..edap import ObjectDoesNotExist, ConstraintError, MultipleObjectsFound
+from ..filters import prefix
 from marshmallow import ValidationError
 
 from .. import utils
 from .serializers import edap_user_schema, edap_users_schema, edap_franchise_schema, edap_franchises_schema, \
-    edap_divisions_schema, edap_teams_schema, edap_division_schema
+    edap_divisions_schema, edap_teams_schema, edap_division_schema, USER_ATTRIBUTES, GROUP_ATTRIBUTES
 from .api_serializers import api_franchise_schema, api_user_schema, api_users_schema, api_franchises_schema, \
     api_divisions_schema, api_teams_schema
 
+from .importer import UserImporter, parse_rows, FORMAT_CSV, FORMAT_JSONL
 from .models import LdapDivision, LdapFranchise, LdapUser
-from .utils import get_config_divisions, merge_divisions, EdapMixin, send_password_reset_email, get_edap, verify_reset_password_token, PWResetEligibilityExc
+from .utils import get_config_divisions, merge_divisions, EdapMixin, send_password_reset_email, get_edap, verify_reset_password_token, PWResetEligibilityExc, \
+    get_edap_pool, get_directory_sync, get_login_guard, encode_cursor, decode_cursor
 
 blueprint = Blueprint('divisions_api', __name__, url_prefix='/api/ldap/')
 blueprint.json_encoder = utils.EncoderWithBytes
@@ -24,12 +28,51 @@ def handle_not_found(e):
 
 
 class UserListViewSet(EdapMixin, MethodView):
+    # api field -> ldap attribute users can be sorted by
+    SORT_FIELDS = {'uid': 'uid', 'name': 'givenName', 'surname': 'sn', 'mail': 'mail'}
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 500
 
     def get(self):
-        """ List users """
-        res = self.edap.get_users()
-        data = edap_users_schema.load(res)
-        return jsonify(api_users_schema.dump(data))
+        """ List users - a page of them if any of limit, cursor, sort or query is given, otherwise all streamed """
+        if any(param in request.args for param in ('limit', 'cursor', 'sort', 'query')):
+            return self.get_page()
+        users = (api_user_schema.dump(edap_user_schema.load(each))
+                 for each in self.directory.iter_users(attrlist=USER_ATTRIBUTES))
+        return Response(stream_with_context(utils.iter_json_array(users)), mimetype='application/json')
+
+    def get_page(self):
+        """
+        Page of users with cursor of the next page and estimated total count of users matching the query.
+        Sort and query of the first page are kept in the cursor.
+        """
+        try:
+            if 'cursor' in request.args:
+                position = decode_cursor(request.args['cursor'])
+            else:
+                position = {'offset': 0, 'sort': request.args.get('sort', 'uid'), 'query': request.args.get('query')}
+            offset = int(position['offset'])
+            limit = int(request.args.get('limit', self.PAGE_SIZE))
+        except (ValueError, KeyError):
+            return jsonify({'message': 'Invalid limit or cursor'}), 400
+        if offset < 0 or not 0 < limit <= self.MAX_PAGE_SIZE:
+            return jsonify({'message': f'Limit has to be between 1 and {self.MAX_PAGE_SIZE}'}), 400
+
+        sort = position.get('sort') or 'uid'
+        descending = sort.startswith('-')
+        attr = self.SORT_FIELDS.get(sort.lstrip('-'))
+        if attr is None:
+            return jsonify({'message': f"Users can be sorted by {', '.join(self.SORT_FIELDS)}"}), 400
+
+        users, total = self.directory.get_users_page(offset=offset, limit=limit,
+                                                     sort=f"-{attr}" if descending else attr,
+                                                     query=position.get('query'), attrlist=USER_ATTRIBUTES)
+        next_offset = offset + len(users)
+        return jsonify({
+            'results': api_users_schema.dump(edap_users_schema.load(users)),
+            'next': encode_cursor({**position, 'offset': next_offset}) if users and next_offset < total else None,
+            'total': total,
+        })
 
     @utils.authorize_only_hr_admins()
     def post(self):
@@ -50,6 +93,26 @@ class UserListViewSet(EdapMixin, MethodView):
         return jsonify(res)
 
 
+class UserImportViewSet(EdapMixin, MethodView):
+    # content type -> format of import
+    FORMATS = {'text/csv': FORMAT_CSV, 'application/x-ndjson': FORMAT_JSONL, 'application/jsonl': FORMAT_JSONL}
+
+    @utils.authorize_only_hr_admins()
+    def post(self):
+        """ Create users from CSV or JSON lines body, respond with JSON lines - result of every row, then summary """
+        fmt = self.FORMATS.get(request.mimetype) or request.args.get('format')
+        if fmt not in (FORMAT_CSV, FORMAT_JSONL):
+            return jsonify({'message': 'Send text/csv or application/x-ndjson, or pass format=csv|jsonl'}), 415
+
+        importer = UserImporter(self.edap,
+                                batch_size=current_app.config.get('IMPORT_BATCH_SIZE', 100),
+                                workers=current_app.config.get('ROCKETCHAT_WORKERS', 8),
+                                create_chat_accounts=request.args.get('chat', 'true') != 'false')
+        rows = parse_rows(io.TextIOWrapper(request.stream, encoding='utf-8'), fmt)
+        results = (json.dumps(result) + '\n' for result in importer.run(rows))
+        return Response(stream_with_context(results), mimetype='application/x-ndjson')
+
+
 class UserAdministrationViewSet(EdapMixin,
                                 MethodView):
     @utils.authorize_only_hr_admins()
@@ -70,7 +133,7 @@ class UserAdministrationViewSet(EdapMixin,
         username = form.username.data
         now = time.time()
         try:
-            user = edap_user_schema.load(self.edap.get_user(username))
+            user = edap_user_schema.load(self.edap.get_user(username, attrlist=USER_ATTRIBUTES))
         except MultipleObjectsFound:
             return jsonify({'message': 'More than 1 user found'}), 409
         except ObjectDoesNotExist:
@@ -91,7 +154,7 @@ class UserRetrieveViewSet(EdapMixin,
     def get(self, username):
         """ List users """
         try:
-            user = edap_user_schema.load(self.edap.get_user(username))
+            user = edap_user_schema.load(self.directory.get_user(username, attrlist=USER_ATTRIBUTES))
         except MultipleObjectsFound:
             return jsonify({'message': 'More than 1 user found'}), 409
         except ObjectDoesNotExist:
@@ -101,7 +164,7 @@ class UserRetrieveViewSet(EdapMixin,
         if auth_err:
             return auth_err
 
-        user_groups = self.edap.get_user_groups(username)
+        user_groups = self.directory.get_user_groups(username)
         user = {
             **api_user_schema.dump(user),
             "groups": [group for group in user_groups],
@@ -168,7 +231,7 @@ class UserRetrieveViewSet(EdapMixin,
         """ Delete user """
         result = dict(success=True)
         try:
-            user = edap_user_schema.load(self.edap.get_user(username))
+            user = edap_user_schema.load(self.edap.get_user(username, attrlist=USER_ATTRIBUTES))
             user.delete()
         except Exception as exc:
             result['success'] = False
@@ -234,8 +297,8 @@ class DivisionsViewSet(EdapMixin, MethodView):
     def get(self):
         """ Get divisions from ldap """
         query = request.args.get('query')
-        search = f"description={query}*" if query else ""
-        ldap_divisions = edap_divisions_schema.load(self.edap.get_divisions(search))
+        search = prefix("description", query) if query else None
+        ldap_divisions = edap_divisions_schema.load(self.directory.get_divisions(search, attrlist=GROUP_ATTRIBUTES))
         return jsonify(api_divisions_schema.dump(ldap_divisions))
 
 
@@ -251,8 +314,8 @@ class FranchisesViewSet(EdapMixin, MethodView):
 
     def get(self):
         query = request.args.get('query')
-        search = f"description={query}*" if query else ""
-        franchises = edap_franchises_schema.load(self.edap.get_franchises(search))
+        search = prefix("description", query) if query else None
+        franchises = edap_franchises_schema.load(self.directory.get_franchises(search, attrlist=GROUP_ATTRIBUTES))
         return jsonify(api_franchises_schema.dump(franchises))
 
     @utils.authorize_only_hr_admins()
@@ -279,7 +342,8 @@ class FranchiseFoldersViewSet(EdapMixin, MethodView):
 
     @utils.authorize_only_hr_admins()
     def post(self, franchise_machine_name):
-        franchise = edap_franchise_schema.load(self.edap.get_franchise(franchise_machine_name))
+        franchise = edap_franchise_schema.load(self.edap.get_franchise(franchise_machine_name,
+                                                                       attrlist=GROUP_ATTRIBUTES))
         res = franchise.create_folder(franchise.display_name)
         return jsonify({'success': res}), 201 if res else 500
 
@@ -289,8 +353,8 @@ class TeamsViewSet(EdapMixin, MethodView):
     def get(self):
         """ Get teams from ldap """
         query = request.args.get('query')
-        search = f"description={query}*" if query else ""
-        ldap_teams = edap_teams_schema.load(self.edap.get_teams(search))
+        search = prefix("description", query) if query else None
+        ldap_teams = edap_teams_schema.load(self.directory.get_teams(search, attrlist=GROUP_ATTRIBUTES))
         return jsonify(api_teams_schema.dump(ldap_teams))
 
 
@@ -308,15 +372,16 @@ class UserFranchisesViewSet(EdapMixin, MethodView):
     @utils.authorize_only_hr_admins()
     def post(self, uid):
         """ add user to franchise """
-        user = edap_user_schema.load(self.edap.get_user(uid))  # to check if user exists, or return 404
+        # to check if user exists, or return 404
+        user = edap_user_schema.load(self.edap.get_user(uid, attrlist=USER_ATTRIBUTES))
         machine_name = request.json.get('machineName')
-        franchise = edap_franchise_schema.load(self.edap.get_franchise(machine_name))
+        franchise = edap_franchise_schema.load(self.edap.get_franchise(machine_name, attrlist=GROUP_ATTRIBUTES))
         franchise.add_user(uid)
         return jsonify({'message': 'success'}), 200
 
     @utils.authorize_only_hr_admins()
     def delete(self, uid):
-        user = edap_user_schema.load(self.edap.get_user(uid))
+        user = edap_user_schema.load(self.edap.get_user(uid, attrlist=USER_ATTRIBUTES))
         machine_name = request.json.get('machineName')
         user.remove_from_franchise(machine_name)
         return jsonify({'message': 'success'}), 202
@@ -327,15 +392,16 @@ class UserDivisionsViewSet(EdapMixin, MethodView):
     @utils.authorize_only_hr_admins()
     def post(self, uid):
         """ add user to team """
-        user = edap_user_schema.load(self.edap.get_user(uid))  # to check if user exists, or return 404
+        # to check if user exists, or return 404
+        user = edap_user_schema.load(self.edap.get_user(uid, attrlist=USER_ATTRIBUTES))
         machine_name = request.json.get('machineName')
-        division = edap_division_schema.load(self.edap.get_division(machine_name))
+        division = edap_division_schema.load(self.edap.get_division(machine_name, attrlist=GROUP_ATTRIBUTES))
         division.add_user(uid)
         return jsonify({'message': 'success'}), 200
 
     @utils.authorize_only_hr_admins()
     def delete(self, uid):
-        user = edap_user_schema.load(self.edap.get_user(uid))
+        user = edap_user_schema.load(self.edap.get_user(uid, attrlist=USER_ATTRIBUTES))
         machine_name = request.json.get('machineName')
         user.remove_from_division(machine_name)
         return jsonify({'message': 'success'}), 202
@@ -345,13 +411,13 @@ class UserTeamsViewSet(EdapMixin, MethodView):
 
     def post(self, uid):
         """ add user to team """
-        user = edap_user_schema.load(self.edap.get_user(uid))
+        user = edap_user_schema.load(self.edap.get_user(uid, attrlist=USER_ATTRIBUTES))
         machine_name = request.json.get('machineName')
         user.add_to_team(machine_name)
         return jsonify({'message': 'success'}), 200
 
     def delete(self, uid):
-        user = edap_user_schema.load(self.edap.get_user(uid))
+        user = edap_user_schema.load(self.edap.get_user(uid, attrlist=USER_ATTRIBUTES))
         machine_name = request.json.get('machineName')
         user.remove_from_team(machine_name)
         return jsonify({'message': 'success'}), 202
@@ -450,9 +516,36 @@ def details_change():
             bp_prefix=blueprint.url_prefix)
 
 
+@blueprint.route("/pool", methods=["GET"])
+@utils.authorize_only_hr_admins()
+def pool_stats():
+    """ Usage statistics of the ldap connection pool of this process """
+    return jsonify(get_edap_pool().stats())
+
+
+@blueprint.route("/logins", methods=["GET"])
+@utils.authorize_only_hr_admins()
+def login_stats():
+    """ Outcomes and latency of password logins handled by this process """
+    return jsonify(get_login_guard().stats())
+
+
+@blueprint.route("/sync", methods=["GET"])
+@utils.authorize_only_hr_admins()
+def sync_status():
+    """ Position and lag of the incremental directory sync of this process """
+    directory_sync = get_directory_sync()
+    if directory_sync is None:
+        return jsonify({'message': 'Directory sync is not enabled'}), 404
+    return jsonify(directory_sync.status())
+
+
 user_list_view = UserListViewSet.as_view('users_api')
 blueprint.add_url_rule('/users/', view_func=user_list_view, methods=['GET', 'POST'])
 
+user_import_view = UserImportViewSet.as_view('user_import_api')
+blueprint.add_url_rule('/users/import', view_func=user_import_view, methods=['POST'])
+
 user_view = UserRetrieveViewSet.as_view('user_api')
 blueprint.add_url_rule('/users/<username>', view_func=user_view, methods=['GET', 'DELETE'])
 blueprint.add_url_rule('/users/<username>', view_func=user_view, methods=['POST'])
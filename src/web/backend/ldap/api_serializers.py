@@ -16,6 +16,16 @@ class ApiUserSchema(Schema):
     groups = fields.List(fields.Str)
 
 
+class ApiImportUserSchema(Schema):
+    """ Deserialize rows of bulk user import """
+    uid = fields.Str(required=True)
+    given_name = fields.Str(data_key='name', required=True)
+    surname = fields.Str(required=True)
+    mail = fields.Email(required=True)
+    password = fields.Str(load_only=True, required=True)
+    teams = fields.List(fields.Str(), missing=list)
+
+
 class ApiBaseGroupSchema(Schema):
     """ Serialize ldap models for posixGroup to json and backwards """
     fqdn = fields.Str()
@@ -49,6 +59,7 @@ class ApiTeamSchema(ApiBaseGroupSchema):
 
 api_user_schema = ApiUserSchema()
 api_users_schema = ApiUserSchema(many=True)
+api_import_user_schema = ApiImportUserSchema()
 
 api_franchise_schema = ApiFranchiseSchema()
 api_franchises_schema = ApiFranchiseSchema(many=True)
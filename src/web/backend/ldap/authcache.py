@@ -0,0 +1,70 @@
+"""
+Cache of special group memberships checked when authorizing requests, so that protected views don't search LDAP
+on every request
+"""
+import threading
+import time
+
+import ldap
+import ldap.dn
+
+
+class MembershipCache(object):
+    """
+    Maps (uid, special group name) to whether the user is a member, entries expire after ttl.
+
+    Registered as write listener of Edap, entries of a group or user are dropped when the entry of the group
+    or the user is written by this process. Changes made elsewhere are picked up when entries expire.
+    """
+
+    def __init__(self, ttl=30, maxsize=10000):
+        """
+        Args:
+            ttl (int): seconds to keep memberships
+            maxsize (int): max number of memberships kept, all are dropped when exceeded
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = dict()  # (uid, lowercase group name) -> (expires, is member)
+        self._lock = threading.Lock()
+
+    def get(self, uid, group):
+        """ Returns (bool): whether uid is member of group, None if it isn't known """
+        with self._lock:
+            item = self._data.get((uid, group.lower()))
+            if item is None:
+                return None
+            expires, is_member = item
+            if expires < time.monotonic():
+                del self._data[(uid, group.lower())]
+                return None
+            return is_member
+
+    def set(self, uid, group, is_member):
+        with self._lock:
+            if len(self._data) >= self.maxsize:
+                self._data.clear()
+            self._data[(uid, group.lower())] = (time.monotonic() + self.ttl, is_member)
+
+    def invalidate(self, dn=None):
+        """ Drop memberships of the group or user of dn, all of them if dn isn't a group or user dn """
+        try:
+            attr, value, _ = ldap.dn.str2dn(dn)[0][0] if dn else (None, None, None)
+        except (ldap.DECODING_ERROR, IndexError):
+            attr = value = None
+        with self._lock:
+            if attr is None:
+                self._data.clear()
+            elif attr.lower() == "cn":
+                for key in [key for key in self._data if key[1] == value.lower()]:
+                    del self._data[key]
+            elif attr.lower() == "uid":
+                for key in [key for key in self._data if key[0] == value]:
+                    del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,210 @@
+"""
+Bulk import of users from CSV or JSON lines, processed in batches so that any number of rows can be streamed through
+"""
+import csv
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from marshmallow import ValidationError
+
+from ..edap import ldap_error_message
+from ..nextcloud.utils import get_nextcloud, flush_nextcloud_ldap_cache
+from ..rocket_chat import utils as rutils
+from .api_serializers import api_import_user_schema
+from .models import LdapTeam, get_password_weaknesses
+
+logger = logging.getLogger()
+
+FORMAT_CSV = "csv"
+FORMAT_JSONL = "jsonl"
+
+STATUS_CREATED = "created"
+STATUS_INVALID = "invalid"
+STATUS_FAILED = "failed"
+
+
+def parse_rows(lines, fmt):
+    """
+    Parse rows of users to import
+
+    Args:
+        lines (iterable): lines of text, e.g. an open file
+        fmt (str): FORMAT_CSV with a header line, teams separated by ';', or FORMAT_JSONL
+
+    Returns (generator): dicts, or ValueError instances for lines that couldn't be parsed
+    """
+    if fmt == FORMAT_CSV:
+        for row in csv.DictReader(lines):
+            row = {key: value.strip() for key, value in row.items() if key and value and value.strip()}
+            if "teams" in row:
+                row["teams"] = [team.strip() for team in row["teams"].split(";") if team.strip()]
+            yield row
+    elif fmt == FORMAT_JSONL:
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield ValueError(f"Invalid JSON: {e}")
+    else:
+        raise ValueError(f"Unsupported format '{fmt}'")
+
+
+def _chunked(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class UserImporter(object):
+    """
+    Creates users of every batch of rows with pipelined ldap adds, adds them to teams with a single modify per team,
+    creates their chat accounts concurrently and flushes Nextcloud LDAP cache once at the end.
+    """
+
+    def __init__(self, edap, batch_size=100, workers=8, create_chat_accounts=True):
+        """
+        Args:
+            edap (Edap): edap to create users with
+            batch_size (int): rows validated and created together
+            workers (int): max number of chat accounts created concurrently
+            create_chat_accounts (bool): create Rocket.Chat accounts of the new users
+        """
+        self.edap = edap
+        self.batch_size = max(batch_size, 1)
+        self.workers = max(workers, 1)
+        self.create_chat_accounts = create_chat_accounts
+        self.counts = {STATUS_CREATED: 0, STATUS_INVALID: 0, STATUS_FAILED: 0}
+        self._seen_uids = set()
+        self._teams = None
+
+    def run(self, rows):
+        """
+        Import users
+
+        Args:
+            rows (iterable): dicts of uid, name, surname, mail, password and teams (list of team machine names)
+
+        Returns (generator): result of every row - dict of row number, uid, status and errors, then the summary
+        """
+        start = time.monotonic()
+        LdapTeam.get_everybody_team()  # creates the team if it doesn't exist yet
+        self._teams = {machine_name.lower(): machine_name for machine_name in self._get_team_names()}
+        for batch in _chunked(enumerate(rows, start=1), self.batch_size):
+            yield from self._import_batch(batch)
+        if self.counts[STATUS_CREATED]:
+            flush_nextcloud_ldap_cache(get_nextcloud(), now=True)
+        seconds = time.monotonic() - start
+        rows_count = sum(self.counts.values())
+        yield {
+            "summary": True,
+            "rows": rows_count,
+            **self.counts,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(rows_count / seconds, 1) if seconds else None,
+        }
+
+    def _get_team_names(self):
+        teams = self.edap.get_teams(attrlist=["cn"])
+        return [team["cn"][0].decode("UTF-8") for team in teams]
+
+    def _validate(self, row):
+        if isinstance(row, Exception):
+            return None, [str(row)]
+        try:
+            data = api_import_user_schema.load(row)
+        except ValidationError as err:
+            return None, [f"{field}: {', '.join(messages)}" for field, messages in err.messages.items()]
+        errors = []
+        if data["uid"].lower() in self._seen_uids:
+            errors.append(f"uid '{data['uid']}' appears more than once")
+        errors.extend(f"teams: team '{team}' doesn't exist"
+                      for team in data["teams"] if team.lower() not in self._teams)
+        errors.extend(get_password_weaknesses(data["password"], username=data["uid"].lower())[:-1])
+        if not errors:
+            # an invalid row doesn't take the uid, a corrected row may follow
+            self._seen_uids.add(data["uid"].lower())
+        return data, errors
+
+    def _import_batch(self, batch):
+        results = []
+        valid = []
+        for number, row in batch:
+            data, errors = self._validate(row)
+            uid = data["uid"] if data else (row.get("uid") if isinstance(row, dict) else None)
+            result = {"row": number, "uid": uid, "status": STATUS_INVALID if errors else None, "errors": errors}
+            results.append(result)
+            if not errors:
+                valid.append((result, data))
+
+        if valid:
+            self._create(valid)
+
+        for result in results:
+            self.counts[result["status"]] += 1
+        return results
+
+    def _create(self, valid):
+        try:
+            added = self.edap.add_users([
+                dict(uid=data["uid"], name=data["given_name"], surname=data["surname"], password=data["password"],
+                     mail=data["mail"]) for _, data in valid])
+        except Exception as e:
+            added = {data["uid"]: str(e) for _, data in valid}
+
+        created = []
+        for result, data in valid:
+            error = added.get(data["uid"])
+            if error:
+                result.update(status=STATUS_FAILED, errors=[error])
+            else:
+                result["status"] = STATUS_CREATED
+                created.append((result, data))
+        if not created:
+            return
+
+        # one modify per team carrying all new members
+        team_members = {LdapTeam.EVERYBODY_MACHINE_NAME: {data["uid"] for _, data in created}}
+        for _, data in created:
+            for team in data["teams"]:
+                team_members.setdefault(self._teams[team.lower()], set()).add(data["uid"])
+        for team, uids in team_members.items():
+            try:
+                self.edap.add_group_members(f"cn={team},{self.edap.TEAMS_GROUP}", uids, ignore_missing=True)
+            except Exception as e:
+                for result, data in created:
+                    if data["uid"] in uids:
+                        result["errors"].append(f"Failed to add to team '{team}': {ldap_error_message(e)}")
+
+        if self.create_chat_accounts:
+            self._create_chat_accounts(created)
+
+    def _create_chat_accounts(self, created):
+        app = current_app._get_current_object()
+        rocket = rutils.rocket_service.bound()
+
+        def create(item):
+            result, data = item
+            # app context for logging of the action
+            with app.app_context():
+                try:
+                    res = rocket.create_user(
+                        username=data["uid"], password=data["password"], email=data["mail"], name=data["given_name"])
+                    body = res.json()
+                    if res.status_code != 200 or not body.get("success", True):
+                        result["errors"].append(f"Failed to create chat account: {body.get('error', res.reason)}")
+                except Exception as e:
+                    logger.exception(f"Failed to create chat account of {data['uid']}")
+                    result["errors"].append(f"Failed to create chat account: {e}")
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(created))) as executor:
+            list(executor.map(create, created))
@@ -0,0 +1,118 @@
+"""
+Password login checks, throttled per uid and measured
+"""
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger()
+
+LOGIN_OK = "ok"
+LOGIN_INVALID = "invalid"
+LOGIN_THROTTLED = "throttled"
+LOGIN_ERROR = "error"
+
+
+class LoginGuard(object):
+    """
+    Verifies passwords unless the uid has failed max_failures times within the last window seconds,
+    so that guessing a password or a storm of retries doesn't reach LDAP. Counts outcomes and keeps
+    latencies of recent verifications.
+    """
+    # failures of uids are pruned when more uids than this are being tracked
+    MAX_TRACKED_UIDS = 10000
+
+    def __init__(self, max_failures=5, window=300, latency_samples=1000):
+        """
+        Args:
+            max_failures (int): failed attempts of a uid within window after which its attempts are rejected,
+                0 for no limit
+            window (int): seconds failed attempts are remembered for
+            latency_samples (int): number of recent verifications latency percentiles are computed from
+        """
+        self.max_failures = max_failures
+        self.window = window
+        self._failures = dict()  # lowercase uid -> deque of monotonic times of failed attempts
+        self._latencies = collections.deque(maxlen=latency_samples)
+        self._counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _recent_failures(self, key, now):
+        """ Failures of key within window, has to be called with the lock held """
+        failures = self._failures.get(key)
+        if failures is None:
+            return 0
+        while failures and now - failures[0] > self.window:
+            failures.popleft()
+        if not failures:
+            del self._failures[key]
+            return 0
+        return len(failures)
+
+    def is_throttled(self, uid):
+        if not self.max_failures:
+            return False
+        with self._lock:
+            return self._recent_failures(uid.lower(), time.monotonic()) >= self.max_failures
+
+    def verify(self, uid, password, check):
+        """
+        Verify password of user
+
+        Args:
+            uid (str): user's uid
+            password (str): password to verify
+            check (callable): takes uid and password, returns whether the password is correct
+
+        Returns (str): LOGIN_OK, LOGIN_INVALID, LOGIN_THROTTLED or LOGIN_ERROR
+        """
+        if not uid or not password:
+            outcome = LOGIN_INVALID
+        elif self.is_throttled(uid):
+            logger.warning(f"Login of '{uid}' rejected, too many failed attempts")
+            outcome = LOGIN_THROTTLED
+        else:
+            start = time.monotonic()
+            try:
+                outcome = LOGIN_OK if check(uid, password) else LOGIN_INVALID
+            except Exception:
+                logger.exception(f"Failed to verify password of '{uid}'")
+                outcome = LOGIN_ERROR
+            self._latencies.append(time.monotonic() - start)
+        self._record(uid, outcome)
+        return outcome
+
+    def _record(self, uid, outcome):
+        with self._lock:
+            self._counters[outcome] += 1
+            if not uid or outcome in (LOGIN_THROTTLED, LOGIN_ERROR):
+                return
+            key = uid.lower()
+            if outcome == LOGIN_OK:
+                self._failures.pop(key, None)
+            else:
+                now = time.monotonic()
+                if len(self._failures) >= self.MAX_TRACKED_UIDS:
+                    for each in list(self._failures):
+                        self._recent_failures(each, now)
+                self._recent_failures(key, now)
+                self._failures.setdefault(key, collections.deque()).append(now)
+
+    def stats(self):
+        """ Get counts of login outcomes and latency of recent verifications in seconds as a dict """
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)], 4) if latencies else None
+
+        with self._lock:
+            return dict(
+                throttled_uids=sum(1 for failures in self._failures.values()
+                                   if self.max_failures and len(failures) >= self.max_failures),
+                latency_p50=percentile(0.5),
+                latency_p95=percentile(0.95),
+                latency_max=round(latencies[-1], 4) if latencies else None,
+                **{outcome: self._counters[outcome]
+                   for outcome in (LOGIN_OK, LOGIN_INVALID, LOGIN_THROTTLED, LOGIN_ERROR)},
+            )
@@ -1,14 +1,16 @@
 """ Models to work with ldap objects, operated by EDAP library """
 import gzip
 
-from ..edap import ObjectDoesNotExist, ConstraintError
+from ..edap import ObjectDoesNotExist, ConstraintError, NO_ATTRIBUTES
+from ..filters import eq
 from nextcloud.base import Permission as NxcPermission
 from password_strength import PasswordStats
 
 from .utils import EdapMixin, get_edap, get_config_divisions
-from ..nextcloud.utils import get_nextcloud, get_group_folder, flush_nextcloud_ldap_cache
+from ..nextcloud.utils import get_nextcloud, get_group_folder, get_group_folder_index, flush_nextcloud_ldap_cache
 from ..rocket_chat import utils as rutils
-from ..settings import FREQUENT_PASSWORDS
+from ..jobs import queue as jobs
+from .passwords import get_frequent_passwords
 
 # TODO: separate layer with edap from data models
 NEXTCLOUD_ADMIN_GROUP = "admin"
@@ -24,6 +26,8 @@ def _assure_folder_exists_with_permissions(nxc, folder_path, all_group_ids_permi
     create_folder_res = nxc.create_group_folder(folder_path)
     result = create_folder_res.is_ok
     folder_id = create_folder_res.data['id']
+    if result:
+        get_group_folder_index().put(folder_path, folder_id)
 
     for group_id, permission in all_group_ids_permissions:
         grant_everybody_access = nxc.grant_access_to_group_folder(
@@ -52,7 +56,7 @@ def get_password_weaknesses(pw, username=None):
         errors.append(f"Password is too simple - current strength is {stats.strength():.2g}, you need at least {MIN_STRENGTH}")
     if stats.entropy_bits < MIN_ENTROPY_BITS:
         errors.append(f"Password is too simple - currently it has {stats.entropy_bits} entropy bits, you need at least {MIN_ENTROPY_BITS}")
-    if pw in FREQUENT_PASSWORDS:
+    if pw in get_frequent_passwords():
         errors.append("This password is already on a list of common passwords, make up something else")
 
     if username and username in pw.lower():
@@ -115,12 +119,7 @@ class GroupFolderMixin:
 
     def folder_exists(self):
         """ Check if group folder exists in Nextcloud """
-        nxc = get_nextcloud()
-        data = nxc.get_group_folders().data
-        for _, folder_info in data.items():
-            if folder_info['mount_point'] == self.main_folder_path:
-                return True
-        return False
+        return get_group_folder(self.main_folder_path) is not None
 
 
 class User:
@@ -210,25 +209,24 @@ class MajorStructure(GroupFolderMixin, GroupChatMixin):
 
 
 class LdapMajorStructure(EdapMixin):
-    def create(self):
-        """ Create franchise with self.machine_name, self.display_name, create corresponding teams """
+    # steps of provisioning job creating everything that belongs to a new structure, see create()
+    PROVISIONING_STEPS = ["structure.create_teams", "structure.create_chat_group",
+                          "structure.create_main_folder", "structure.create_dea_folder"]
+
+    def create(self, wait=False):
+        """
+        Create structure with self.machine_name, self.display_name in ldap and submit job creating corresponding
+        teams, chat group and group folders
+
+        Args:
+            wait (bool): run the job right away instead of in background
+
+        Returns (dict): {'job': provisioning job}
+        """
         self.add_to_edap()
-        self.create_teams()
-        channel_res = self.create_group()
-
-        # create group folders
-        main_folder_success = self.create_main_folder()
-        dea_folder_success = self.create_dea_folder()
-
-        return {
-            'rocket': channel_res,
-            'main_folder': {
-                'success': main_folder_success
-            },
-            'dea_folder': {
-                'success': dea_folder_success
-            },
-        }
+        args = dict(entity=self.ENTITY_NAME, machine_name=self.machine_name, display_name=self.display_name)
+        job = jobs.job_queue.submit(self.ENTITY_NAME.lower(), args, self.PROVISIONING_STEPS, wait=wait)
+        return {'job': job}
 
     @staticmethod
     def _get_ldap_dict(code):
@@ -270,7 +268,7 @@ class LdapUser(EdapMixin, User):
     @classmethod
     def get_from_edap(cls, uid):
         ret = cls()
-        edap_dict = ret.edap.get_user(uid)
+        edap_dict = ret.edap.get_user(uid, attrlist=["givenName", "mail", "sn", "jpegPhoto", "mailAlias"])
 
         ret.uid = uid
         ret.given_name = edap_dict.get("givenName", [b""])[0].decode("UTF-8")
@@ -306,17 +304,25 @@ class LdapUser(EdapMixin, User):
         ret = self.edap.make_user_member_of_team(self.uid, everybody_team.machine_name)
         return ret
 
-    def create(self, password):
+    # steps of provisioning job making a new user known to other services, see create()
+    PROVISIONING_STEPS = ["user.flush_nextcloud_ldap_cache", "user.create_chat_account"]
+
+    def create(self, password, wait=False):
+        """
+        Create user in ldap, add them to everybody team and submit job creating their accounts in other services
+
+        Args:
+            password (str): user's password, passed to the job in memory only
+            wait (bool): run the job right away instead of in background
+
+        Returns (dict): {'job': provisioning job}
+        """
         self.add_to_edap(password)
         self.add_to_everybody_team()
 
-        nxc = get_nextcloud()
-        flush_nextcloud_ldap_cache(nxc)
-
-        rocket_data = self.create_chat_account(password)
-        return {
-            'rocket': rocket_data
-        }
+        args = dict(uid=self.uid, mail=self.mail, given_name=self.given_name)
+        job = jobs.job_queue.submit("user", args, self.PROVISIONING_STEPS, secrets={"password": password}, wait=wait)
+        return {'job': job}
 
     def modify_password(self, new_value):
         weaknesses = get_password_weaknesses(new_value)
@@ -371,9 +377,8 @@ class LdapUser(EdapMixin, User):
 
     def remove_from_all_groups(self):
         """ Remove user from all ldap groups """
-        user_groups = self.edap.get_user_groups(self.uid)
-        for each in user_groups:
-            self.edap.remove_uid_member_of(self.uid, each['fqdn'])
+        user_groups = self.edap.get_user_groups(self.uid, attrlist=NO_ATTRIBUTES)
+        self.edap.remove_uid_member_of_many(self.uid, [each['fqdn'] for each in user_groups])
 
     def create_chat_account(self, password):
         """
@@ -389,14 +394,14 @@ class LdapUser(EdapMixin, User):
 
     def delete_chat_account(self):
         """ Delete user's chat account """
-        rocket_user = rutils.rocket_service.get_user_by_username(self.uid)
-        if rocket_user and rocket_user.get('_id'):
-            return rutils.rocket_service.delete_user(rocket_user['_id'])
+        user_id = rutils.rocket_service.get_user_id(self.uid)
+        if user_id:
+            return rutils.rocket_service.delete_user(user_id)
 
     def get_teams(self):
         """ Get teams where user is a member """
         from .serializers import edap_teams_schema
-        user_teams = self.edap.get_teams(f'memberUid={self.uid}')
+        user_teams = self.directory.get_teams(eq("memberUid", self.uid))
         return edap_teams_schema.load(user_teams)
 
     def add_user_to_implied_structures(self, team_machine_name):
@@ -423,7 +428,7 @@ class LdapUser(EdapMixin, User):
 
     def get_franchises(self):
         from .serializers import edap_franchises_schema
-        franchises_raw = self.edap.get_franchises(f'memberUid={self.uid}')
+        franchises_raw = self.directory.get_franchises(eq("memberUid", self.uid))
         return edap_franchises_schema.load(franchises_raw)
 
     def ensure_in_franchise(self, franchise_machine_name):
@@ -446,7 +451,7 @@ class LdapUser(EdapMixin, User):
 
     def get_divisions(self):
         from .serializers import edap_divisions_schema
-        divisions_raw = self.edap.get_divisions(f'memberUid={self.uid}')
+        divisions_raw = self.directory.get_divisions(eq("memberUid", self.uid))
         return edap_divisions_schema.load(divisions_raw)
 
     def ensure_in_division(self, division_machine_name):
@@ -517,13 +522,15 @@ class LdapFranchise(Franchise, LdapMajorStructure):
         so there are teams for every <new franchise>-<division> combination.
 
         Should be called when new Franchise is created
+
+        Returns (dict): summary of Edap.ensure_teams_exist
         """
         from .serializers import edap_divisions_schema
         divisions = edap_divisions_schema.load(self.edap.get_divisions())
-        for division in divisions:
-            machine_name = self.edap.make_team_machine_name(self.machine_name, division.machine_name)
-            display_name = self.edap.make_team_display_name(self.display_name, division.display_name)
-            self.edap.create_team(machine_name, display_name)
+        return self.edap.ensure_teams_exist(
+            (self.edap.make_team_machine_name(self.machine_name, division.machine_name),
+             self.edap.make_team_display_name(self.display_name, division.display_name))
+            for division in divisions)
 
     @staticmethod
     def check_exists_by_display_name(display_name):
@@ -536,7 +543,7 @@ class LdapFranchise(Franchise, LdapMajorStructure):
         Returns (bool):
         """
         edap = get_edap()
-        franchises = edap.get_franchises(f'description={display_name}')
+        franchises = edap.get_franchises(eq("description", display_name))
         return bool(franchises)
 
     @staticmethod
@@ -609,7 +616,7 @@ class LdapDivision(Division, LdapMajorStructure):
         Returns (bool):
         """
         edap = get_edap()
-        divisions = edap.get_divisions(f'description={display_name}')
+        divisions = edap.get_divisions(eq("description", display_name))
         return bool(divisions)
 
     def create_teams(self):
@@ -617,14 +624,16 @@ class LdapDivision(Division, LdapMajorStructure):
          When a new division is created, an LDAP entry is created for it, and team entries are created as well,
          so there are teams for every <franchise>-<new division> combination.
 
-         Should be called when new Franchise is created
+         Should be called when new Division is created
+
+         Returns (dict): summary of Edap.ensure_teams_exist
          """
         from .serializers import edap_franchises_schema
         franchises = edap_franchises_schema.load(self.edap.get_franchises())
-        for franchise in franchises:
-            machine_name = self.edap.make_team_machine_name(franchise.machine_name, self.machine_name)
-            display_name = self.edap.make_team_display_name(franchise.display_name, self.display_name)
-            self.edap.create_team(machine_name, display_name)
+        return self.edap.ensure_teams_exist(
+            (self.edap.make_team_machine_name(franchise.machine_name, self.machine_name),
+             self.edap.make_team_display_name(franchise.display_name, self.display_name))
+            for franchise in franchises)
 
 
 class Team:
@@ -690,13 +699,81 @@ class LdapTeam(EdapMixin, Team):
         return edap_team_schema.load(inter_team)
 
 
+@jobs.job_step("user.flush_nextcloud_ldap_cache")
+def flush_nextcloud_ldap_cache_step(args, secrets):
+    flush_nextcloud_ldap_cache(get_nextcloud())
+
+
+@jobs.job_step("user.create_chat_account")
+def create_chat_account_step(args, secrets):
+    if "password" not in secrets:
+        raise jobs.JobStepError("The password is not available anymore, "
+                                "retry with the password or create the chat account manually")
+    user = LdapUser(uid=args["uid"], mail=args["mail"], given_name=args["given_name"])
+    res = user.create_chat_account(secrets["password"])
+    if not res.get("success"):
+        raise jobs.JobStepError(res.get("error", "Failed to create chat account"))
+    return res
+
+
+def _structure_of_job(args):
+    cls = {LdapFranchise.ENTITY_NAME: LdapFranchise, LdapDivision.ENTITY_NAME: LdapDivision}[args["entity"]]
+    return cls(machine_name=args["machine_name"], display_name=args["display_name"])
+
+
+@jobs.job_step("structure.create_teams")
+def create_teams_step(args, secrets):
+    summary = _structure_of_job(args).create_teams()
+    if summary["failed"]:
+        raise jobs.JobStepError(f"Failed to create teams: {summary['failed']}")
+    return summary
+
+
+@jobs.job_step("structure.create_chat_group")
+def create_chat_group_step(args, secrets):
+    structure = _structure_of_job(args)
+    if structure.group_exists():
+        return {"success": True}
+    res = structure.create_group()
+    if not res.get("success"):
+        raise jobs.JobStepError(res.get("error", "Failed to create chat group"))
+    return res
+
+
+@jobs.job_step("structure.create_main_folder")
+def create_main_folder_step(args, secrets):
+    structure = _structure_of_job(args)
+    # folder creation isn't idempotent, check first so that a step can be retried
+    if get_group_folder(structure.main_folder_path) is None and not structure.create_main_folder():
+        raise jobs.JobStepError(f"Failed to create folder {structure.main_folder_path}")
+    return {"success": True}
+
+
+@jobs.job_step("structure.create_dea_folder")
+def create_dea_folder_step(args, secrets):
+    structure = _structure_of_job(args)
+    if get_group_folder(structure.dea_folder_path) is None and not structure.create_dea_folder():
+        raise jobs.JobStepError(f"Failed to create folder {structure.dea_folder_path}")
+    return {"success": True}
+
+
 def bootstrap_ldap():
-    """ Create the basic structure """
+    """
+    Create the basic structure and divisions of the config that don't exist yet
+
+    Returns (dict): report of ensure_org_sanity, "divisions" lists machine names of created divisions
+    """
     from .. import edap
 
     e = get_edap()
     divisions = get_config_divisions()
-    edap.ensure_org_sanity(e)
+    report = edap.ensure_org_sanity(e)
+    existing = {division['cn'][0].decode('utf-8').lower() for division in e.get_divisions(attrlist=['cn'])}
+    report['divisions'] = []
     for code, desc in divisions.items():
+        if code.lower() in existing:
+            continue
         d = LdapDivision(machine_name=code, display_name=desc)
-        d.create()
+        d.create(wait=True)
+        report['divisions'].append(code)
+    return report
@@ -0,0 +1,132 @@
+"""
+List of frequent passwords kept as a sorted file that is memory-mapped and searched by bisection,
+so that it isn't loaded into every worker process and its pages are shared by all of them
+"""
+import gzip
+import mmap
+import os
+import sys
+import tempfile
+import threading
+
+SORTED_SUFFIX = ".sorted"
+
+_frequent_passwords = None
+_frequent_passwords_lock = threading.Lock()
+
+
+class SortedPasswordFile(object):
+    """ Membership test against a file of unique passwords, one per line, sorted bytewise """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = b""
+
+    def _line_at(self, data, pos):
+        """ Get (start, line) of the line containing position pos """
+        start = data.rfind(b"\n", 0, pos) + 1
+        end = data.find(b"\n", start)
+        if end < 0:
+            end = len(data)
+        return start, data[start:end]
+
+    def __contains__(self, password):
+        data = self._map
+        needle = password.encode("utf-8")
+        low, high = 0, len(data)
+        # bisect over byte offsets, every probe compares the line the offset falls into
+        while low < high:
+            mid = (low + high) // 2
+            start, line = self._line_at(data, mid)
+            if line == needle:
+                return True
+            if line < needle:
+                low = start + len(line) + 1
+            else:
+                high = start
+        return False
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+
+def _read_lines(source):
+    opener = gzip.open if source.endswith("gz") else open
+    with opener(source, "rb") as f:
+        for line in f:
+            line = line.rstrip()
+            if line:
+                yield line
+
+
+def build_sorted_password_file(source, target):
+    """
+    Write passwords of a plain or gzipped list to a file suitable for SortedPasswordFile
+
+    Args:
+        source (str): path of the list, one password per line, gzipped if it ends with 'gz'
+        target (str): path to write the sorted list to, it's replaced atomically
+    """
+    passwords = sorted(set(_read_lines(source)))
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target)), prefix=".passwords-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(b"\n".join(passwords))
+        os.replace(tmp, target)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def open_frequent_passwords(source):
+    """
+    Open list of frequent passwords, sorting it into a file next to it, or in the temp directory
+    if that's not writable, unless that's already been done
+
+    Args:
+        source (str): path of the list, one password per line, gzipped if it ends with 'gz'
+
+    Returns (SortedPasswordFile):
+    """
+    candidates = [source + SORTED_SUFFIX,
+                  os.path.join(tempfile.gettempdir(), os.path.basename(source) + SORTED_SUFFIX)]
+    for target in candidates:
+        if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+            return SortedPasswordFile(target)
+    try:
+        build_sorted_password_file(source, candidates[0])
+        return SortedPasswordFile(candidates[0])
+    except OSError:
+        build_sorted_password_file(source, candidates[1])
+        return SortedPasswordFile(candidates[1])
+
+
+def get_frequent_passwords():
+    """
+    Get the process-wide list of frequent passwords configured by the FREQUENT_PASSWORDS setting,
+    opened on first use
+
+    Returns (container): supports `in`, empty if no list is configured or it can't be opened
+    """
+    global _frequent_passwords
+    if _frequent_passwords is None:
+        with _frequent_passwords_lock:
+            if _frequent_passwords is None:
+                from ..settings import FREQUENT_PASSWORDS_FILENAME
+                passwords = frozenset()
+                if FREQUENT_PASSWORDS_FILENAME:
+                    try:
+                        passwords = open_frequent_passwords(FREQUENT_PASSWORDS_FILENAME)
+                    except Exception as exc:
+                        msg = (
+                            f"Tried to load list of frequent passwords from {FREQUENT_PASSWORDS_FILENAME}"
+                            f", failed: {str(exc)}")
+                        print(msg, file=sys.stderr)
+                _frequent_passwords = passwords
+    return _frequent_passwords
@@ -16,6 +16,11 @@ class BaseLdapSchema(Schema):
     class Meta:
         unknown = EXCLUDE
 
+    @classmethod
+    def ldap_attributes(cls):
+        """ Names of ldap attributes the schema loads, to request only those from ldap """
+        return [field.data_key or name for name, field in cls._declared_fields.items() if name != 'fqdn']
+
     def unpack_data(self, data):
         """ Unpack single value fields from list with single element to that element, str """
         # unpack ldap fields values that can have only one value
@@ -96,3 +101,7 @@ edap_franchises_schema = EdapFranchiseSchema(many=True)
 
 edap_team_schema = EdapTeamSchema()
 edap_teams_schema = EdapTeamSchema(many=True)
+
+# ldap attributes to request for objects loaded by the schemas above
+USER_ATTRIBUTES = UserSchema.ldap_attributes()
+GROUP_ATTRIBUTES = EdapTeamSchema.ldap_attributes()
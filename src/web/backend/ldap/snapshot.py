@@ -0,0 +1,367 @@
+"""
+In-memory snapshot of the directory, to serve read-heavy endpoints without hitting LDAP on every request
+"""
+import collections
+import itertools
+import logging
+import re
+import threading
+import time
+
+import ldap
+
+from ..edap import get_single_object, get_str, sort_entries, USER_QUERY_ATTRIBUTES
+from ..filters import eq, unescape_value
+
+# "attr=value" or "attr=value*", the only search shapes the snapshot answers by itself
+SIMPLE_SEARCH_RE = re.compile(r"^\(?(?P<attr>[\w-]+)=(?P<value>[^()*]*)(?P<prefix>\*)?\)?$")
+# memberUid has case exact matching rule, other attributes we filter by ignore case
+CASE_EXACT_ATTRIBUTES = {"memberuid"}
+
+logger = logging.getLogger()
+
+
+class UnsupportedSearch(ValueError):
+    """ Raised if a search filter is too complex to be evaluated against the snapshot """
+    pass
+
+
+def parse_simple_search(search):
+    """
+    Parse search filter the snapshot can evaluate
+
+    Args:
+        search (Filter or str): search filter, e.g. 'cn=PL-PUB' or 'description=Pol*'
+
+    Returns (tuple): (attribute, unescaped value, is_prefix) or None if there is nothing to filter by
+    """
+    if not search:
+        return None
+    match = SIMPLE_SEARCH_RE.match(str(search).strip())
+    if not match:
+        raise UnsupportedSearch(f"Search '{search}' can't be evaluated against the snapshot")
+    return match.group("attr"), unescape_value(match.group("value")), bool(match.group("prefix"))
+
+
+def entry_matches(entry, attr, value, is_prefix):
+    """ Check if entry (dict of attribute -> list of bytes) has an attribute value matching value or prefix """
+    case_exact = attr.lower() in CASE_EXACT_ATTRIBUTES
+    if not case_exact:
+        value = value.lower()
+    for key, values in entry.items():
+        if key.lower() != attr.lower():
+            continue
+        for each in values:
+            each = get_str(each)
+            if not case_exact:
+                each = each.lower()
+            if each == value or (is_prefix and each.startswith(value)):
+                return True
+    return False
+
+
+class DirectorySnapshot(object):
+    """
+    Compact copy of people, posix groups and organizational units, together with a reverse index
+    uid -> set of group dns, so that memberships of a user resolve without a search.
+
+    The snapshot is process-wide, it is refreshed when older than ttl seconds or after it has been invalidated,
+    which Edap instances do on every write they make.
+    """
+    PEOPLE_ATTRIBUTES = ["objectClass", "uid", "givenName", "sn", "cn", "mail", "mailAlias"]
+    GROUP_ATTRIBUTES = ["objectClass", "cn", "description", "gidNumber", "memberUid"]
+    ORG_UNIT_ATTRIBUTES = ["objectClass", "ou"]
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.loaded_at = None
+        self._stale = True
+        self._invalidated_at = None  # monotonic time of the last invalidation
+        self._written_dns = set()  # dns written since the last load or sync, they may have been deleted
+        self._written_lock = threading.Lock()
+        self._lock = threading.RLock()
+        # only people directly under this dn are kept, set from edap on refresh
+        self.people_dn = None
+        # callable fetching just the changes since the last load, set when DirectorySync keeps the snapshot current
+        self.updater = None
+
+        self.users = dict()  # lowercase uid -> entry
+        self.groups = dict()  # lowercase dn -> entry
+        self.groups_by_ou = collections.defaultdict(list)  # lowercase ou name -> entries
+        self.org_units = dict()  # lowercase dn -> entry
+        self.memberships = collections.defaultdict(set)  # uid -> set of lowercase group dns
+        self.sorted_users = dict()  # sort -> users sorted by it, built on demand
+
+    @classmethod
+    def all_attributes(cls):
+        """ Get union of attributes of all entry types, for searches fetching entries of every type at once """
+        return list(dict.fromkeys(cls.PEOPLE_ATTRIBUTES + cls.GROUP_ATTRIBUTES + cls.ORG_UNIT_ATTRIBUTES))
+
+    def invalidate(self, dn=None):
+        """ Mark the snapshot as outdated, the next read reloads or syncs it, checking whether dn was deleted """
+        if dn is not None:
+            with self._written_lock:
+                self._written_dns.add(dn)
+        self._invalidated_at = time.monotonic()
+        self._stale = True
+
+    def written_dns(self):
+        """ Get dns written since the last load or sync """
+        with self._written_lock:
+            return set(self._written_dns)
+
+    def forget_written_dns(self, dns):
+        """ Forget written dns once a load or sync has seen what happened to them """
+        with self._written_lock:
+            self._written_dns.difference_update(dns)
+
+    def is_fresh(self):
+        if self._stale or self.loaded_at is None:
+            return False
+        return time.monotonic() - self.loaded_at < self.ttl
+
+    def mark_synced(self, started):
+        """
+        Mark the snapshot as up to date, after it has been loaded or changes have been applied incrementally
+
+        Args:
+            started (float): monotonic time the load or sync started at, it stays outdated if invalidated since
+        """
+        self._stale = self._invalidated_at is not None and self._invalidated_at >= started
+        self.loaded_at = time.monotonic()
+
+    def ensure_fresh(self, edap):
+        """ Bring the snapshot up to date if it is outdated, incrementally if possible or by reloading it using edap """
+        if self.is_fresh():
+            return
+        if self.updater is not None:
+            try:
+                self.updater()
+            except Exception:
+                logger.exception("Incremental update of directory snapshot failed, reloading it")
+            if self.is_fresh():
+                return
+        with self._lock:
+            if not self.is_fresh():
+                self.refresh(edap)
+
+    def refresh(self, edap):
+        """ Load the whole snapshot with three searches """
+        with self._lock:
+            started = time.monotonic()
+            written = self.written_dns()
+            self.people_dn = edap.ACTIVE_PEOPLE_GROUP
+            people = edap.search_s(edap.ACTIVE_PEOPLE_GROUP, ldap.SCOPE_ONELEVEL,
+                                   "(objectClass=inetOrgPerson)", attrlist=self.PEOPLE_ATTRIBUTES)
+            groups = edap.search_s(edap.BASE_DN, ldap.SCOPE_SUBTREE,
+                                   "(objectClass=posixGroup)", attrlist=self.GROUP_ATTRIBUTES)
+            org_units = edap.search_s(edap.BASE_DN, ldap.SCOPE_SUBTREE,
+                                      "(objectClass=organizationalUnit)", attrlist=self.ORG_UNIT_ATTRIBUTES)
+            self.replace_all(people + groups + org_units)
+            self.forget_written_dns(written)
+            self.mark_synced(started)
+
+    def replace_all(self, entries):
+        """
+        Replace content of the snapshot
+
+        Args:
+            entries (list): (dn, attributes) tuples of people, posix groups and organizational units in any order
+        """
+        with self._lock:
+            users, groups, org_units = dict(), dict(), dict()
+            for dn, attrs in entries:
+                self._put(dn, attrs, users, groups, org_units)
+            self._publish(users, groups, org_units)
+
+    def apply_changes(self, updated=(), removed=()):
+        """
+        Patch the snapshot with entries changed since the last sync. Indexes are rebuilt into new dicts that replace
+        the current ones at once, so readers iterating the previous version are not disturbed.
+
+        Args:
+            updated (list): (dn, attributes) tuples of added or modified entries
+            removed (list): dns of deleted entries
+        """
+        with self._lock:
+            users, groups, org_units = dict(self.users), dict(self.groups), dict(self.org_units)
+            for dn in itertools.chain(removed, (dn for dn, _ in updated)):
+                self._discard(dn, users, groups, org_units)
+            for dn, attrs in updated:
+                self._put(dn, attrs, users, groups, org_units)
+            self._publish(users, groups, org_units)
+
+    def covers(self, attrlist):
+        """ Check if entries of the snapshot hold all given attributes """
+        attributes = {attr.lower() for attr in self.all_attributes()}
+        return all(attr.lower() in attributes for attr in attrlist)
+
+    def known_dns(self):
+        """ Get lowercase dns of all entries in the snapshot """
+        return {entry["fqdn"].lower() for entry in self.users.values()} | set(self.groups) | set(self.org_units)
+
+    def _put(self, dn, attrs, users, groups, org_units):
+        if dn is None:
+            return
+        object_classes = {get_str(each).lower() for each in attrs.get("objectClass", [])}
+        if "posixgroup" in object_classes:
+            groups[dn.lower()] = self._entry(dn, attrs, self.GROUP_ATTRIBUTES)
+        elif "organizationalunit" in object_classes:
+            org_units[dn.lower()] = self._entry(dn, attrs, self.ORG_UNIT_ATTRIBUTES)
+        elif "inetorgperson" in object_classes and attrs.get("uid") and self._is_active_person(dn):
+            users[get_str(attrs["uid"][0]).lower()] = self._entry(dn, attrs, self.PEOPLE_ATTRIBUTES)
+
+    @staticmethod
+    def _discard(dn, users, groups, org_units):
+        key = dn.lower()
+        groups.pop(key, None)
+        org_units.pop(key, None)
+        attr, _, value = dn.split(",", 1)[0].partition("=")
+        user = users.get(value.lower()) if attr.strip().lower() == "uid" else None
+        if user is not None and user["fqdn"].lower() == key:
+            del users[value.lower()]
+
+    def _publish(self, users, groups, org_units):
+        groups_by_ou = collections.defaultdict(list)
+        memberships = collections.defaultdict(set)
+        for key, entry in groups.items():
+            groups_by_ou[self._parent_ou_name(entry["fqdn"])].append(entry)
+            for uid in entry.get("memberUid", []):
+                memberships[get_str(uid)].add(key)
+
+        self.users = users
+        self.groups = groups
+        self.groups_by_ou = groups_by_ou
+        self.memberships = memberships
+        self.org_units = org_units
+        self.sorted_users = dict()
+
+    def _is_active_person(self, dn):
+        return self.people_dn is None or dn.split(",", 1)[-1].lower() == self.people_dn.lower()
+
+    @staticmethod
+    def _entry(dn, attrs, attributes):
+        """ Make snapshot entry out of search result, leaving out attributes the snapshot doesn't serve """
+        wanted = {attr.lower() for attr in attributes}
+        return {"fqdn": dn, **{key: value for key, value in attrs.items() if key.lower() in wanted}}
+
+    @staticmethod
+    def _parent_ou_name(dn):
+        parent_rdn = dn.split(",")[1] if "," in dn else ""
+        attr, _, value = parent_rdn.partition("=")
+        return value.lower() if attr.strip().lower() == "ou" else None
+
+    @staticmethod
+    def _filter(entries, search):
+        """ Filter entries by a simple search and return copies, as schemas modify the dicts they load """
+        criteria = parse_simple_search(search)
+        if criteria is not None:
+            entries = [entry for entry in entries if entry_matches(entry, *criteria)]
+        return [dict(entry) for entry in entries]
+
+    def get_users(self, search=None):
+        return self._filter(self.users.values(), search)
+
+    def get_users_page(self, offset=0, limit=50, sort=None, query=None):
+        """ Get a window of users from the sorted index, with the exact total count """
+        users = self._sorted_users(sort or "uid")
+        if query:
+            query = query.lower()
+            users = [entry for entry in users
+                     if any(query in get_str(value).lower()
+                            for attr in USER_QUERY_ATTRIBUTES for value in entry.get(attr, []))]
+        return [dict(entry) for entry in users[offset:offset + limit]], len(users)
+
+    def _sorted_users(self, sort):
+        sorted_users = self.sorted_users
+        if sort not in sorted_users:
+            entries = list(self.users.values())
+            sort_entries(entries, sort)
+            sorted_users[sort] = entries
+        return sorted_users[sort]
+
+    def get_user(self, uid):
+        entry = self.users.get(uid.lower())
+        return get_single_object([dict(entry)] if entry else [])
+
+    def get_user_groups(self, uid):
+        return [dict(self.groups[dn]) for dn in sorted(self.memberships.get(uid, ())) if dn in self.groups]
+
+    def get_groups(self, search=None, organizational_unit=None):
+        if organizational_unit is None:
+            entries = self.groups.values()
+        else:
+            entries = self.groups_by_ou.get(organizational_unit.lower(), [])
+
+        criteria = parse_simple_search(search)
+        if criteria is not None and criteria[0].lower() == "memberuid" and not criteria[2]:
+            # answer membership searches from the reverse index
+            group_dns = self.memberships.get(criteria[1], set())
+            return [dict(entry) for entry in entries if entry["fqdn"].lower() in group_dns]
+        return self._filter(entries, search)
+
+    def reader(self, edap):
+        """ Get an object to read from, that refreshes the snapshot with given edap when needed """
+        return SnapshotReader(self, edap)
+
+
+class SnapshotReader(object):
+    """
+    Drop-in replacement of Edap for reads: supported getters are answered from the snapshot,
+    searches the snapshot can't evaluate and everything else are passed to the edap
+    """
+
+    def __init__(self, snapshot, edap):
+        self.snapshot = snapshot
+        self.edap = edap
+
+    def __getattr__(self, name):
+        return getattr(self.edap, name)
+
+    def _read(self, method_name, *args, attrlist=None, **kwargs):
+        if attrlist is not None and not self.snapshot.covers(attrlist):
+            return getattr(self.edap, method_name)(*args, attrlist=attrlist, **kwargs)
+        self.snapshot.ensure_fresh(self.edap)
+        try:
+            return getattr(self.snapshot, method_name)(*args, **kwargs)
+        except UnsupportedSearch:
+            return getattr(self.edap, method_name)(*args, attrlist=attrlist, **kwargs)
+
+    def get_users(self, search=None, attrlist=None):
+        return self._read("get_users", search, attrlist=attrlist)
+
+    def iter_users(self, search=None, page_size=None, attrlist=None):
+        return iter(self.get_users(search, attrlist=attrlist))
+
+    def get_users_page(self, offset=0, limit=50, sort=None, query=None, attrlist=None):
+        return self._read("get_users_page", offset=offset, limit=limit, sort=sort, query=query, attrlist=attrlist)
+
+    def get_user(self, uid, attrlist=None):
+        return self._read("get_user", uid, attrlist=attrlist)
+
+    def get_user_groups(self, uid, attrlist=None):
+        return self._read("get_user_groups", uid, attrlist=attrlist)
+
+    def get_groups(self, search=None, organizational_unit=None, attrlist=None):
+        return self._read("get_groups", search, organizational_unit=organizational_unit, attrlist=attrlist)
+
+    def iter_groups(self, search=None, organizational_unit=None, page_size=None, attrlist=None):
+        return iter(self.get_groups(search, organizational_unit=organizational_unit, attrlist=attrlist))
+
+    def get_teams(self, search=None, attrlist=None):
+        return self.get_groups(search, organizational_unit=self.edap.TEAMS_GROUP_NAME, attrlist=attrlist)
+
+    def get_team(self, name, attrlist=None):
+        return get_single_object(self.get_teams(eq("cn", name), attrlist=attrlist))
+
+    def get_franchises(self, search=None, attrlist=None):
+        return self.get_groups(search, organizational_unit=self.edap.FRANCHISES_GROUP_NAME, attrlist=attrlist)
+
+    def get_franchise(self, code, attrlist=None):
+        return get_single_object(self.get_franchises(eq("cn", code), attrlist=attrlist))
+
+    def get_divisions(self, search=None, attrlist=None):
+        return self.get_groups(search, organizational_unit=self.edap.DIVISIONS_GROUP_NAME, attrlist=attrlist)
+
+    def get_division(self, machine_name, attrlist=None):
+        return get_single_object(self.get_divisions(eq("cn", machine_name), attrlist=attrlist))
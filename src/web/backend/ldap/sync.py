@@ -0,0 +1,306 @@
+"""
+Background synchronization keeping the directory snapshot current by fetching only what changed on the server.
+
+RFC 4533 content synchronization (syncrepl, refreshOnly mode) is used when the server advertises it,
+otherwise entries are polled by modifyTimestamp and deletions are found by a periodic comparison of dns.
+Entries written by the app are looked up on the next poll, so that its own deletions don't wait for the comparison.
+"""
+import logging
+import threading
+import time
+
+import ldap
+import ldap.ldapobject
+from ldap.syncrepl import SyncreplConsumer
+
+from ..edap import get_str
+
+logger = logging.getLogger()
+
+SYNCREPL_CONTROL_OID = "1.3.6.1.4.1.4203.1.9.1.1"
+SYNC_FILTER = "(|(objectClass=inetOrgPerson)(objectClass=posixGroup)(objectClass=organizationalUnit))"
+
+
+def csn_from_cookie(cookie):
+    """
+    Get change sequence number from syncrepl cookie
+
+    Args:
+        cookie (str|bytes): e.g. 'rid=000,csn=20200101120000.000000Z#000000#000#000000'
+
+    Returns (str): csn or None if the cookie doesn't contain one
+    """
+    if not cookie:
+        return None
+    for part in get_str(cookie).split(","):
+        key, _, value = part.partition("=")
+        if key.strip() == "csn":
+            return value
+    return None
+
+
+class SyncreplConnection(ldap.ldapobject.ReconnectLDAPObject, SyncreplConsumer):
+    """ Connection running refreshOnly syncrepl searches, passing the results to DirectorySync """
+
+    def __init__(self, uri, directory_sync, **kwargs):
+        super().__init__(uri, **kwargs)
+        self.directory_sync = directory_sync
+
+    def syncrepl_get_cookie(self):
+        return self.directory_sync.cookie
+
+    def syncrepl_set_cookie(self, cookie):
+        self.directory_sync.cookie = cookie
+
+    def syncrepl_entry(self, dn, attributes, uuid):
+        self.directory_sync.syncrepl_entry(dn, attributes, uuid)
+
+    def syncrepl_delete(self, uuids):
+        self.directory_sync.syncrepl_delete(uuids)
+
+    def syncrepl_present(self, uuids, refreshDeletes=False):
+        self.directory_sync.syncrepl_present(uuids, refreshDeletes)
+
+
+class DirectorySync(object):
+    """
+    Keeps DirectorySnapshot up to date with incremental polls, run periodically by a background thread
+    and on demand by readers finding the snapshot invalidated.
+    """
+    MODE_AUTO = "auto"
+    MODE_SYNCREPL = "syncrepl"
+    MODE_TIMESTAMP = "timestamp"
+    # in timestamp mode written entries are looked up one by one up to this many, dns are compared if there are more
+    MAX_WRITTEN_LOOKUPS = 50
+
+    def __init__(self, snapshot, uri, bind_dn, password, base_dn, people_dn, interval=30, mode=MODE_AUTO,
+                 reconcile_every=20, network_timeout=5):
+        """
+        Args:
+            snapshot (DirectorySnapshot): snapshot to keep current
+            uri (str): ldap server uri
+            bind_dn (str): dn to bind as
+            password (str): password of bind_dn
+            base_dn (str): dn of subtree to synchronize
+            people_dn (str): dn of active people, the only people the snapshot keeps
+            interval (int): seconds between polls of the background thread
+            mode (str): 'syncrepl', 'timestamp' or 'auto' to detect what the server supports
+            reconcile_every (int): in timestamp mode look for deleted entries on every n-th poll
+            network_timeout (int): seconds to wait for the server when connecting
+        """
+        self.snapshot = snapshot
+        self.uri = uri
+        self.bind_dn = bind_dn
+        self.password = password
+        self.base_dn = base_dn
+        self.interval = interval
+        self.mode = mode
+        self.reconcile_every = max(reconcile_every, 1)
+        self.network_timeout = network_timeout
+
+        self.cookie = None  # syncrepl cookie, it holds csn of the last change seen
+        self.last_timestamp = None  # highest modifyTimestamp seen, in generalized time
+        self.last_sync = None
+        self.polls = 0
+        self.errors = 0
+        self.last_error = None
+
+        self._conn = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        # state of a syncrepl refresh
+        self._uuid_dns = dict()  # entryUUID -> dn of every entry in the snapshot
+        self._updated = []
+        self._removed = []
+        self._present = set()
+
+        snapshot.people_dn = people_dn
+        snapshot.updater = self.poll
+
+    def start(self):
+        """ Start background thread polling the server every interval seconds """
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="directory-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._close()
+
+    def request_sync(self):
+        """ Make the background thread poll right away """
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Directory sync failed")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def poll(self):
+        """ Run one synchronization round, fetching only entries that changed since the previous one """
+        with self._lock:
+            started = time.monotonic()
+            written = self.snapshot.written_dns()
+            try:
+                conn = self._connection()
+                if self.mode == self.MODE_SYNCREPL:
+                    self._poll_syncrepl(conn)
+                else:
+                    self._poll_timestamp(conn, written)
+            except ldap.LDAPError as e:
+                self.errors += 1
+                self.last_error = str(e)
+                self._close()
+                raise
+            self.polls += 1
+            self.last_sync = time.time()
+            self.snapshot.forget_written_dns(written)
+            self.snapshot.mark_synced(started)
+
+    def status(self):
+        """ Get position and health of the synchronization """
+        return {
+            "mode": self.mode,
+            "last_csn": csn_from_cookie(self.cookie),
+            "last_timestamp": self.last_timestamp,
+            "last_sync": self.last_sync,
+            "lag": time.time() - self.last_sync if self.last_sync is not None else None,
+            "polls": self.polls,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
+
+    def _connect(self):
+        if self.mode == self.MODE_SYNCREPL:
+            conn = SyncreplConnection(self.uri, self)
+        else:
+            conn = ldap.initialize(self.uri)
+        conn.set_option(ldap.OPT_NETWORK_TIMEOUT, self.network_timeout)
+        conn.bind_s(self.bind_dn, self.password)
+        return conn
+
+    def _connection(self):
+        if self._conn is None:
+            if self.mode == self.MODE_AUTO:
+                self.mode = self.MODE_TIMESTAMP
+                conn = self._connect()
+                if self._supports_syncrepl(conn):
+                    conn.unbind_s()
+                    self.mode = self.MODE_SYNCREPL
+                    conn = self._connect()
+                logger.info(f"Directory sync uses {self.mode} mode")
+            else:
+                conn = self._connect()
+            self._conn = conn
+        return self._conn
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.unbind_s()
+            except ldap.LDAPError:
+                pass
+            self._conn = None
+
+    @staticmethod
+    def _supports_syncrepl(conn):
+        try:
+            root_dse = conn.search_s("", ldap.SCOPE_BASE, "(objectClass=*)", attrlist=["supportedControl"])
+        except ldap.LDAPError:
+            return False
+        return any(get_str(control) == SYNCREPL_CONTROL_OID
+                   for _, attrs in root_dse for control in attrs.get("supportedControl", []))
+
+    def _poll_timestamp(self, conn, written=()):
+        attrlist = self.snapshot.all_attributes() + ["modifyTimestamp"]
+        if self.last_timestamp is None:
+            entries = self._search(conn, SYNC_FILTER, attrlist)
+            self.snapshot.replace_all(entries)
+        else:
+            # >= so that changes made later within the same second are not missed, re-applying an entry is harmless
+            search = f"(&{SYNC_FILTER}(modifyTimestamp>={self.last_timestamp}))"
+            entries = self._search(conn, search, attrlist)
+            if self.polls % self.reconcile_every == 0 or len(written) > self.MAX_WRITTEN_LOOKUPS:
+                # deletions leave no trace to poll for, compare dns instead - '1.1' requests no attributes
+                present = {dn.lower() for dn, _ in self._search(conn, SYNC_FILTER, ["1.1"])}
+                removed = [dn for dn in self.snapshot.known_dns() if dn not in present]
+            else:
+                removed = [dn for dn in written if not self._exists(conn, dn)]
+            self.snapshot.apply_changes(updated=entries, removed=removed)
+
+        # generalized time of the same precision sorts as string
+        timestamps = [get_str(attrs["modifyTimestamp"][0]) for _, attrs in entries if attrs.get("modifyTimestamp")]
+        if self.last_timestamp is not None:
+            timestamps.append(self.last_timestamp)
+        if timestamps:
+            self.last_timestamp = max(timestamps)
+
+    @staticmethod
+    def _exists(conn, dn):
+        try:
+            return bool(conn.search_s(dn, ldap.SCOPE_BASE, SYNC_FILTER, attrlist=["1.1"]))
+        except ldap.NO_SUCH_OBJECT:
+            return False
+
+    def _search(self, conn, search, attrlist):
+        return [(dn, attrs) for dn, attrs in conn.search_s(self.base_dn, ldap.SCOPE_SUBTREE, search,
+                                                           attrlist=attrlist) if dn is not None]
+
+    def _poll_syncrepl(self, conn):
+        initial = self.cookie is None
+        self._begin_refresh()
+        msgid = conn.syncrepl_search(self.base_dn, ldap.SCOPE_SUBTREE, mode="refreshOnly",
+                                     filterstr=SYNC_FILTER, attrlist=self.snapshot.all_attributes())
+        while conn.syncrepl_poll(msgid=msgid, all=1):
+            pass
+        self._finish_refresh(initial)
+
+    def _begin_refresh(self):
+        self._updated, self._removed, self._present = [], [], set()
+
+    def _finish_refresh(self, initial):
+        if initial:
+            self.snapshot.replace_all(self._updated)
+        else:
+            self.snapshot.apply_changes(updated=self._updated, removed=self._removed)
+
+    def syncrepl_entry(self, dn, attributes, uuid):
+        """ Entry was added or modified """
+        previous_dn = self._uuid_dns.get(uuid)
+        if previous_dn is not None and previous_dn.lower() != dn.lower():
+            self._removed.append(previous_dn)
+        self._uuid_dns[uuid] = dn
+        self._updated.append((dn, attributes))
+        self._present.add(uuid)
+
+    def syncrepl_delete(self, uuids):
+        """ Entries were deleted """
+        for uuid in uuids:
+            dn = self._uuid_dns.pop(uuid, None)
+            if dn is not None:
+                self._removed.append(dn)
+
+    def syncrepl_present(self, uuids, refresh_deletes=False):
+        """
+        Entries are unchanged, uuids None marks the end of present phase - entries not reported are deleted,
+        unless the server sent explicit deletions instead (refresh_deletes)
+        """
+        if uuids is not None:
+            self._present.update(uuids)
+            return
+        if not refresh_deletes:
+            self.syncrepl_delete([uuid for uuid in self._uuid_dns if uuid not in self._present])
+        self._present = set()
@@ -1,28 +1,224 @@
+import base64
+import json
 import logging
+import threading
 
-from flask import g, current_app
+from flask import g, current_app, has_request_context
 from .. import edap
+from ..metrics import get_call_tracker
+from .authcache import MembershipCache
+from .login import LoginGuard
+from .snapshot import DirectorySnapshot
+from .sync import DirectorySync
 import configparser
 
 logger = logging.getLogger()
 
+_edap_pool = None
+_edap_pool_lock = threading.Lock()
+
+_directory_snapshot = None
+_directory_snapshot_lock = threading.Lock()
+_directory_sync = None
+
+_membership_cache = None
+_membership_cache_lock = threading.Lock()
+
+_login_guard = None
+_login_guard_lock = threading.Lock()
+
+
+def get_edap_pool():
+    """ Create if doesn't exist or return the process-wide pool of bound ldap connections """
+    global _edap_pool
+    if _edap_pool is None:
+        with _edap_pool_lock:
+            if _edap_pool is None:
+                config = current_app.config
+                base_dn = edap.make_base_dn(config['EDAP_DOMAIN'])
+                _edap_pool = edap.LdapConnectionPool(
+                    f"ldap://{config['EDAP_HOSTNAME']}",
+                    f"{config['EDAP_USER']},{base_dn}",
+                    config['EDAP_PASSWORD'],
+                    max_size=config.get('EDAP_POOL_SIZE', 10),
+                    idle_timeout=config.get('EDAP_POOL_IDLE_TIMEOUT', 300),
+                    checkout_timeout=config.get('EDAP_POOL_CHECKOUT_TIMEOUT', 10))
+    return _edap_pool
+
+
+def get_directory_snapshot():
+    """ Create if doesn't exist or return the process-wide directory snapshot, None if it's disabled """
+    global _directory_snapshot
+    ttl = current_app.config.get('EDAP_CACHE_TTL', 0)
+    if not ttl:
+        return None
+    if _directory_snapshot is None:
+        with _directory_snapshot_lock:
+            if _directory_snapshot is None:
+                snapshot = DirectorySnapshot(ttl=ttl)
+                start_directory_sync(snapshot)
+                _directory_snapshot = snapshot
+    return _directory_snapshot
+
+
+def start_directory_sync(snapshot):
+    """ Start keeping the snapshot current by incremental polls in background, if EDAP_SYNC_INTERVAL is set """
+    global _directory_sync
+    config = current_app.config
+    interval = config.get('EDAP_SYNC_INTERVAL', 0)
+    if not interval:
+        return None
+    base_dn = edap.make_base_dn(config['EDAP_DOMAIN'])
+    _directory_sync = DirectorySync(
+        snapshot,
+        f"ldap://{config['EDAP_HOSTNAME']}",
+        f"{config['EDAP_USER']},{base_dn}",
+        config['EDAP_PASSWORD'],
+        base_dn,
+        f"ou=active,ou=people,{base_dn}",
+        interval=interval,
+        mode=config.get('EDAP_SYNC_MODE', DirectorySync.MODE_AUTO))
+    _directory_sync.start()
+    return _directory_sync
+
+
+def get_directory_sync():
+    """ Get the process-wide directory sync, None if it isn't running """
+    get_directory_snapshot()
+    return _directory_sync
+
+
+def get_membership_cache():
+    """ Create if doesn't exist or return the process-wide cache of special group memberships, None if disabled """
+    global _membership_cache
+    ttl = current_app.config.get('EDAP_AUTH_CACHE_TTL', 0)
+    if not ttl:
+        return None
+    if _membership_cache is None:
+        with _membership_cache_lock:
+            if _membership_cache is None:
+                _membership_cache = MembershipCache(ttl=ttl)
+    return _membership_cache
+
+
+def uid_is_member_of_special_groups(uid, groups):
+    """
+    Check if user is member of any of special groups, using the membership cache
+
+    Args:
+        uid (str): user's uid
+        groups (list): names of special groups
+
+    Returns (bool):
+    """
+    cache = get_membership_cache()
+    if cache is None:
+        e = get_edap()
+        return any(e.uid_is_member_of_special_group(uid, group) for group in groups)
+    unknown = []
+    for group in groups:
+        is_member = cache.get(uid, group)
+        if is_member:
+            return True
+        if is_member is None:
+            unknown.append(group)
+    for group in unknown:
+        is_member = bool(get_edap().uid_is_member_of_special_group(uid, group))
+        cache.set(uid, group, is_member)
+        if is_member:
+            return True
+    return False
+
+
+def get_login_guard():
+    """ Create if doesn't exist or return the process-wide guard throttling and measuring password logins """
+    global _login_guard
+    if _login_guard is None:
+        with _login_guard_lock:
+            if _login_guard is None:
+                _login_guard = LoginGuard(max_failures=current_app.config.get('LOGIN_MAX_FAILURES', 5),
+                                          window=current_app.config.get('LOGIN_FAILURE_WINDOW', 300))
+    return _login_guard
+
 
 def get_edap():
-    """ Create if doesn't exist or return edap from flask g object """
+    """
+    Create if doesn't exist or return edap from flask g object, its connection is checked out of the pool.
+    In requests, its identical searches are sent once, see Edap.enable_search_cache
+    """
     if 'edap' not in g:
-        g.edap = edap.Edap(current_app.config['EDAP_HOSTNAME'],
+        e = edap.Edap(current_app.config['EDAP_HOSTNAME'],
                       current_app.config['EDAP_USER'],
                       current_app.config['EDAP_PASSWORD'],
-                      current_app.config['EDAP_DOMAIN'])
+                      current_app.config['EDAP_DOMAIN'],
+                      pool=get_edap_pool(),
+                      page_size=current_app.config.get('EDAP_PAGE_SIZE'))
+        snapshot = get_directory_snapshot()
+        if snapshot is not None:
+            e.write_listeners.append(snapshot.invalidate)
+        membership_cache = get_membership_cache()
+        if membership_cache is not None:
+            e.write_listeners.append(membership_cache.invalidate)
+        if has_request_context() and current_app.config.get('EDAP_REQUEST_CACHE', True):
+            e.enable_search_cache(maxsize=current_app.config.get('EDAP_REQUEST_CACHE_SIZE', 1000))
+        call_tracker = get_call_tracker()
+        if call_tracker is not None:
+            e.call_listeners.append(call_tracker.ldap_listener)
+        g.edap = e
     return g.edap
 
 
+def get_directory():
+    """ Get object to read the directory with - the snapshot reader if the snapshot is enabled, edap otherwise """
+    snapshot = get_directory_snapshot()
+    if snapshot is None:
+        return get_edap()
+    return snapshot.reader(get_edap())
+
+
+def release_edap(exc=None):
+    """ Return connection of the edap from flask g object to the pool, registered as app context teardown """
+    e = g.pop('edap', None)
+    if e is not None:
+        e.release()
+
+
 class EdapMixin:
 
     @property
     def edap(self):
         return get_edap()
 
+    @property
+    def directory(self):
+        """ Use for reads that may be served from the directory snapshot """
+        return get_directory()
+
+
+def encode_cursor(position):
+    """
+    Make opaque pagination cursor
+
+    Args:
+        position (dict): json serializable position of the next page, e.g. {'offset': 50, 'sort': 'uid'}
+
+    Returns (str): url safe token
+    """
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """ Get position out of cursor made by encode_cursor, raise ValueError if the cursor is malformed """
+    position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(position, dict):
+        raise ValueError(f"Malformed cursor {cursor}")
+    offset = position.get("offset")
+    if not isinstance(offset, int) or isinstance(offset, bool):
+        raise ValueError(f"Malformed offset in cursor {cursor}")
+    if any(not isinstance(position.get(key), (str, type(None))) for key in ("sort", "query")):
+        raise ValueError(f"Malformed sort or query in cursor {cursor}")
+    return position
+
 
 def get_config_divisions():
     """ Get divisions from config file `ldap.ini` where key is division machine_name, value is display name """
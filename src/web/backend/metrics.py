@@ -0,0 +1,384 @@
+"""
+Count, latency and size of calls to LDAP, Rocket.Chat and Nextcloud.
+
+Totals of the process are exported by /metrics in Prometheus text format, calls made by one request are summed up
+in its Server-Timing header. In debug mode, requests calling the same operation of the same shape many times,
+e.g. subobject_exists_at in a loop, are logged as likely N+1 patterns.
+"""
+import collections
+import logging
+import re
+import threading
+import time
+from functools import partial
+
+import flask
+
+logger = logging.getLogger()
+
+SERVICES = ("ldap", "rocket", "nextcloud")
+# upper bounds in seconds of latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# distinct shapes counted, further ones are counted as OTHER_SHAPE
+MAX_SHAPES = 500
+OTHER_SHAPE = "other"
+
+LDAP_SCOPES = {0: "base", 1: "onelevel", 2: "subtree"}
+LDAP_SEARCHES = ("search_s", "search_ext", "search_ext_s")
+
+_call_metrics = None
+_call_metrics_lock = threading.Lock()
+
+
+def generalize_dn(dn):
+    """ Replace values of cn and uid RDNs by '*', e.g. 'cn=pl,ou=franchises,dc=example' -> 'cn=*,ou=franchises,...' """
+    return re.sub(r"\b(cn|uid)=[^,]*", r"\1=*", dn, flags=re.IGNORECASE)
+
+
+def _generalize_assertion(match):
+    attr, operator, value = match.groups()
+    return f"({attr}{operator}{value if attr.lower() == 'objectclass' else '*'})"
+
+
+def generalize_filter(search):
+    """
+    Replace assertion values of search filter by '*', except object classes,
+    e.g. '(&(objectClass=posixGroup)(cn=pl))' -> '(&(objectClass=posixGroup)(cn=*))'
+    """
+    return re.sub(r"\(([\w.;-]+)(~=|<=|>=|=)([^()]*)\)", _generalize_assertion, search)
+
+
+def ldap_call_shape(method_name, args):
+    """
+    Describe ldap call without its values, so that calls differing only in values have the same shape
+
+    Args:
+        method_name (str): method of the ldap connection
+        args (tuple): its positional arguments
+
+    Returns (str): e.g. 'cn=*,ou=teams,dc=example,dc=com base (objectClass=*)', None if args don't tell
+    """
+    if method_name in LDAP_SEARCHES and len(args) >= 2:
+        search = args[2] if len(args) > 2 else "(objectClass=*)"
+        return f"{generalize_dn(args[0])} {LDAP_SCOPES.get(args[1], args[1])} {generalize_filter(search)}"
+    if args and isinstance(args[0], str):
+        return generalize_dn(args[0])
+    return None
+
+
+def ldap_result_size(result):
+    """ Approximate bytes of entries returned by search_s or result3 - dns and attribute values """
+    entries = result[1] if isinstance(result, tuple) and len(result) > 1 else result
+    if not isinstance(entries, list):
+        return 0
+    size = 0
+    for entry in entries:
+        if not isinstance(entry, tuple) or len(entry) != 2:
+            continue
+        dn, attrs = entry
+        size += len(dn or "")
+        if isinstance(attrs, dict):
+            size += sum(len(value) for values in attrs.values() for value in values)
+    return size
+
+
+def response_size(res):
+    """ Bytes of body of a requests response, or of one wrapped by a Nextcloud OCS response """
+    for each in (res, getattr(res, "raw", None)):
+        content = getattr(each, "content", None)
+        if isinstance(content, bytes):
+            return len(content)
+    return 0
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class Histogram(object):
+    """ Counts of observations in cumulative buckets, as Prometheus histograms """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """ Get (upper bound, count of observations up to it) pairs, the last bound is '+Inf' """
+        total, pairs = 0, []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            pairs.append((bound, total))
+        pairs.append(("+Inf", self.count))
+        return pairs
+
+
+class CallMetrics(object):
+    """ Process-wide totals of calls to services, thread-safe """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, max_shapes=MAX_SHAPES):
+        self.buckets = buckets
+        self.max_shapes = max_shapes
+        self.calls = collections.Counter()  # (service, operation, view) -> count
+        self.errors = collections.Counter()  # (service, operation) -> count
+        self.response_bytes = collections.Counter()  # (service, operation) -> bytes
+        self.latency = dict()  # (service, operation) -> Histogram
+        self.shapes = collections.Counter()  # (service, operation, shape) -> count
+        self.repeated = collections.Counter()  # (view, service, operation, shape) -> requests that repeated it
+        self._lock = threading.Lock()
+
+    def record(self, service, operation, seconds, size=0, shape=None, view=None, error=False):
+        """
+        Record one call
+
+        Args:
+            service (str): one of SERVICES
+            operation (str): method called, e.g. 'search_s' or 'groups_invite'
+            seconds (float): how long the call took
+            size (int): bytes returned
+            shape (str): call without its values, see ldap_call_shape
+            view (str): endpoint of the request the call was made for, None outside requests
+            error (bool): whether the call raised
+        """
+        with self._lock:
+            self.calls[(service, operation, view or "")] += 1
+            if error:
+                self.errors[(service, operation)] += 1
+            self.response_bytes[(service, operation)] += size
+            histogram = self.latency.get((service, operation))
+            if histogram is None:
+                histogram = self.latency[(service, operation)] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            if shape is not None:
+                key = (service, operation, shape)
+                if key not in self.shapes and len(self.shapes) >= self.max_shapes:
+                    key = (service, operation, OTHER_SHAPE)
+                self.shapes[key] += 1
+
+    def record_repeated(self, view, service, operation, shape):
+        with self._lock:
+            self.repeated[(view or "", service, operation, shape)] += 1
+
+    def render(self):
+        """ Get the metrics in Prometheus text exposition format """
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            family("teap_service_calls_total", "counter", "Calls to LDAP, Rocket.Chat and Nextcloud by view")
+            for (service, operation, view), count in sorted(self.calls.items()):
+                lines.append(f"teap_service_calls_total{_labels(service=service, operation=operation, view=view)}"
+                             f" {count}")
+            family("teap_service_call_errors_total", "counter", "Calls that raised")
+            for (service, operation), count in sorted(self.errors.items()):
+                lines.append(f"teap_service_call_errors_total{_labels(service=service, operation=operation)} {count}")
+            family("teap_service_response_bytes_total", "counter", "Bytes returned by calls")
+            for (service, operation), size in sorted(self.response_bytes.items()):
+                lines.append(f"teap_service_response_bytes_total{_labels(service=service, operation=operation)}"
+                             f" {size}")
+            family("teap_service_call_seconds", "histogram", "Latency of calls")
+            for (service, operation), histogram in sorted(self.latency.items()):
+                for bound, count in histogram.cumulative():
+                    labels = _labels(service=service, operation=operation, le=bound)
+                    lines.append(f"teap_service_call_seconds_bucket{labels} {count}")
+                labels = _labels(service=service, operation=operation)
+                lines.append(f"teap_service_call_seconds_sum{labels} {histogram.sum:.6f}")
+                lines.append(f"teap_service_call_seconds_count{labels} {histogram.count}")
+            family("teap_service_calls_by_shape_total", "counter", "Calls by base DN, scope and filter without values")
+            for (service, operation, shape), count in sorted(self.shapes.items()):
+                labels = _labels(service=service, operation=operation, shape=shape)
+                lines.append(f"teap_service_calls_by_shape_total{labels} {count}")
+            family("teap_repeated_calls_total", "counter", "Requests repeating a call of the same shape, in debug mode")
+            for (view, service, operation, shape), count in sorted(self.repeated.items()):
+                labels = _labels(view=view, service=service, operation=operation, shape=shape)
+                lines.append(f"teap_repeated_calls_total{labels} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class CallTracker(object):
+    """
+    Calls made for one request, or for work in an app context outside requests. Records them to CallMetrics
+    and sums them up per service. In debug mode, counts calls of the same shape to find repeated ones.
+    """
+
+    def __init__(self, metrics, view=None, debug=False):
+        """
+        Args:
+            metrics (CallMetrics): process-wide totals to record calls to
+            view (str): endpoint of the request
+            debug (bool): count calls by shape
+        """
+        self.metrics = metrics
+        self.view = view
+        self.debug = debug
+        self.totals = collections.OrderedDict((service, [0, 0.0]) for service in SERVICES)  # calls, seconds
+        self.by_shape = collections.Counter()  # (service, operation, shape) -> count, in debug mode
+        self._lock = threading.Lock()
+
+    def record(self, service, operation, seconds, size=0, shape=None, error=False):
+        self.metrics.record(service, operation, seconds, size=size, shape=shape, view=self.view, error=error)
+        with self._lock:
+            totals = self.totals.setdefault(service, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            if self.debug and shape is not None:
+                self.by_shape[(service, operation, shape)] += 1
+
+    def server_timing(self):
+        """ Get value of Server-Timing header, e.g. 'ldap;dur=12.5;desc="7 calls", rocket;dur=0.0;desc="0 calls"' """
+        with self._lock:
+            return ", ".join(f'{service};dur={seconds * 1000:.1f};desc="{calls} calls"'
+                             for service, (calls, seconds) in self.totals.items())
+
+    def repeated_calls(self, threshold):
+        """
+        Get calls made at least threshold times with the same shape
+
+        Returns (list): ((service, operation, shape), count) pairs, most repeated first
+        """
+        with self._lock:
+            return [(key, count) for key, count in self.by_shape.most_common() if count >= threshold]
+
+    def ldap_listener(self, method_name, args, seconds, result, error):
+        """ Call listener of Edap, see Edap.call_listeners """
+        self.record("ldap", method_name, seconds, size=ldap_result_size(result),
+                    shape=ldap_call_shape(method_name, args), error=error is not None)
+
+
+class InstrumentedClient(object):
+    """ Proxy of a Rocket.Chat or Nextcloud client recording calls of its methods to a CallTracker """
+
+    def __init__(self, client, service, tracker):
+        self._client = client
+        self._service = service
+        self._tracker = tracker
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name.startswith("_"):
+            return attr
+        return partial(self._call, name, attr)
+
+    def _call(self, name, method, *args, **kwargs):
+        start = time.perf_counter()
+        res, error = None, True
+        try:
+            res = method(*args, **kwargs)
+            error = False
+            return res
+        finally:
+            self._tracker.record(self._service, name, time.perf_counter() - start, size=response_size(res),
+                                 shape=name, error=error)
+
+
+def get_call_metrics():
+    """ Create if doesn't exist or return the process-wide CallMetrics """
+    global _call_metrics
+    if _call_metrics is None:
+        with _call_metrics_lock:
+            if _call_metrics is None:
+                _call_metrics = CallMetrics()
+    return _call_metrics
+
+
+def get_call_tracker():
+    """ Create if doesn't exist or return tracker of calls made in the current app context, None if disabled """
+    if not flask.current_app.config.get("METRICS_ENABLED", True):
+        return None
+    if "call_tracker" not in flask.g:
+        view = flask.request.endpoint if flask.has_request_context() else None
+        flask.g.call_tracker = CallTracker(get_call_metrics(), view=view,
+                                           debug=flask.current_app.config.get("METRICS_DEBUG", False))
+    return flask.g.call_tracker
+
+
+def instrument_client(client, service):
+    """
+    Wrap Rocket.Chat or Nextcloud client so that its calls are recorded, unless metrics are disabled
+
+    Args:
+        client: RocketChat or NextCloud
+        service (str): one of SERVICES
+
+    Returns: the proxied client, or client itself
+    """
+    tracker = get_call_tracker()
+    if tracker is None:
+        return client
+    return InstrumentedClient(client, service, tracker)
+
+
+def add_server_timing(response):
+    """ Sum up calls of the request in the Server-Timing header, registered as after_request """
+    tracker = flask.g.get("call_tracker")
+    if tracker is not None:
+        response.headers.add("Server-Timing", tracker.server_timing())
+    return response
+
+
+def report_repeated_calls(exc=None):
+    """ Log calls the request repeated METRICS_REPEATED_CALLS times or more, registered as teardown_request """
+    tracker = flask.g.get("call_tracker")
+    if tracker is None or not tracker.debug:
+        return
+    for (service, operation, shape), count in tracker.repeated_calls(
+            flask.current_app.config.get("METRICS_REPEATED_CALLS", 5)):
+        tracker.metrics.record_repeated(tracker.view, service, operation, shape)
+        logger.warning(f"{tracker.view} made {count} {service} {operation} calls of shape {shape}, "
+                       f"consider fetching them at once")
+
+
+def metrics_view():
+    """ Totals of calls to services, ldap connection pool and logins of this process, in Prometheus text format """
+    from .utils import auth_err_if_user_not_hr_admin
+    from .ldap.login import LOGIN_ERROR, LOGIN_INVALID, LOGIN_OK, LOGIN_THROTTLED
+    from .ldap.utils import get_edap_pool, get_login_guard
+
+    token = flask.current_app.config.get("METRICS_TOKEN")
+    if token:
+        if flask.request.headers.get("Authorization") != f"Bearer {token}":
+            return flask.jsonify(message="Invalid metrics token"), 401
+    else:
+        auth_err = auth_err_if_user_not_hr_admin()
+        if auth_err:
+            return auth_err
+
+    lines = [get_call_metrics().render().rstrip("\n")]
+    lines.append("# HELP teap_ldap_pool Usage of the ldap connection pool")
+    lines.append("# TYPE teap_ldap_pool gauge")
+    for key, value in get_edap_pool().stats().items():
+        lines.append(f"teap_ldap_pool{_labels(stat=key)} {value}")
+    login_stats = get_login_guard().stats()
+    lines.append("# HELP teap_login_latency_seconds Latency of recent password verifications")
+    lines.append("# TYPE teap_login_latency_seconds gauge")
+    for quantile, key in (("0.5", "latency_p50"), ("0.95", "latency_p95"), ("1", "latency_max")):
+        if login_stats[key] is not None:
+            lines.append(f"teap_login_latency_seconds{_labels(quantile=quantile)} {login_stats[key]}")
+    lines.append("# HELP teap_logins_total Password logins by outcome")
+    lines.append("# TYPE teap_logins_total counter")
+    for outcome in (LOGIN_OK, LOGIN_INVALID, LOGIN_THROTTLED, LOGIN_ERROR):
+        lines.append(f"teap_logins_total{_labels(outcome=outcome)} {login_stats[outcome]}")
+    lines.append("# HELP teap_login_throttled_uids Uids whose logins are currently rejected")
+    lines.append("# TYPE teap_login_throttled_uids gauge")
+    lines.append(f"teap_login_throttled_uids {login_stats['throttled_uids']}")
+    return flask.Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+def initialize_module(app):
+    app.after_request(add_server_timing)
+    app.teardown_request(report_repeated_calls)
+    app.add_url_rule("/metrics", "metrics", metrics_view, methods=["GET"])
@@ -45,51 +45,6 @@ def _spec_to_uids(edap, spec):
     return members
 
 
-def _ensure_that_groups_exist(rocket, group_names):
-    for name in group_names:
-        g = rocket.get_group_by_name(name)
-        if not g:
-            rocket.create_group(name)
-
-
-def _add_users_to_group(rocket, group_id, usernames):
-    for username in usernames:
-        rocket_user = rocket.get_user_by_username(username)
-        if not rocket_user:
-            logging.info(f"Couldn't find user '{username}'")
-            continue
-        r = rocket.invite_user_to_group(group_id, rocket_user["_id"])
-        if not r.ok:
-            logging.info(f"Couldn't add user '{username}': {r.reason}")
-
-
-def _kick_users_from_group(rocket, group_id, usernames):
-    for username in usernames:
-        rocket_user = rocket.get_user_by_username(username)
-        if not rocket_user:
-            logging.info(f"Couldn't find user '{username}'")
-            continue
-        r = rocket.kick_user_from_group(group_id, rocket_user["_id"])
-        if not r.ok:
-            logging.info(f"Couldn't remove user '{username}': {r.reason}")
-
-
-def _sync_users_in_special_rooms(rocket, group_name, intended_members):
-    _ensure_that_groups_exist(rocket, [group_name])
-    g = rocket.get_group_by_name(group_name)
-    if not g:
-        raise RuntimeError(f"Unable to create group '{group_name}'")
-
-    current_members = {x["username"] for x in get_members_of(rocket, g["_id"])}
-    new_members = intended_members.difference(current_members)
-    invalid_members = current_members.difference(intended_members)
-
-    logging.info(f"g {group_name}: current: {current_members}, adding {new_members}, removing {invalid_members}")
-
-    _add_users_to_group(rocket, g["_id"], new_members)
-    _kick_users_from_group(rocket, g["_id"], invalid_members)
-
-
 def get_franchises_mn_dn(edap):
     all_franchises_records = edap.get_franchises()
     entries = [
@@ -109,38 +64,40 @@ def get_members_of(rocket, group_id):
                 f"Error code {result.status_code}: {result.reason}"
         )
         raise RuntimeError(msg)
-    members = rocket.get_group_members(group_id).json()["members"]
-    return members
+    return result.json()["members"]
 
 
-def get_franchise_group_id(rocket, machine_name, display_name):
+def reconcile_rooms(rocket, rooms):
     """
-    Create the group if it doesn't exist
+    Sync members of chat groups concurrently
+
+    Args:
+        rocket (RocketChatService):
+        rooms (dict): group name -> set of usernames of intended members
+
+    Returns (dict): report of RoomReconciler
     """
-    from . import ldap
-    franchise = ldap.models.Franchise(machine_name=machine_name, display_name=display_name)
-    group = rocket.get_group_by_name(franchise.chat_name)
-    if not group:
-        franchise.create_group()
-        group = rocket.get_group_by_name(franchise.chat_name)
-        if not group:
-            msg = (
-                f"Unable to get room for franchise '{f_code}', "
-                f"although it has just been created under name of {franchise.chat_name}"
-            )
-            raise RuntimeError(msg)
-    return group["_id"]
+    from flask import current_app
+    from .rocket_chat.reconcile import RoomReconciler
+    reconciler = RoomReconciler(
+        rocket.bound(),
+        workers=current_app.config.get("ROCKETCHAT_WORKERS", 8),
+        rate=current_app.config.get("ROCKETCHAT_RATE_LIMIT", 20))
+    return reconciler.reconcile(rooms)
 
 
 def fill_teams(edap, teams):
     for name, spec in teams:
         intended_members = _spec_to_uids(edap, spec)
-        for uid in intended_members:
-            try:
-                edap.make_user_member_of_team(uid, name)
-            except Exception as exc:
-                msg = f"Error adding {uid} to team {name}: {exc}"
-                logging.error(msg)
+        try:
+            change = edap.add_group_members(f"cn={name},{edap.TEAMS_GROUP}", intended_members, ignore_missing=True)
+        except Exception as exc:
+            msg = f"Error adding {intended_members} to team {name}: {exc}"
+            logging.error(msg)
+            continue
+        for uid in change.missing:
+            msg = f"Error adding {uid} to team {name}: user doesn't exist"
+            logging.error(msg)
 
 
 def populate_groups(edap):
@@ -148,40 +105,38 @@ def populate_groups(edap):
     fill_teams(edap, groups_to_fill["teams"])
 
 
-def populate_special_rooms(edap, rocket):
-    special_rooms = get_special_rooms()
-    _ensure_that_groups_exist(rocket, special_rooms)
-    for r, spec in special_rooms.items():
-        intended_members = _spec_to_uids(edap, spec)
-        _sync_users_in_special_rooms(rocket, r, intended_members)
+def get_special_rooms_members(edap):
+    return {r: _spec_to_uids(edap, spec) for r, spec in get_special_rooms().items()}
 
 
-def sync_franchise_rooms(edap, rocket):
-    franchises = get_franchises_mn_dn(edap)
-    for machine_name, display_name in franchises:
-        chat_group_id = get_franchise_group_id(rocket, machine_name, display_name)
-        users_already_in_franchise_room = [
-                u["username"]
-                for u in get_members_of(rocket, chat_group_id)]
+def get_franchise_rooms_members(edap):
+    from . import ldap
+    rooms = dict()
+    for machine_name, display_name in get_franchises_mn_dn(edap):
+        franchise = ldap.models.Franchise(machine_name=machine_name, display_name=display_name)
+        rooms[franchise.chat_name] = set(get_members_of_franchise(edap, machine_name))
+    return rooms
+
+
+def populate_special_rooms(edap, rocket):
+    return reconcile_rooms(rocket, get_special_rooms_members(edap))
 
-        franchise_members = set(get_members_of_franchise(edap, machine_name))
-        users_to_invite = franchise_members.difference(users_already_in_franchise_room)
-        invalid_members = set(users_already_in_franchise_room).difference(franchise_members)
 
-        logging.info(f"f {display_name}: current: {users_already_in_franchise_room}, adding {users_to_invite}, removing {invalid_members}")
-        _add_users_to_group(rocket, chat_group_id, users_to_invite)
-        _kick_users_from_group(rocket, chat_group_id, invalid_members)
+def sync_franchise_rooms(edap, rocket):
+    return reconcile_rooms(rocket, get_franchise_rooms_members(edap))
 
 
 def populate_rooms(edap, rocket):
-    populate_special_rooms(edap, rocket)
-    sync_franchise_rooms(edap, rocket)
+    rooms = get_special_rooms_members(edap)
+    rooms.update(get_franchise_rooms_members(edap))
+    return reconcile_rooms(rocket, rooms)
 
 
 def maintain(edap, rocket):
     populate_groups(edap)
-    populate_rooms(edap, rocket)
+    report = populate_rooms(edap, rocket)
 
     from . import ldap
     ldap.models.LdapTeam.get_international_team()
     ldap.models.LdapTeam.get_everybody_team()
+    return report
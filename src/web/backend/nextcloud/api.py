@@ -2,6 +2,7 @@ from flask import Blueprint, jsonify, request, abort, current_app
 from flask.views import MethodView
 
 from ..edap import ConstraintError, MultipleObjectsFound, ObjectDoesNotExist
+from ..filters import eq, prefix
 
 from .. import utils
 from ..ldap.utils import EdapMixin
@@ -36,7 +37,7 @@ class GroupListViewSet(NextCloudMixin,
     def get(self):
         """ List groups """
         query = request.args.get('query')
-        search = f'cn={query}*' if query else None
+        search = prefix("cn", query) if query else None
         res = self.edap.get_groups(search=search)
         return jsonify([obj for obj in res]), 200
 
@@ -77,7 +78,7 @@ class GroupViewSet(NextCloudMixin, EdapMixin, MethodView):
     def get(self, group_name):
         """ List groups """
         try:
-            res = self.edap.get_groups(search=f'cn={group_name}')
+            res = self.edap.get_groups(search=eq("cn", group_name))
         except ConstraintError as e:
             return jsonify({'message': f'Group not found. {e}'}), 404
         if len(res) == 0:
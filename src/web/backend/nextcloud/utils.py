@@ -1,25 +1,166 @@
 import logging
+import threading
+import time
 
 from flask import g, current_app
 
 from nextcloud import NextCloud
 from nextcloud.base import Permission
 
+from ..metrics import instrument_client
+
 logger = logging.getLogger()
 
+_group_folder_index = None
+_group_folder_index_lock = threading.Lock()
+_ldap_cache_flusher = None
+_ldap_cache_flusher_lock = threading.Lock()
+
 
 def get_nextcloud():
     """ Create if doesn't exist or return edap from flask g object """
     if 'nextcloud' not in g:
-        g.nextcloud = NextCloud(endpoint=current_app.config['NEXTCLOUD_HOST'],
-                                user=current_app.config['NEXTCLOUD_USER'],
-                                password=current_app.config['NEXTCLOUD_PASSWORD'])
+        g.nextcloud = instrument_client(NextCloud(endpoint=current_app.config['NEXTCLOUD_HOST'],
+                                                  user=current_app.config['NEXTCLOUD_USER'],
+                                                  password=current_app.config['NEXTCLOUD_PASSWORD']), "nextcloud")
     return g.nextcloud
 
 
-def flush_nextcloud_ldap_cache(n):
-    config_id = n.get_ldap_lowest_existing_config_id()
-    n.ldap_cache_flush(config_id)
+class LdapCacheFlusher(object):
+    """
+    Coalesces flushes of Nextcloud LDAP cache - all flushes requested within window seconds are done by
+    a single flush in background. Id of the LDAP config is looked up once.
+    """
+
+    def __init__(self, app, window=5):
+        """
+        Args:
+            app (Flask): app to run background flushes in the context of
+            window (float): seconds to wait for more requests before flushing
+        """
+        self.app = app
+        self.window = window
+        self.config_id = None
+        self.requests = 0
+        self.flushes = 0
+        self._pending = None  # timer of the scheduled flush
+        self._lock = threading.Lock()
+
+    def request(self):
+        """ Schedule flush, unless one is scheduled already """
+        with self._lock:
+            self.requests += 1
+            if self._pending is None:
+                self._pending = threading.Timer(self.window, self._flush_in_background)
+                self._pending.daemon = True
+                self._pending.start()
+
+    def _flush_in_background(self):
+        with self._lock:
+            self._pending = None
+        try:
+            with self.app.app_context():
+                self.flush_now(get_nextcloud())
+        except Exception:
+            logger.exception("Failed to flush Nextcloud LDAP cache")
+
+    def flush_now(self, nxc):
+        """ Flush right away, the scheduled flush is cancelled as this one covers it """
+        with self._lock:
+            if self._pending is not None:
+                self._pending.cancel()
+                self._pending = None
+        if self.config_id is None:
+            self.config_id = nxc.get_ldap_lowest_existing_config_id()
+        res = nxc.ldap_cache_flush(self.config_id)
+        if not getattr(res, 'is_ok', True):
+            self.config_id = None  # the config may have been replaced, look it up again next time
+        self.flushes += 1
+        return res
+
+
+def get_ldap_cache_flusher():
+    """ Create if doesn't exist or return the process-wide LdapCacheFlusher """
+    global _ldap_cache_flusher
+    if _ldap_cache_flusher is None:
+        with _ldap_cache_flusher_lock:
+            if _ldap_cache_flusher is None:
+                _ldap_cache_flusher = LdapCacheFlusher(current_app._get_current_object(),
+                                                       window=current_app.config.get('NEXTCLOUD_FLUSH_WINDOW', 5))
+    return _ldap_cache_flusher
+
+
+def flush_nextcloud_ldap_cache(n, now=False):
+    """
+    Make Nextcloud see changes of LDAP
+
+    Args:
+        n (NextCloud): client
+        now (bool): flush before returning, otherwise the flush is coalesced with others in NEXTCLOUD_FLUSH_WINDOW
+    """
+    flusher = get_ldap_cache_flusher()
+    if now or not flusher.window:
+        return flusher.flush_now(n)
+    flusher.request()
+
+
+class GroupFolderIndex(object):
+    """
+    Ids of Nextcloud group folders by mount point, fetched with a single get_group_folders call and kept for ttl
+    seconds. Folders created through TEAP are written through, folders created elsewhere appear after ttl.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.folders = dict()  # mount point -> folder id
+        self.fetched = None  # monotonic time of the last fetch
+        self._lock = threading.Lock()
+
+    def is_fresh(self):
+        return self.fetched is not None and time.monotonic() - self.fetched < self.ttl
+
+    def refresh(self, nxc):
+        group_folders = nxc.get_group_folders().data
+        folders = dict()
+        if group_folders:  # if there is no group folders, response data will be empty list
+            for key, value in group_folders.items():
+                folders.setdefault(value['mount_point'], key)
+        self.folders = folders
+        self.fetched = time.monotonic()
+
+    def get(self, nxc, mount_point):
+        """
+        Get folder id by mount point, fetching all folders if the index is older than ttl
+
+        Args:
+            nxc (NextCloud): client to fetch folders with
+            mount_point (str): nextcloud folder mount point
+
+        Returns (str): folder id or None if there is no such folder
+        """
+        with self._lock:
+            if not self.is_fresh():
+                self.refresh(nxc)
+            return self.folders.get(mount_point)
+
+    def put(self, mount_point, folder_id):
+        """ Add folder that was just created """
+        with self._lock:
+            self.folders[mount_point] = str(folder_id)
+
+    def invalidate(self):
+        with self._lock:
+            self.fetched = None
+
+
+def get_group_folder_index():
+    """ Create if doesn't exist or return the process-wide index of group folders """
+    global _group_folder_index
+    if _group_folder_index is None:
+        with _group_folder_index_lock:
+            if _group_folder_index is None:
+                _group_folder_index = GroupFolderIndex(ttl=current_app.config.get('NEXTCLOUD_FOLDERS_TTL', 60))
+    return _group_folder_index
 
 
 def get_group_folder(mount_point):
@@ -31,13 +172,7 @@ def get_group_folder(mount_point):
 
     Returns:
     """
-    nxc = get_nextcloud()
-    group_folders = nxc.get_group_folders().data
-    if group_folders:  # if there is no group folders, response data will be empty list
-        for key, value in group_folders.items():
-            if value['mount_point'] == mount_point:
-                return key
-    return None
+    return get_group_folder_index().get(get_nextcloud(), mount_point)
 
 
 def check_consistency():
@@ -8,3 +8,4 @@ def register_blueprint(app):
 def initialize_module(app):
     from . import utils
     utils.populate_service(app.config["TEAP_USE_DB"])
+    utils.init_directory(app)
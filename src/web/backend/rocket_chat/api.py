@@ -106,8 +106,8 @@ class UserTeamsChatsViewSet(rutils.RocketMixin, EdapMixin, MethodView):
     @utils.authorize_only_hr_admins()
     def post(self, uid, team_machine_name):
         """ Add user to team chats """
-        from ..ldap.serializers import edap_team_schema
-        team = edap_team_schema.load(self.edap.get_team(team_machine_name))
+        from ..ldap.serializers import edap_team_schema, GROUP_ATTRIBUTES
+        team = edap_team_schema.load(self.edap.get_team(team_machine_name, attrlist=GROUP_ATTRIBUTES))
         try:
             franchise, division = team.get_team_components()
         except ObjectDoesNotExist:
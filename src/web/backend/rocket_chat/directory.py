@@ -0,0 +1,245 @@
+"""
+Process-wide caches of Rocket.Chat ids, so that users and rooms are not looked up again for every room or request
+"""
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """ Thread-safe mapping of at most maxsize entries, least recently used are evicted, entries expire after ttl """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def update(self, items):
+        for key, value in items:
+            self.set(key, value)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def pop_value(self, value):
+        """ Remove all keys mapped to value """
+        with self._lock:
+            for key in [key for key, (_, each) in self._data.items() if each == value]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RoomIndex(object):
+    """
+    Index of private groups by display name (fname).
+
+    The index is built by paging through groups.listAll, then kept current with rooms.get?updatedSince, which
+    reports rooms updated or removed since the previous refresh - it only covers rooms the api user is a member of,
+    e.g. rooms it created, so the index is rebuilt from scratch every rebuild_interval seconds as well.
+    """
+
+    def __init__(self, refresh_interval=30, rebuild_interval=300, page_size=500):
+        """
+        Args:
+            refresh_interval (int): max age in seconds of the index before lookups refresh it incrementally
+            rebuild_interval (int): seconds between full listings of groups
+            page_size (int): groups fetched per groups.listAll request
+        """
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.page_size = page_size
+        self.rooms = dict()  # fname -> group json object
+        self.built = None  # monotonic time of the last full listing
+        self.refreshed = None  # monotonic time of the last refresh
+        self.updated_since = None  # iso timestamp to pass as updatedSince of the next incremental refresh
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _now_iso():
+        # a second early, so that rooms updated during the refresh are reported again rather than missed
+        now = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        return now.isoformat(timespec="milliseconds") + "Z"
+
+    def rebuild(self, client):
+        """ List all groups page by page, replace the index if all pages were fetched """
+        started = self._now_iso()
+        rooms = dict()
+        offset = 0
+        while True:
+            res = client.groups_list_all(offset=offset, count=self.page_size, fields='{"fname": 1, "t": 1}')
+            if res.status_code != 200:
+                return False
+            data = res.json()
+            # "name" is Rocket-machine name, "fname" is display name.
+            for room in data["groups"]:
+                rooms.setdefault(room["fname"], room)
+            offset += len(data["groups"])
+            if not data["groups"] or offset >= data.get("total", 0):
+                break
+        with self._lock:
+            self.rooms = rooms
+            self.built = self.refreshed = time.monotonic()
+            self.updated_since = started
+        return True
+
+    def refresh(self, client):
+        """ Apply rooms updated and removed since the previous refresh, rebuild the index if that's not possible """
+        with self._lock:
+            if self.built is None or time.monotonic() - self.built >= self.rebuild_interval:
+                return self.rebuild(client)
+            started = self._now_iso()
+            res = client.rooms_get(updatedSince=self.updated_since)
+            if res.status_code != 200:
+                return self.rebuild(client)
+            data = res.json()
+            removed = {room["_id"] for room in data.get("remove", [])}
+            for room in data.get("update", []):
+                if room.get("t") == "p" and room.get("fname"):
+                    removed.discard(room["_id"])
+                    self.put(room)
+            if removed:
+                self.rooms = {fname: room for fname, room in self.rooms.items() if room["_id"] not in removed}
+            self.refreshed = time.monotonic()
+            self.updated_since = started
+            return True
+
+    def get(self, client, name):
+        """
+        Get group by display name, refreshing the index if it's older than refresh_interval or the group is missing
+
+        Returns (dict): group json object or None if it doesn't exist
+        """
+        with self._lock:
+            if self.refreshed is None or time.monotonic() - self.refreshed >= self.refresh_interval:
+                self.refresh(client)
+            elif name not in self.rooms:
+                self.refresh(client)
+            return self.rooms.get(name)
+
+    def put(self, room):
+        """ Add or update group, e.g. when it was just created """
+        with self._lock:
+            for fname in [fname for fname, each in self.rooms.items() if each["_id"] == room["_id"]]:
+                del self.rooms[fname]
+            self.rooms[room["fname"]] = room
+
+    def clear(self):
+        with self._lock:
+            self.rooms = dict()
+            self.built = self.refreshed = self.updated_since = None
+
+
+class RocketDirectory(object):
+    """
+    Maps usernames to user ids and room display names (fname) to rooms.
+
+    All users are prefetched with paginated users.list at most once per ttl, a username still missing after that is
+    looked up individually. Entries are updated by RocketChatService when users are created or deleted.
+    """
+
+    def __init__(self, ttl=300, maxsize=10000, page_size=500, rooms_refresh_interval=30):
+        """
+        Args:
+            ttl (int): seconds to keep users, between prefetches of users and between full listings of rooms
+            maxsize (int): max number of users kept
+            page_size (int): users or rooms fetched per request
+            rooms_refresh_interval (int): max age in seconds of the room index before it's refreshed
+        """
+        self.ttl = ttl
+        self.page_size = page_size
+        self.users = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.rooms = RoomIndex(refresh_interval=rooms_refresh_interval, rebuild_interval=ttl, page_size=page_size)
+        self.prefetched = None  # monotonic time of the last prefetch of users
+        self._prefetch_lock = threading.Lock()
+
+    def prefetch_users(self, client, force=False):
+        """
+        Fetch usernames and ids of all users, unless they were fetched within ttl
+
+        Args:
+            client (RocketChat): api client
+            force (bool): fetch even if users were fetched within ttl
+        """
+        with self._prefetch_lock:
+            if not force and self.prefetched is not None and time.monotonic() - self.prefetched < self.ttl:
+                return
+            offset = 0
+            while True:
+                res = client.users_list(offset=offset, count=self.page_size, fields='{"username": 1}')
+                if res.status_code != 200:
+                    return
+                data = res.json()
+                users = data['users']
+                self.users.update((user['username'], user['_id']) for user in users if user.get('username'))
+                offset += len(users)
+                if not users or offset >= data.get('total', 0):
+                    break
+            self.prefetched = time.monotonic()
+
+    def get_user_id(self, client, username, lookup):
+        """
+        Get id of user
+
+        Args:
+            client (RocketChat): api client
+            username (str):
+            lookup (callable): gets user json object by username, used when the user wasn't prefetched
+
+        Returns (str): id or None if user doesn't exist
+        """
+        user_id = self.users.get(username)
+        if user_id is None:
+            self.prefetch_users(client)
+            user_id = self.users.get(username)
+        if user_id is None:
+            rocket_user = lookup(username)
+            if rocket_user:
+                user_id = rocket_user['_id']
+                self.users.set(username, user_id)
+        return user_id
+
+    def get_room(self, client, name):
+        """
+        Get private group
+
+        Args:
+            client (RocketChat): api client
+            name (str): display name of the group
+
+        Returns (dict): group json object or None if the group doesn't exist
+        """
+        return self.rooms.get(client, name)
+
+    def clear(self):
+        self.users.clear()
+        self.rooms.clear()
+        self.prefetched = None
@@ -0,0 +1,158 @@
+"""
+Reconciliation of Rocket.Chat room members with intended members, running the http calls concurrently
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+logger = logging.getLogger()
+
+
+class HostRateLimiter(object):
+    """ Spaces out requests to the same host to at most `rate` per second, shared by all threads """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = dict()  # host -> monotonic time of the next allowed request
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(self._next.get(host, now), now)
+            self._next[host] = at + self.interval
+        delay = at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RoomReconciler(object):
+    """
+    Brings members of private groups in line with intended members in phases, every phase running its
+    http calls in a bounded thread pool:
+
+    - ensure: find groups in the room index of RocketDirectory, create missing ones
+    - fetch: get current members of all groups
+    - resolve: get ids of every user to be invited or kicked, from the prefetched RocketDirectory
+    - apply: invite and kick
+    """
+
+    def __init__(self, rocket, workers=8, rate=20):
+        """
+        Args:
+            rocket (RocketChatService): service, bound to a client usable from worker threads
+            workers (int): max number of concurrent requests
+            rate (int): max requests per second to a single host, 0 for no limit
+        """
+        self.rocket = rocket
+        self.workers = max(workers, 1)
+        self.limiter = HostRateLimiter(rate)
+        self.host = urlparse(getattr(rocket.rocket, "server_url", "") or "").netloc
+        self.timings = dict()
+
+    @contextmanager
+    def _phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.monotonic() - start
+
+    def _call(self, func, *args, **kwargs):
+        self.limiter.wait(self.host)
+        return func(*args, **kwargs)
+
+    def _map(self, func, items):
+        """ Apply func to items concurrently, return dict item -> result, exceptions are logged and give None """
+        items = list(items)
+
+        def run(item):
+            try:
+                return func(item)
+            except Exception as e:
+                logger.error(f"Rocket.Chat request for {item} failed: {e}")
+                return None
+
+        if len(items) <= 1:
+            return {item: run(item) for item in items}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(items))) as executor:
+            return dict(zip(items, executor.map(run, items)))
+
+    def ensure_groups(self, names):
+        """
+        Get ids of groups of given names, creating missing groups
+
+        Returns (dict): name -> group id
+        """
+        with self._phase("ensure"):
+            ids = self._map(lambda name: self._call(self.rocket.get_group_id, name), names)
+            missing = [name for name in names if not ids[name]]
+            if missing:
+                self._map(lambda name: self._call(self.rocket.create_group, name), missing)
+                ids.update(self._map(lambda name: self._call(self.rocket.get_group_id, name), missing))
+        for name in names:
+            if not ids[name]:
+                raise RuntimeError(f"Unable to create group '{name}'")
+        return ids
+
+    def _get_usernames(self, group_id):
+        return {member["username"] for member in self.rocket.get_all_group_members(group_id, call=self._call)}
+
+    def reconcile(self, rooms):
+        """
+        Invite intended members missing in rooms and kick members that are not intended
+
+        Args:
+            rooms (dict): group name -> set of usernames of intended members
+
+        Returns (dict): counts of invited and kicked users, errors, and seconds spent by phase
+        """
+        group_ids = self.ensure_groups(list(rooms))
+
+        with self._phase("fetch"):
+            current = self._map(self._get_usernames, list(group_ids.values()))
+
+        changes = []  # (action, group name, username)
+        for name, intended in rooms.items():
+            members = current[group_ids[name]]
+            if members is None:
+                continue
+            invite, kick = intended.difference(members), members.difference(intended)
+            logger.info(f"g {name}: current: {members}, adding {invite}, removing {kick}")
+            changes.extend(("invite", name, username) for username in invite)
+            changes.extend(("kick", name, username) for username in kick)
+
+        with self._phase("resolve"):
+            self._call(self.rocket.prefetch_users)
+            user_ids = self._map(self.rocket.get_user_id, {username for _, _, username in changes})
+
+        def apply(change):
+            action, name, username = change
+            user_id = user_ids.get(username)
+            if not user_id:
+                logger.info(f"Couldn't find user '{username}'")
+                return False
+            func = self.rocket.invite_user_to_group if action == "invite" else self.rocket.kick_user_from_group
+            r = self._call(func, group_ids[name], user_id)
+            if not r.ok:
+                logger.info(f"Couldn't {action} user '{username}' in '{name}': {r.reason}")
+            return r.ok
+
+        with self._phase("apply"):
+            results = self._map(apply, changes)
+
+        # rooms whose members couldn't be fetched count as errors too
+        unfetched = sum(1 for members in current.values() if members is None)
+        report = {
+            "invited": sum(1 for change, ok in results.items() if ok and change[0] == "invite"),
+            "kicked": sum(1 for change, ok in results.items() if ok and change[0] == "kick"),
+            "errors": sum(1 for ok in results.values() if not ok) + unfetched,
+            "timings": {phase: round(seconds, 3) for phase, seconds in self.timings.items()},
+        }
+        logger.info(f"Reconciled {len(rooms)} rooms: {report}")
+        return report
@@ -7,6 +7,8 @@ from flask import g, current_app
 
 from rocketchat_API.rocketchat import RocketChat
 from ..actions.models import Action
+from ..metrics import instrument_client
+from .directory import RocketDirectory
 
 logger = logging.getLogger()
 
@@ -17,10 +19,10 @@ def get_rocket():
     """ Create if doesn't exist or return edap from flask g object """
     if 'rocket' not in g:
         try:
-            g.rocket = RocketChat(
+            g.rocket = instrument_client(RocketChat(
                     current_app.config["ROCKETCHAT_USER"],
                     current_app.config["ROCKETCHAT_PASSWORD"],
-                    server_url=current_app.config["ROCKETCHAT_HOST"])
+                    server_url=current_app.config["ROCKETCHAT_HOST"]), "rocket")
             g.rocket_exception = None
         except Exception as e:
             g.rocket = None
@@ -68,6 +70,19 @@ def log_rocket_action(event_name):
 
 class RocketChatService(RocketMixin):
 
+    def __init__(self, client=None):
+        self.client = client
+
+    @property
+    def rocket(self):
+        if self.client is not None:
+            return self.client
+        return get_rocket()
+
+    def bound(self):
+        """ Get service using the client of the current app context, usable from threads without app context """
+        return type(self)(client=self.rocket)
+
     def create_user(self, username, password, email, name):
         """
         Create user
@@ -81,9 +96,14 @@ class RocketChatService(RocketMixin):
         Returns (response):
 
         """
-        return self.rocket.users_create(
+        res = self.rocket.users_create(
                 email, name, password, username,
                 requirePasswordChange=False, verified=True)
+        if rocket_directory is not None:
+            rocket_directory.users.pop(username)
+            if res.status_code == 200 and res.json().get('user'):
+                rocket_directory.users.set(username, res.json()['user']['_id'])
+        return res
 
     def create_channel(self, room_name):
         """
@@ -105,7 +125,10 @@ class RocketChatService(RocketMixin):
         Returns:
 
         """
-        return self.rocket.groups_create(room_name)
+        res = self.rocket.groups_create(room_name)
+        if rocket_directory is not None and res.status_code == 200 and res.json().get('group'):
+            rocket_directory.rooms.put(res.json()['group'])
+        return res
 
     def invite_user_to_channel(self, rocket_channel, rocket_user):
         return self.rocket.channels_invite(rocket_channel, rocket_user)
@@ -120,8 +143,8 @@ class RocketChatService(RocketMixin):
         return self.rocket.groups_kick(rocket_group, rocket_user)
 
     def get_ids(self, username, channel_name=None, group_name=None):
-        rocket_user = rocket_service.get_user_by_username(username)
-        if not rocket_user:
+        user_id = rocket_service.get_user_id(username)
+        if not user_id:
             raise ValueError(f"Rocket.chat user '{username}' not found")
 
         rocket_channel = None
@@ -133,18 +156,19 @@ class RocketChatService(RocketMixin):
 
         rocket_group = None
         if group_name:
-            rocket_group = rocket_service.get_group_by_name(group_name)
+            rocket_group = rocket_service.get_group_id(group_name)
             if not rocket_group:
                 raise ValueError(f"Rocket.chat group '{group_name}' not found")
-            rocket_group = rocket_group["_id"]
 
         return rocket_ids(
-                user=rocket_user["_id"],
+                user=user_id,
                 channel=rocket_channel,
                 group=rocket_group,
         )
 
     def delete_user(self, user_id):
+        if rocket_directory is not None:
+            rocket_directory.users.pop_value(user_id)
         return self.rocket.users_delete(user_id)
 
     def get_channel_by_name(self, channel_name):
@@ -159,9 +183,10 @@ class RocketChatService(RocketMixin):
         return rooms[0]
 
     def get_group_by_name(self, group_name):
-        """ Get rocket group json object by it's name """
+        """ Get rocket group json object by it's name, from the room index if the directory is enabled """
+        if rocket_directory is not None:
+            return rocket_directory.get_room(self.rocket, group_name)
         # Queries are quite unreliable
-        query = f'{{"fname": {{"$eq": "{group_name}"}}}}'
         fields = '{"fname": 1}'
         res = self.rocket.groups_list_all(count=0, fields=fields)
         if res.status_code != 200:
@@ -171,8 +196,7 @@ class RocketChatService(RocketMixin):
         good_rooms = [r for r in all_rooms if r["fname"] == group_name]
         if not good_rooms:
             return None
-        good_room = good_rooms[0]
-        return good_room
+        return good_rooms[0]
 
     def get_user_by_username(self, username):
         """ Get rocket user json object by it's username """
@@ -185,10 +209,47 @@ class RocketChatService(RocketMixin):
             return None
         return users[0]
 
+    def get_user_id(self, username):
+        """ Get id of user by username, from the directory cache if it's enabled """
+        if rocket_directory is None:
+            rocket_user = self.get_user_by_username(username)
+            return rocket_user["_id"] if rocket_user else None
+        return rocket_directory.get_user_id(self.rocket, username, self.get_user_by_username)
+
+    def get_group_id(self, group_name):
+        group = self.get_group_by_name(group_name)
+        return group["_id"] if group else None
+
+    def prefetch_users(self):
+        """ Fill the directory cache with all users, so that following get_user_id calls don't query one by one """
+        if rocket_directory is not None:
+            rocket_directory.prefetch_users(self.rocket)
+
     def get_group_members(self, group_id):
         res = self.rocket.groups_members(room_id=group_id)
         return res
 
+    def get_all_group_members(self, group_id, call=None):
+        """
+        Get all members of group, page by page
+
+        Args:
+            group_id (str): rocket group id
+            call (callable): calls the api, given function and its arguments, e.g. to rate limit
+
+        Returns (list): user json objects
+        """
+        call = call or (lambda func, *args, **kwargs: func(*args, **kwargs))
+        members = []
+        while True:
+            res = call(self.rocket.groups_members, room_id=group_id, offset=len(members))
+            if not res.ok:
+                raise RuntimeError(f"Error code {res.status_code}: {res.reason}")
+            data = res.json()
+            members.extend(data["members"])
+            if not data["members"] or len(members) >= data.get("total", 0):
+                return members
+
     def get_channel_members(self, channel_id):
         res = self.rocket.channels_members(room_id=channel_id)
         return res
@@ -224,4 +285,15 @@ def populate_service(logging_enabled):
         rocket_service = RocketChatService()
 
 
+def init_directory(app):
+    """ Create process-wide cache of user and room ids, unless ROCKETCHAT_CACHE_TTL is 0 """
+    global rocket_directory
+    ttl = app.config.get("ROCKETCHAT_CACHE_TTL", 300)
+    rocket_directory = RocketDirectory(
+        ttl=ttl,
+        maxsize=app.config.get("ROCKETCHAT_CACHE_SIZE", 10000),
+        rooms_refresh_interval=app.config.get("ROCKETCHAT_ROOMS_REFRESH", 30)) if ttl else None
+
+
 rocket_service = None
+rocket_directory = None
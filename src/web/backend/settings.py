@@ -6,7 +6,6 @@ For local development, use a .env file to set
 environment variables.
 """
 import sys
-import gzip
 
 from environs import Env
 
@@ -29,29 +28,17 @@ DEBUG_TB_INTERCEPT_REDIRECTS = False
 CACHE_TYPE = 'simple'  # Can be "memcached", "redis", etc.
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
-FREQUENT_PASSWORDS = set()
-
+# List of frequent passwords, one per line, gzipped if it ends with "gz". It's sorted into a file next to it
+# on first use and memory-mapped, see ldap.passwords
 FREQUENT_PASSWORDS_FILENAME = env.str("FREQUENT_PASSWORDS", "")
-if FREQUENT_PASSWORDS_FILENAME:
-    try:
-        if FREQUENT_PASSWORDS_FILENAME.endswith("gz"):
-            with gzip.open(FREQUENT_PASSWORDS_FILENAME, "rt", encoding="utf-8") as f:
-                for line in f:
-                    FREQUENT_PASSWORDS.add(line.rstrip())
-        else:
-            with open(FREQUENT_PASSWORDS_FILENAME, "r", encoding="utf-8") as f:
-                for line in f:
-                    FREQUENT_PASSWORDS.add(line.rstrip())
-    except Exception as exc:
-        msg = (
-            f"Tried to load list of frequent passwords from {FREQUENT_PASSWORDS_FILENAME}"
-            f", failed: {str(exc)}")
-        print(msg, file=sys.stderr)
 
 # NEXTCLOUD
 NEXTCLOUD_HOST = env.str('NEXTCLOUD_HOST')
 NEXTCLOUD_USER = env.str('NEXTCLOUD_USER')
 NEXTCLOUD_PASSWORD = env.str("NEXTCLOUD_PASSWORD")
+NEXTCLOUD_FOLDERS_TTL = env.int("NEXTCLOUD_FOLDERS_TTL", 60)  # seconds to keep the index of group folders
+# Seconds to coalesce Nextcloud LDAP cache flushes in, 0 to flush at once
+NEXTCLOUD_FLUSH_WINDOW = env.float("NEXTCLOUD_FLUSH_WINDOW", 5)
 
 # MAIL
 MAIL_SERVER = env.str('MAIL_SERVER')
@@ -66,12 +53,53 @@ PW_RESET_EXPIRY_SEC = max(0, env.int("PW_RESET_EXPIRY_SEC", 600))
 ROCKETCHAT_USER = env.str("ROCKETCHAT_USER")
 ROCKETCHAT_PASSWORD = env.str("ROCKETCHAT_PASSWORD")
 ROCKETCHAT_HOST = env.str("ROCKETCHAT_HOST")
+ROCKETCHAT_WORKERS = env.int("ROCKETCHAT_WORKERS", 8)  # concurrent requests of room reconciliation
+ROCKETCHAT_RATE_LIMIT = env.int("ROCKETCHAT_RATE_LIMIT", 20)  # max requests per second, 0 for no limit
+ROCKETCHAT_CACHE_TTL = env.int("ROCKETCHAT_CACHE_TTL", 300)  # seconds to cache user and room ids, 0 to disable
+ROCKETCHAT_CACHE_SIZE = env.int("ROCKETCHAT_CACHE_SIZE", 10000)
+ROCKETCHAT_ROOMS_REFRESH = env.int("ROCKETCHAT_ROOMS_REFRESH", 30)  # max age in seconds of the room index
 
 # Edap
 EDAP_HOSTNAME = env.str("EDAP_HOSTNAME")
 EDAP_USER = env.str("EDAP_USER")
 EDAP_PASSWORD = env.str("EDAP_PASSWORD")
 EDAP_DOMAIN = env.str("EDAP_DOMAIN")
+EDAP_POOL_SIZE = env.int("EDAP_POOL_SIZE", 10)
+IMPORT_BATCH_SIZE = env.int("IMPORT_BATCH_SIZE", 100)  # rows of bulk user import created together
+EDAP_POOL_IDLE_TIMEOUT = env.int("EDAP_POOL_IDLE_TIMEOUT", 300)
+EDAP_POOL_CHECKOUT_TIMEOUT = env.int("EDAP_POOL_CHECKOUT_TIMEOUT", 10)
+# Entries per page of paged searches
+EDAP_PAGE_SIZE = env.int("EDAP_PAGE_SIZE", 500)
+# Seconds to keep the in-memory directory snapshot for reads, 0 disables it
+EDAP_CACHE_TTL = env.int("EDAP_CACHE_TTL", 0)
+# Seconds between incremental syncs keeping the snapshot current, 0 disables them
+EDAP_SYNC_INTERVAL = env.int("EDAP_SYNC_INTERVAL", 0)
+# syncrepl, timestamp or auto to detect what the server supports
+EDAP_SYNC_MODE = env.str("EDAP_SYNC_MODE", "auto")
+# Send identical searches of one request only once, until the request writes an object they may include
+EDAP_REQUEST_CACHE = env.bool("EDAP_REQUEST_CACHE", True)
+EDAP_REQUEST_CACHE_SIZE = env.int("EDAP_REQUEST_CACHE_SIZE", 1000)
+# Seconds to keep special group memberships checked when authorizing requests, 0 disables the cache
+EDAP_AUTH_CACHE_TTL = env.int("EDAP_AUTH_CACHE_TTL", 30)
+# Failed password logins of a uid within the window (seconds) after which its logins are rejected, 0 for no limit
+LOGIN_MAX_FAILURES = env.int("LOGIN_MAX_FAILURES", 5)
+LOGIN_FAILURE_WINDOW = env.int("LOGIN_FAILURE_WINDOW", 300)
+
+# Count and time calls to LDAP, Rocket.Chat and Nextcloud, exported by /metrics and summed up per request
+# in the Server-Timing header
+METRICS_ENABLED = env.bool("METRICS_ENABLED", True)
+# Bearer token /metrics is scraped with, if not set it's available to logged in hr-admins only
+METRICS_TOKEN = env.str("METRICS_TOKEN", "")
+# Log requests making METRICS_REPEATED_CALLS or more calls of the same shape, e.g. searches in a loop
+METRICS_DEBUG = env.bool("METRICS_DEBUG", DEBUG)
+METRICS_REPEATED_CALLS = env.int("METRICS_REPEATED_CALLS", 5)
+
+# Provisioning jobs - sqlite file they are kept in and number of threads running them
+JOBS_DB_PATH = env.str("JOBS_DB_PATH", "teap-jobs.db")
+JOBS_WORKERS = env.int("JOBS_WORKERS", 2)
+# Seconds after which a pending or running job that wasn't updated is taken as interrupted and run again,
+# checked when the first request is served
+JOBS_STALE_AFTER = env.int("JOBS_STALE_AFTER", 600)
 
 SERVER_NAME = env.str("SERVER_NAME")
 AUTHORIZATION = env.bool("AUTHORIZATION", False)
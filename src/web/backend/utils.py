@@ -28,13 +28,12 @@ def redirect_to_next(next_page):
 
 
 def _login_by_ldap(username, password, next_page=None):
-    from .ldap.utils import get_edap
+    from .ldap.login import LOGIN_OK
+    from .ldap.utils import get_edap, get_login_guard
 
-    try:
-        edap = get_edap()
-        login_successful = edap.verify_user_password(username, password)
-    except Exception:
-        login_successful = False
+    outcome = get_login_guard().verify(
+        username, password, lambda uid, pw: get_edap().verify_user_password(uid, pw))
+    login_successful = outcome == LOGIN_OK
 
     print(f"{login_successful=}")
     if login_successful:
@@ -78,11 +77,8 @@ def auth_err_if_user_not_from_groups(groups):
         if not flask_login.current_user.is_authenticated:
             print("Not authd at all")
             return flask.jsonify(messge="You are not even authenticated"), 401
-        from .ldap.utils import get_edap
-        edap = get_edap()
-        uid = flask_login.current_user.id
-        memberships = [edap.uid_is_member_of_special_group(uid, g) for g in groups]
-        if not any(memberships):
+        from .ldap.utils import uid_is_member_of_special_groups
+        if not uid_is_member_of_special_groups(flask_login.current_user.id, groups):
             print(f"Auth as '{flask_login.current_user.id}' not good enough")
             return flask.jsonify(message=f"Only users from groups {groups} are allowed"), 401
         print("Passed auth")
@@ -127,6 +123,21 @@ class EncoderWithBytes(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+def iter_json_array(items):
+    """
+    Encode items to json array piece by piece, to stream a response while the items are still being fetched
+
+    Args:
+        items (iterable): json serializable objects
+
+    Returns (generator): str chunks of the array
+    """
+    yield "["
+    for i, item in enumerate(items):
+        yield ("," if i else "") + json.dumps(item, cls=EncoderWithBytes)
+    yield "]"
+
+
 def api_auth_required(func):
     """ Authentication check decorator for api """
     @wraps(func)
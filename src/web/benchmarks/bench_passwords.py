@@ -0,0 +1,92 @@
+"""
+Compare the frequent password set loaded into memory, as settings.py used to do, with the memory-mapped sorted file.
+
+Reports load time, memory allocated by the process for the list and lookup throughput of both.
+
+    python benchmarks/bench_passwords.py --count 1000000
+    python benchmarks/bench_passwords.py --source /path/to/rockyou.txt.gz
+"""
+import argparse
+import gzip
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from backend.ldap.passwords import SortedPasswordFile, build_sorted_password_file  # noqa: E402
+
+
+def generate_list(path, count, seed=0):
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(count):
+            f.write("".join(rng.choice(alphabet) for _ in range(rng.randint(6, 14))) + "\n")
+
+
+def load_set(source):
+    passwords = set()
+    opener = gzip.open if source.endswith("gz") else open
+    with opener(source, "rt", encoding="utf-8") as f:
+        for line in f:
+            passwords.add(line.rstrip())
+    return passwords
+
+
+def sample_queries(source, count, seed=1):
+    """ Half of the queries are on the list, half are not """
+    rng = random.Random(seed)
+    opener = gzip.open if source.endswith("gz") else open
+    with opener(source, "rt", encoding="utf-8") as f:
+        present = [line.rstrip() for _, line in zip(range(count // 2), f)]
+    absent = ["".join(rng.choice(string.punctuation) for _ in range(12)) for _ in range(count - len(present))]
+    return present + absent
+
+
+def measure(name, load, queries):
+    tracemalloc.start()
+    start = time.perf_counter()
+    passwords = load()
+    loaded = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    hits = sum(1 for query in queries if query in passwords)
+    lookups = time.perf_counter() - start
+    print(f"{name:8}  load {loaded:8.3f}s  memory {memory / 2 ** 20:9.1f} MiB  "
+          f"lookups {len(queries) / lookups:12,.0f}/s  hits {hits}")
+    return passwords
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", help="list of passwords, a random one is generated if not given")
+    parser.add_argument("--count", type=int, default=500000, help="passwords in the generated list")
+    parser.add_argument("--queries", type=int, default=100000, help="lookups to time")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = args.source
+        if source is None:
+            source = os.path.join(tmp, "passwords.txt")
+            generate_list(source, args.count)
+        queries = sample_queries(source, args.queries)
+        sorted_path = os.path.join(tmp, "passwords.sorted")
+
+        start = time.perf_counter()
+        build_sorted_password_file(source, sorted_path)
+        print(f"sorting   {time.perf_counter() - start:.3f}s, done once per list")
+
+        measure("set", lambda: load_set(source), queries)
+        passwords = measure("mmap", lambda: SortedPasswordFile(sorted_path), queries)
+        passwords.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,512 @@
+"""
+In-process fakes of LDAP, Rocket.Chat and Nextcloud servers that model per-call latency and count round trips
+"""
+import collections
+import itertools
+import json
+import re
+import threading
+import time
+
+import ldap
+from ldap.controls import SimplePagedResultsControl
+from ldap.controls.sss import SSSRequestControl, SSSResponseControl
+
+# attributes compared case-sensitively, the rest is compared ignoring case like most LDAP matching rules do
+CASE_EXACT_ATTRIBUTES = {"memberuid", "userpassword"}
+
+
+class FakeServer(object):
+    """ Counts calls and round trips of a fake server, shared by all its connections and threads """
+
+    def __init__(self, latency=0.0):
+        """
+        Args:
+            latency (float): seconds every round trip takes
+        """
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls = collections.Counter()
+            self.round_trips = 0
+            self.bytes_returned = 0
+
+    def _round_trip(self, call, returned=b""):
+        with self._lock:
+            self.calls[call] += 1
+            self.round_trips += 1
+            self.bytes_returned += len(returned)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _count(self, call):
+        """ Count call answered without a round trip of its own """
+        with self._lock:
+            self.calls[call] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(round_trips=self.round_trips, bytes_returned=self.bytes_returned, calls=dict(self.calls))
+
+
+# LDAP
+
+def _unescape(value):
+    return re.sub(r"\\([0-9a-fA-F]{2})", lambda m: chr(int(m.group(1), 16)), value)
+
+
+def parse_filter(filterstr):
+    """
+    Parse RFC 4515 search filter into a predicate
+
+    Returns (callable): takes dict of attribute -> list of bytes, returns whether the entry matches
+    """
+    filterstr = filterstr.strip() or "(objectClass=*)"
+    if not filterstr.startswith("("):
+        filterstr = f"({filterstr})"
+    predicate, end = _parse(filterstr, 0)
+    if end != len(filterstr):
+        raise ldap.FILTER_ERROR({"desc": "Bad search filter", "info": filterstr})
+    return predicate
+
+
+def _parse(filterstr, pos):
+    if filterstr[pos] != "(":
+        raise ldap.FILTER_ERROR({"desc": "Bad search filter", "info": filterstr})
+    pos += 1
+    operator = filterstr[pos]
+    if operator in "&|!":
+        pos += 1
+        children = []
+        while filterstr[pos] == "(":
+            child, pos = _parse(filterstr, pos)
+            children.append(child)
+        if filterstr[pos] != ")":
+            raise ldap.FILTER_ERROR({"desc": "Bad search filter", "info": filterstr})
+        if operator == "&":
+            return (lambda entry: all(child(entry) for child in children)), pos + 1
+        if operator == "|":
+            return (lambda entry: any(child(entry) for child in children)), pos + 1
+        return (lambda entry: not children[0](entry)), pos + 1
+    end = filterstr.index(")", pos)
+    return _item(filterstr[pos:end]), end + 1
+
+
+def _item(item):
+    match = re.match(r"^([\w.;-]+)(>=|<=|~=|=)(.*)$", item)
+    if not match:
+        raise ldap.FILTER_ERROR({"desc": "Bad search filter", "info": item})
+    attr, operator, raw = match.groups()
+    attr = attr.lower()
+    fold = (lambda s: s) if attr in CASE_EXACT_ATTRIBUTES else (lambda s: s.lower())
+
+    def values(entry):
+        for key, each in entry.items():
+            if key.lower() == attr:
+                return [fold(v.decode("utf-8", "replace") if isinstance(v, bytes) else v) for v in each]
+        return []
+
+    if operator == "=" and raw == "*":
+        return lambda entry: bool(values(entry))
+    if operator == "=" and "*" in raw:
+        pattern = re.compile(".*".join(re.escape(fold(_unescape(part))) for part in raw.split("*")), re.DOTALL)
+        return lambda entry: any(pattern.fullmatch(v) for v in values(entry))
+    value = fold(_unescape(raw))
+    if operator == ">=":
+        return lambda entry: any(v >= value for v in values(entry))
+    if operator == "<=":
+        return lambda entry: any(v <= value for v in values(entry))
+    return lambda entry: value in values(entry)
+
+
+def _norm(dn):
+    return ",".join(rdn.strip().lower() for rdn in dn.split(","))
+
+
+class FakeLdapServer(FakeServer):
+    """
+    Directory held in memory. Entries are dicts of attribute -> list of bytes.
+
+    A synchronous operation is one round trip. Asynchronous operations are sent without waiting, the first
+    result3 of operations sent since the previous wait is one round trip, so that pipelined operations cost one.
+    """
+
+    def __init__(self, base_dn, latency=0.0):
+        super().__init__(latency)
+        self.base_dn = base_dn
+        self.entries = dict()  # normalized dn -> (dn, attributes)
+        self.entries[_norm(base_dn)] = (base_dn, {"objectClass": [b"top", b"domain"]})
+
+    def add_entry(self, dn, attrs):
+        self.entries[_norm(dn)] = (dn, {key: list(value) for key, value in attrs.items()})
+
+    def connect(self, uri=None):
+        return FakeLdapConnection(self)
+
+    def search(self, base, scope, filterstr, attrlist):
+        norm_base = _norm(base)
+        if norm_base not in self.entries:
+            raise ldap.NO_SUCH_OBJECT({"desc": "No such object", "matched": self.base_dn})
+        predicate = parse_filter(filterstr or "(objectClass=*)")
+        results = []
+        for norm_dn, (dn, attrs) in list(self.entries.items()):
+            if scope == ldap.SCOPE_BASE and norm_dn != norm_base:
+                continue
+            if scope == ldap.SCOPE_ONELEVEL and norm_dn.split(",", 1)[-1] != norm_base:
+                continue
+            if scope == ldap.SCOPE_SUBTREE and not (norm_dn == norm_base or norm_dn.endswith("," + norm_base)):
+                continue
+            if not predicate(attrs):
+                continue
+            if attrlist == ["1.1"]:
+                selected = dict()
+            elif attrlist:
+                wanted = {each.lower() for each in attrlist}
+                selected = {key: list(value) for key, value in attrs.items() if key.lower() in wanted}
+            else:
+                selected = {key: list(value) for key, value in attrs.items()}
+            results.append((dn, selected))
+        return results
+
+    def add(self, dn, modlist):
+        if _norm(dn) in self.entries:
+            raise ldap.ALREADY_EXISTS({"desc": "Already exists", "matched": dn})
+        if dn.split(",", 1)[-1] and _norm(dn.split(",", 1)[-1]) not in self.entries:
+            raise ldap.NO_SUCH_OBJECT({"desc": "No such object"})
+        self.add_entry(dn, {attr: [value] if isinstance(value, bytes) else value for attr, value in modlist})
+
+    def modify(self, dn, modlist):
+        if _norm(dn) not in self.entries:
+            raise ldap.NO_SUCH_OBJECT({"desc": "No such object", "matched": self.base_dn})
+        attrs = self.entries[_norm(dn)][1]
+        for op, attr, values in modlist:
+            if values is None:
+                values = []
+            elif isinstance(values, bytes):
+                values = [values]
+            current = attrs.setdefault(attr, [])
+            if op == ldap.MOD_ADD:
+                for value in values:
+                    if value in current:
+                        raise ldap.TYPE_OR_VALUE_EXISTS({"desc": "Type or value exists"})
+                    current.append(value)
+            elif op == ldap.MOD_DELETE:
+                if not values:
+                    current.clear()
+                for value in values:
+                    if value not in current:
+                        raise ldap.NO_SUCH_ATTRIBUTE({"desc": "No such attribute"})
+                    current.remove(value)
+            else:
+                current[:] = list(values)
+            if not current:
+                del attrs[attr]
+
+    def delete(self, dn):
+        if _norm(dn) not in self.entries:
+            raise ldap.NO_SUCH_OBJECT({"desc": "No such object", "matched": self.base_dn})
+        if any(norm_dn.endswith("," + _norm(dn)) for norm_dn in self.entries):
+            raise ldap.NOT_ALLOWED_ON_NONLEAF({"desc": "Operation not allowed on non-leaf"})
+        del self.entries[_norm(dn)]
+
+
+def _size(results):
+    return sum(len(dn) + sum(len(value) for values in attrs.values() for value in values) for dn, attrs in results)
+
+
+class FakeLdapConnection(object):
+    """ Subset of python-ldap LDAPObject used by Edap, talking to FakeLdapServer """
+
+    def __init__(self, server):
+        self.server = server
+        self._msgid = itertools.count(1)
+        self._pending = dict()  # msgid -> (wait number when sent, result or exception)
+        self._waits = 0
+
+    def set_option(self, option, value):
+        pass
+
+    def bind_s(self, who, cred):
+        self.server._round_trip("bind")
+
+    def whoami_s(self):
+        self.server._round_trip("whoami")
+        return "dn:"
+
+    def unbind_s(self):
+        pass
+
+    def search_s(self, base, scope, filterstr="(objectClass=*)", attrlist=None, attrsonly=0):
+        results = self.server.search(base, scope, filterstr, attrlist)
+        self.server._round_trip("search", b"x" * _size(results))
+        return results
+
+    def add_s(self, dn, modlist):
+        self.server._round_trip("add")
+        self.server.add(dn, modlist)
+
+    def modify_s(self, dn, modlist):
+        self.server._round_trip("modify")
+        self.server.modify(dn, modlist)
+
+    def delete_s(self, dn):
+        self.server._round_trip("delete")
+        self.server.delete(dn)
+
+    def _send(self, call, func, *args):
+        try:
+            result = func(*args)
+        except ldap.LDAPError as e:
+            result = e
+        msgid = next(self._msgid)
+        self._pending[msgid] = (call, self._waits, result)
+        return msgid
+
+    @staticmethod
+    def _apply(result_type, func, *args):
+        func(*args)
+        return result_type, [], None, []
+
+    def add(self, dn, modlist):
+        return self._send("add", self._apply, ldap.RES_ADD, self.server.add, dn, modlist)
+
+    def modify(self, dn, modlist):
+        return self._send("modify", self._apply, ldap.RES_MODIFY, self.server.modify, dn, modlist)
+
+    def delete(self, dn):
+        return self._send("delete", self._apply, ldap.RES_DELETE, self.server.delete, dn)
+
+    def search_ext(self, base, scope, filterstr="(objectClass=*)", attrlist=None, attrsonly=0, serverctrls=None):
+        return self._send("search", self._search_ext, base, scope, filterstr, attrlist, serverctrls or [])
+
+    def _search_ext(self, base, scope, filterstr, attrlist, serverctrls):
+        results = self.server.search(base, scope, filterstr, attrlist)
+        response_controls = []
+        for control in serverctrls:
+            if control.controlType == SSSRequestControl.controlType:
+                rule = control.ordering_rules[0]
+                attr = rule.lstrip("-")
+                results.sort(key=lambda entry: next((values[0].lower() for key, values in entry[1].items()
+                                                     if key.lower() == attr.lower() and values), b""),
+                             reverse=rule.startswith("-"))
+                response = SSSResponseControl()
+                response.sortResult = 0
+                response_controls.append(response)
+        for control in serverctrls:
+            if control.controlType == SimplePagedResultsControl.controlType:
+                start = int(control.cookie or 0)
+                end = start + control.size if control.size else len(results)
+                total = len(results)
+                results = results[start:end]
+                response_controls.append(SimplePagedResultsControl(
+                    criticality=False, size=total, cookie=str(end).encode() if end < total else b""))
+        return ldap.RES_SEARCH_RESULT, results, None, response_controls
+
+    def result3(self, msgid, all=1, timeout=None):
+        call, sent_at, result = self._pending.pop(msgid)
+        if sent_at == self._waits:
+            # not answered by any of the previous waits, wait for it
+            self._waits += 1
+            returned = b"x" * _size(result[1]) if not isinstance(result, Exception) else b""
+            self.server._round_trip(call, returned)
+        else:
+            self.server._count(call)
+        if isinstance(result, Exception):
+            raise result
+        return result[0], result[1], msgid, result[3]
+
+
+# Rocket.Chat
+
+class FakeResponse(object):
+
+    def __init__(self, data=None, status_code=200):
+        self.status_code = status_code
+        self.ok = status_code == 200
+        self.reason = "OK" if self.ok else "Bad Request"
+        self._data = dict(success=self.ok, **(data or {}))
+
+    def json(self):
+        return self._data
+
+
+class FakeRocketChat(FakeServer):
+    """ Subset of rocketchat_API.RocketChat used by RocketChatService, every call is one round trip """
+
+    server_url = "http://rocket.chat.invalid"
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.users = dict()  # username -> user
+        self.usernames = dict()  # user id -> username
+        self.groups = dict()  # id -> group with set of member usernames
+        self._ids = itertools.count(1)
+        self._data_lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        # used in place of the RocketChat class, logging in returns the same server
+        return self
+
+    def add_user(self, username):
+        user = dict(_id=f"u{next(self._ids)}", username=username)
+        self.users[username] = user
+        self.usernames[user["_id"]] = username
+        return user
+
+    def add_group(self, fname, members=()):
+        group = dict(_id=f"g{next(self._ids)}", name=fname, fname=fname, t="p", members=set(members))
+        self.groups[group["_id"]] = group
+        return group
+
+    @staticmethod
+    def _public(group):
+        return {key: value for key, value in group.items() if key != "members"}
+
+    @staticmethod
+    def _page(items, offset=0, count=None, key=None):
+        items = list(items)
+        end = offset + count if count else len(items)
+        return {key: items[offset:end], "total": len(items), "offset": offset, "count": len(items[offset:end])}
+
+    def users_list(self, offset=0, count=None, fields=None, query=None, **kwargs):
+        self._round_trip("users.list")
+        users = list(self.users.values())
+        if query:
+            username = json.loads(query).get("username", {}).get("$eq")
+            users = [user for user in users if user["username"] == username]
+        return FakeResponse(self._page(users, offset, count, "users"))
+
+    def users_create(self, email, name, password, username, **kwargs):
+        self._round_trip("users.create")
+        with self._data_lock:
+            if username in self.users:
+                return FakeResponse(dict(error="Username is already in use"), 400)
+            return FakeResponse(dict(user=self.add_user(username)))
+
+    def users_delete(self, user_id, **kwargs):
+        self._round_trip("users.delete")
+        with self._data_lock:
+            username = self.usernames.pop(user_id, None)
+            if username is not None:
+                del self.users[username]
+                return FakeResponse()
+        return FakeResponse(dict(error="User not found"), 400)
+
+    def groups_list_all(self, offset=0, count=None, fields=None, **kwargs):
+        self._round_trip("groups.listAll")
+        return FakeResponse(self._page(map(self._public, self.groups.values()), offset, count, "groups"))
+
+    def rooms_get(self, updatedSince=None, **kwargs):
+        self._round_trip("rooms.get")
+        return FakeResponse(dict(update=[self._public(group) for group in self.groups.values()], remove=[]))
+
+    def groups_create(self, name, **kwargs):
+        self._round_trip("groups.create")
+        with self._data_lock:
+            if any(group["fname"] == name for group in self.groups.values()):
+                return FakeResponse(dict(error="A room with the same name already exists"), 400)
+            return FakeResponse(dict(group=self._public(self.add_group(name))))
+
+    def groups_members(self, room_id, offset=0, count=50, **kwargs):
+        self._round_trip("groups.members")
+        group = self.groups.get(room_id)
+        if group is None:
+            return FakeResponse(dict(error="Room not found"), 400)
+        members = [self.users.get(username, dict(_id=None, username=username))
+                   for username in sorted(group["members"])]
+        return FakeResponse(self._page(members, offset, count, "members"))
+
+    def _membership(self, call, room_id, user_id, add):
+        self._round_trip(call)
+        group = self.groups.get(room_id)
+        username = self.usernames.get(user_id)
+        if group is None or username is None:
+            return FakeResponse(dict(error="Room or user not found"), 400)
+        with self._data_lock:
+            if add:
+                group["members"].add(username)
+            else:
+                group["members"].discard(username)
+        return FakeResponse()
+
+    def groups_invite(self, room_id, user_id, **kwargs):
+        return self._membership("groups.invite", room_id, user_id, add=True)
+
+    def groups_kick(self, room_id, user_id, **kwargs):
+        return self._membership("groups.kick", room_id, user_id, add=False)
+
+
+# Nextcloud
+
+class FakeOCSResponse(object):
+
+    def __init__(self, data=None, is_ok=True):
+        self.data = data
+        self.is_ok = is_ok
+        self.status_code = 100 if is_ok else 400
+
+
+class FakeNextCloud(FakeServer):
+    """ Subset of the NextCloud OCS client used by the app, every call is one round trip """
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.folders = dict()  # id -> folder
+        self.groups = set()
+        self._ids = itertools.count(1)
+        self._data_lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        # used in place of the NextCloud class
+        return self
+
+    def get_group_folders(self):
+        self._round_trip("group_folders.list")
+        return FakeOCSResponse(dict(self.folders) or [])
+
+    def get_group_folder(self, folder_id):
+        self._round_trip("group_folders.get")
+        folder = self.folders.get(str(folder_id))
+        return FakeOCSResponse(folder, is_ok=folder is not None)
+
+    def create_group_folder(self, mount_point):
+        self._round_trip("group_folders.create")
+        with self._data_lock:
+            folder_id = str(next(self._ids))
+            self.folders[folder_id] = dict(id=folder_id, mount_point=mount_point, groups=dict())
+        return FakeOCSResponse(dict(id=folder_id))
+
+    def grant_access_to_group_folder(self, folder_id, group_id):
+        self._round_trip("group_folders.grant")
+        self.folders[str(folder_id)]["groups"].setdefault(group_id, 31)
+        return FakeOCSResponse()
+
+    def set_permissions_to_group_folder(self, folder_id, group_id, permissions):
+        self._round_trip("group_folders.permissions")
+        self.folders[str(folder_id)]["groups"][group_id] = int(permissions)
+        return FakeOCSResponse()
+
+    def get_ldap_lowest_existing_config_id(self):
+        self._round_trip("ldap.config")
+        return "s01"
+
+    def ldap_cache_flush(self, config_id):
+        self._round_trip("ldap.flush")
+        return FakeOCSResponse()
+
+    def add_group(self, group_id):
+        self._round_trip("groups.add")
+        self.groups.add(group_id)
+        return FakeOCSResponse()
+
+    def get_group(self, group_id):
+        self._round_trip("groups.get")
+        return FakeOCSResponse(dict(users=[]), is_ok=group_id in self.groups)
+
+    def delete_group(self, group_id):
+        self._round_trip("groups.delete")
+        self.groups.discard(group_id)
+        return FakeOCSResponse()
@@ -0,0 +1,149 @@
+"""
+Run the app against in-process fakes of LDAP, Rocket.Chat and Nextcloud and report, for every scenario,
+round trips to each service, wall time and peak memory allocated by Python.
+
+    python benchmarks/run.py --users 2000 --franchises 30 --divisions 10 --latency 0.001
+    python benchmarks/run.py --scenario listing --scenario maintain --json results.json
+
+Round trip counts don't depend on the machine, so they are what CI should compare between runs.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir))
+
+# settings are read from the environment when the app is imported, the services are faked and
+# requests to them are not rate limited, so that --latency is what calls cost
+for key, value in dict(SECRET_KEY="benchmark", SERVER_NAME="teap.example.com",
+                       EDAP_HOSTNAME="ldap.invalid", EDAP_USER="cn=admin", EDAP_PASSWORD="admin",
+                       EDAP_DOMAIN="example.com", ROCKETCHAT_HOST="http://rocket.chat.invalid",
+                       ROCKETCHAT_USER="admin", ROCKETCHAT_PASSWORD="admin",
+                       NEXTCLOUD_HOST="http://nextcloud.invalid", NEXTCLOUD_USER="admin", NEXTCLOUD_PASSWORD="admin",
+                       MAIL_SERVER="localhost", MAIL_PORT="25", MAIL_USE_TLS="0", MAIL_USERNAME="", MAIL_PASSWORD="",
+                       NEXTCLOUD_FLUSH_WINDOW="0", ROCKETCHAT_RATE_LIMIT="0").items():
+    os.environ.setdefault(key, value)
+os.environ.setdefault("JOBS_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="teap-bench-"), "jobs.db"))
+
+import ldap  # noqa: E402
+
+from fakes import FakeLdapServer, FakeNextCloud, FakeRocketChat  # noqa: E402
+from scenarios import build_organization, new_users  # noqa: E402
+
+
+def scenario_listing(app, org, args):
+    client = app.test_client()
+    res = client.get("/api/ldap/users/", query_string=dict(limit=50, sort="surname"))
+    assert res.status_code == 200, res.data
+    res = client.get("/api/ldap/users/")
+    assert res.status_code == 200, res.data
+    for path in ("/api/ldap/franchises", "/api/ldap/divisions", "/api/ldap/teams"):
+        res = client.get(path)
+        assert res.status_code == 200, (path, res.data)
+
+
+def scenario_onboarding(app, org, args):
+    from backend.ldap.importer import UserImporter
+    from backend.ldap.utils import get_edap
+
+    teams = [f"{code}-{division}" for code in org["franchises"] for division in org["divisions"]]
+    with app.app_context():
+        importer = UserImporter(get_edap(), batch_size=app.config.get("IMPORT_BATCH_SIZE", 100),
+                                workers=app.config.get("ROCKETCHAT_WORKERS", 8))
+        summary = list(importer.run(new_users(args.onboard, teams)))[-1]
+    assert summary["created"] == args.onboard, summary
+
+
+def scenario_maintain(app, org, args):
+    from backend import model
+    from backend.ldap.utils import get_edap
+    from backend.rocket_chat.utils import RocketChatService
+
+    with app.app_context():
+        model.maintain(get_edap(), RocketChatService())
+
+
+def scenario_consistency(app, org, args):
+    from backend.edap import get_teams_consistency
+    from backend.ldap.utils import check_consistency as check_ldap_consistency, get_edap
+    from backend.nextcloud.utils import check_consistency as check_nextcloud_consistency
+
+    with app.app_context():
+        get_teams_consistency(get_edap())
+        check_ldap_consistency()
+        check_nextcloud_consistency()
+
+
+SCENARIOS = OrderedDict([
+    ("listing", scenario_listing),
+    ("onboarding", scenario_onboarding),
+    ("maintain", scenario_maintain),
+    ("consistency", scenario_consistency),
+])
+
+
+def measure(name, func, servers):
+    for server in servers.values():
+        server.reset_stats()
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return OrderedDict([
+        ("scenario", name),
+        ("seconds", round(seconds, 3)),
+        ("peak_memory_mib", round(peak / 2 ** 20, 1)),
+        *((service, server.stats()) for service, server in servers.items()),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="users in the generated organization")
+    parser.add_argument("--franchises", type=int, default=20, help="franchises in the generated organization")
+    parser.add_argument("--divisions", type=int, default=10, help="divisions in the generated organization")
+    parser.add_argument("--onboard", type=int, default=100, help="users created by the onboarding scenario")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every round trip to a service takes")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="scenario to run, can be repeated, all by default")
+    parser.add_argument("--json", dest="json_path", help="write results to this file as JSON")
+    args = parser.parse_args()
+
+    ldap_server = FakeLdapServer("dc=example,dc=com", latency=args.latency)
+    rocket = FakeRocketChat(latency=args.latency)
+    nextcloud = FakeNextCloud(latency=args.latency)
+    org = build_organization(ldap_server, rocket, users=args.users, franchises=args.franchises,
+                             divisions=args.divisions)
+    servers = OrderedDict([("ldap", ldap_server), ("rocket", rocket), ("nextcloud", nextcloud)])
+
+    with mock.patch.object(ldap, "initialize", ldap_server.connect), \
+            mock.patch("rocketchat_API.rocketchat.RocketChat", rocket), \
+            mock.patch("nextcloud.NextCloud", nextcloud):
+        from backend.app import create_app
+        with mock.patch("backend.rocket_chat.utils.RocketChat", rocket), \
+                mock.patch("backend.nextcloud.utils.NextCloud", nextcloud):
+            app = create_app()
+            app.config.update(AUTHORIZATION=False)
+            results = [measure(name, lambda: SCENARIOS[name](app, org, args), servers)
+                       for name in args.scenario or SCENARIOS]
+
+    print(f"{'scenario':12} {'seconds':>8} {'MiB':>7} " + " ".join(f"{service + ' rt':>12}" for service in servers))
+    for result in results:
+        round_trips = " ".join(f"{result[service]['round_trips']:12}" for service in servers)
+        print(f"{result['scenario']:12} {result['seconds']:8.3f} {result['peak_memory_mib']:7.1f} {round_trips}")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(dict(parameters=vars(args), results=results), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Generators of organizations of a given size in the fake servers
+"""
+import random
+
+from backend.edap import COUNTRIES_CODES, _hashPassword, make_base_dn
+from backend.rocket_chat.utils import sanitize_room_name
+
+OUS = ("people", "teams", "franchises", "divisions", "services", "special", "cdea", "ddea", "lm")
+PASSWORD = "correct horse battery staple 42"
+
+
+def _group(cn, description=None, members=()):
+    attrs = {"objectClass": [b"posixGroup", b"top"], "cn": [cn.encode()], "gidNumber": [b"500"]}
+    if description:
+        attrs["description"] = [description.encode()]
+    if members:
+        attrs["memberUid"] = [uid.encode() for uid in members]
+    return attrs
+
+
+def _user(uid, password_hash, photo):
+    name, surname = uid.capitalize(), "Doe"
+    return {
+        "objectClass": [b"inetOrgPerson", b"top"], "uid": [uid.encode()], "givenName": [name.encode()],
+        "sn": [surname.encode()], "cn": [f"{name} {surname}".encode()], "mail": [f"{uid}@example.com".encode()],
+        "userPassword": [password_hash], "jpegPhoto": [photo],
+    }
+
+
+def build_organization(ldap_server, rocket, domain="example.com", users=1000, franchises=20, divisions=10,
+                       photo_size=2048, seed=0):
+    """
+    Fill the fake servers with an organization: users spread over franchises and divisions, a team of every
+    franchise and division with members of both, chat accounts of all users and chat rooms of half of the
+    franchises with some members missing and some not belonging there, so that maintain has work to do.
+
+    Args:
+        ldap_server (FakeLdapServer):
+        rocket (FakeRocketChat):
+        domain (str): domain of the base DN
+        users (int): number of users
+        franchises (int): number of franchises, at most the number of country codes
+        divisions (int): number of divisions
+        photo_size (int): bytes of jpegPhoto of every user
+        seed (int): seed of random choices
+
+    Returns (dict): uids, franchise codes and division names of the organization
+    """
+    rng = random.Random(seed)
+    base_dn = make_base_dn(domain)
+    for ou in OUS:
+        ldap_server.add_entry(f"ou={ou},{base_dn}", {"objectClass": [b"organizationalUnit", b"top"],
+                                                     "ou": [ou.encode()]})
+    ldap_server.add_entry(f"ou=active,ou=people,{base_dn}", {"objectClass": [b"organizationalUnit", b"top"],
+                                                             "ou": [b"active"]})
+
+    password_hash = _hashPassword(PASSWORD)
+    photo = bytes(rng.getrandbits(8) for _ in range(photo_size))
+    uids = ["ceo"] + [f"user{i:06d}" for i in range(users - 1)]
+    for uid in uids:
+        ldap_server.add_entry(f"uid={uid},ou=active,ou=people,{base_dn}", _user(uid, password_hash, photo))
+
+    codes = sorted(code for code in COUNTRIES_CODES if len(code) == 2)[:franchises]
+    division_names = [f"D{i:03d}" for i in range(divisions)]
+    franchise_members = {code: [] for code in codes}
+    division_members = {name: [] for name in division_names}
+    team_members = dict()
+    for i, uid in enumerate(uids[1:]):
+        code, division = codes[i % len(codes)], division_names[i // len(codes) % len(division_names)]
+        franchise_members[code].append(uid)
+        division_members[division].append(uid)
+        team_members.setdefault((code, division), []).append(uid)
+
+    for code in codes:
+        ldap_server.add_entry(f"cn={code},ou=franchises,{base_dn}",
+                              _group(code, COUNTRIES_CODES[code], franchise_members[code]))
+        ldap_server.add_entry(f"cn={code},ou=cdea,{base_dn}",
+                              _group(code, f"{COUNTRIES_CODES[code]} FD", franchise_members[code][:1]))
+    for name in division_names:
+        ldap_server.add_entry(f"cn={name},ou=divisions,{base_dn}",
+                              _group(name, f"Division {name}", division_members[name]))
+        ldap_server.add_entry(f"cn={name},ou=ddea,{base_dn}",
+                              _group(name, f"Division {name} DD", division_members[name][:1]))
+    for code in codes:
+        for name in division_names:
+            ldap_server.add_entry(f"cn={code}-{name},ou=teams,{base_dn}",
+                                  _group(f"{code}-{name}", f"{COUNTRIES_CODES[code]} Division {name}",
+                                         team_members.get((code, name), ())))
+    ldap_server.add_entry(f"cn=everybody,ou=teams,{base_dn}", _group("everybody", "Everybody", uids))
+    ldap_server.add_entry(f"cn=international,ou=teams,{base_dn}", _group("international", "International"))
+    ldap_server.add_entry(f"cn=hr-admins,ou=special,{base_dn}", _group("hr-admins", "HR admins", ["ceo"]))
+
+    for uid in uids:
+        rocket.add_user(uid)
+    for code in codes[::2]:
+        members = franchise_members[code]
+        current = set(rng.sample(members, len(members) // 2)) | set(rng.sample(uids, min(5, len(uids))))
+        rocket.add_group(sanitize_room_name(f"Franchise-{COUNTRIES_CODES[code]}"), current)
+
+    return dict(uids=uids, franchises=codes, divisions=division_names)
+
+
+def new_users(count, teams, start=0):
+    """
+    Rows of users to import, each in one of teams
+
+    Returns (list): dicts accepted by UserImporter
+    """
+    return [dict(uid=f"new{i:06d}", name="New", surname="User", mail=f"new{i:06d}@example.com", password=PASSWORD,
+                 teams=[teams[i % len(teams)]] if teams else [])
+            for i in range(start, start + count)]
@@ -0,0 +1,48 @@
+import ApiService from './api.service'
+import Notifier from './notifier'
+
+const BASE_URL = 'jobs'
+// milliseconds between checks of a running job
+const POLL_INTERVAL = 2000
+
+export const JobsService = {
+
+  get (id) {
+    return ApiService.get(`${BASE_URL}/${id}`)
+  },
+
+  retry (id, params) {
+    return ApiService.post(`${BASE_URL}/${id}/retry`, params)
+  }
+}
+
+/**
+ * Check a provisioning job until it's done or failed, show errors of failed steps and offer to retry them
+ * @param {Object} job - job returned by the api
+ * @param {String} what - what the job creates, used in notifications
+ * @param {Object} retryParams - sent when retrying, e.g. {password} needed to create the chat account again
+ */
+export function followJob (job, what, retryParams = {}) {
+  if (job.status === 'done') {
+    Notifier.success({text: `Created ${what}`})
+    return
+  }
+  if (job.status === 'failed') {
+    job.steps.filter(step => step.status === 'failed').forEach(step => {
+      Notifier.error({title: `Error creating ${what}`, text: `${step.name}: ${step.error}`})
+    })
+    if (confirm(`Creating ${what} failed, retry?`)) {
+      JobsService.retry(job.id, retryParams)
+        .then(response => followJob(response.data, what, retryParams), (error) => {
+          Notifier.error({title: `Error retrying job ${job.id}`, text: error.response.data.message})
+        })
+    }
+    return
+  }
+  setTimeout(() => {
+    JobsService.get(job.id)
+      .then(response => followJob(response.data, what, retryParams), (error) => {
+        Notifier.error({title: `Error checking job ${job.id}`, text: error.response.data.message})
+      })
+  }, POLL_INTERVAL)
+}
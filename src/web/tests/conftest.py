@@ -1,8 +1,10 @@
 """Defines fixtures available to all tests."""
 
 import pytest
+from unittest.mock import patch, MagicMock
 from webtest import TestApp
 
+from backend import edap
 from backend.app import create_app
 from backend.database import db as _db
 
@@ -48,6 +50,19 @@ def db(app):
     _db.drop_all()
 
 
+@pytest.fixture
+def initialize_mock():
+    """ Patch ldap connections to be mocks """
+    with patch('backend.edap.ldap.initialize', side_effect=lambda uri: MagicMock()) as initialize_mock:
+        yield initialize_mock
+
+
+@pytest.fixture
+def edap_with_mocked_ldap(initialize_mock):
+    """ Edap on a mocked ldap connection """
+    yield edap.Edap('localhost', 'cn=admin', 'admin')
+
+
 @pytest.fixture
 def user(db):
     """A user for the tests."""
@@ -0,0 +1,18 @@
+import json
+import os
+import subprocess
+import sys
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'benchmarks')
+
+
+def test_benchmarks_run_end_to_end(tmp_path):
+    results_path = str(tmp_path / 'results.json')
+    env = dict(os.environ, JOBS_DB_PATH=str(tmp_path / 'jobs.db'))
+    subprocess.run([sys.executable, os.path.join(BENCHMARKS, 'run.py'), '--users', '20', '--franchises', '2',
+                    '--divisions', '2', '--onboard', '2', '--json', results_path], env=env, check=True, timeout=300)
+    with open(results_path) as f:
+        results = json.load(f)['results']
+    # asserts
+    assert [result['scenario'] for result in results] == ['listing', 'onboarding', 'maintain', 'consistency']
+    assert all(result['ldap']['round_trips'] > 0 for result in results)
@@ -0,0 +1,401 @@
+import pytest
+
+from unittest.mock import MagicMock
+
+import ldap
+from ldap.controls import SimplePagedResultsControl
+
+from backend import edap
+
+
+class TestLdapConnectionPool:
+
+    def test_connections_are_reused(self, initialize_mock):
+        pool = edap.LdapConnectionPool('ldap://localhost', 'cn=admin,dc=example,dc=com', 'admin')
+        conn = pool.checkout()
+        pool.checkin(conn)
+        # asserts
+        assert pool.checkout() is conn
+        assert initialize_mock.call_count == 1
+        conn.bind_s.assert_called_once_with('cn=admin,dc=example,dc=com', 'admin')
+
+    def test_pool_is_bounded(self, initialize_mock):
+        pool = edap.LdapConnectionPool('ldap://localhost', 'cn=admin', 'admin', max_size=1, checkout_timeout=0.01)
+        pool.checkout()
+        # asserts
+        with pytest.raises(edap.PoolExhausted):
+            pool.checkout()
+        assert pool.stats()['timeouts'] == 1
+
+    def test_unhealthy_connection_is_replaced(self, initialize_mock):
+        pool = edap.LdapConnectionPool('ldap://localhost', 'cn=admin', 'admin', health_check_interval=0)
+        conn = pool.checkout()
+        conn.whoami_s.side_effect = ldap.SERVER_DOWN
+        pool.checkin(conn)
+        # asserts
+        assert pool.checkout() is not conn
+        assert pool.stats()['health_check_failures'] == 1
+
+    def test_idle_connections_expire(self, initialize_mock):
+        pool = edap.LdapConnectionPool('ldap://localhost', 'cn=admin', 'admin', idle_timeout=-1)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        # asserts
+        assert pool.checkout() is not conn
+        conn.unbind_s.assert_called_once_with()
+        assert pool.stats()['expired'] == 1
+
+    def test_edap_reconnects_after_server_restart(self, initialize_mock):
+        pool = edap.LdapConnectionPool('ldap://localhost', 'cn=admin', 'admin')
+        e = edap.Edap('localhost', 'cn=admin', 'admin', pool=pool)
+        dead_conn = e.ldap
+        dead_conn.search_s.side_effect = ldap.SERVER_DOWN
+        e.search_s('dc=example,dc=com', ldap.SCOPE_BASE, '(objectClass=*)')
+        # asserts
+        assert e.ldap is not dead_conn
+        e.ldap.search_s.assert_called_once_with('dc=example,dc=com', ldap.SCOPE_BASE, '(objectClass=*)')
+        e.release()
+        assert pool.stats()['idle'] == 1
+
+    def test_failed_reconnect_gives_the_connection_up(self, initialize_mock):
+        pool = edap.LdapConnectionPool('ldap://localhost', 'cn=admin', 'admin', max_size=1)
+        e = edap.Edap('localhost', 'cn=admin', 'admin', pool=pool)
+        e.ldap.search_s.side_effect = ldap.SERVER_DOWN
+        initialize_mock.side_effect = ldap.SERVER_DOWN
+        with pytest.raises(ldap.SERVER_DOWN):
+            e.search_s('dc=example,dc=com', ldap.SCOPE_BASE, '(objectClass=*)')
+        e.release()
+        # asserts
+        assert e.ldap is None
+        assert pool.stats()['size'] == 0 and pool.stats()['checked_out'] == 0 and pool.stats()['idle'] == 0
+
+
+def test_verify_user_password_looks_up_only_the_hash(edap_with_mocked_ldap):
+    e = edap_with_mocked_ldap
+    e.ldap.search_s.return_value = [('uid=alice,ou=active,ou=people,dc=example,dc=com',
+                                     {'userPassword': [edap._hashPassword('secret')]})]
+    # asserts
+    assert e.verify_user_password('alice', 'secret')
+    assert not e.verify_user_password('alice', 'wrong')
+    e.ldap.search_s.assert_called_with('uid=alice,ou=active,ou=people,dc=example,dc=com', ldap.SCOPE_BASE,
+                                       '(objectClass=inetOrgPerson)', attrlist=['userPassword'])
+    e.ldap.search_s.side_effect = ldap.NO_SUCH_OBJECT({'desc': 'No such object'})
+    assert not e.verify_user_password('bob', 'secret')
+
+
+class TestGroupMembersBulk:
+    GROUP_FQDN = 'cn=everybody,ou=teams,dc=example,dc=com'
+
+    def test_set_group_members_sends_single_modify(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.search_s.side_effect = [
+            [(self.GROUP_FQDN, {'memberUid': [b'alice', b'bob']})],
+            [('uid=carol,ou=active,ou=people,dc=example,dc=com', {'uid': [b'carol']})],
+        ]
+        change = e.set_group_members(self.GROUP_FQDN, ['alice', 'carol'])
+        # asserts
+        assert change.added == {'carol'}
+        assert change.removed == {'bob'}
+        e.ldap.modify_s.assert_called_once_with(self.GROUP_FQDN, [
+            (ldap.MOD_ADD, 'memberUid', [b'carol']),
+            (ldap.MOD_DELETE, 'memberUid', [b'bob']),
+        ])
+
+    def test_add_group_members_reports_missing_users(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.search_s.side_effect = [
+            [(self.GROUP_FQDN, {})],
+            [],
+        ]
+        # asserts
+        with pytest.raises(edap.ConstraintError):
+            e.add_group_members(self.GROUP_FQDN, ['ghost'])
+        assert not e.ldap.modify_s.called
+
+    def test_make_uid_member_of_many_for_unknown_group(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.search_s.return_value = []
+        # asserts
+        with pytest.raises(edap.ConstraintError):
+            e.make_uid_member_of_many('alice', [self.GROUP_FQDN])
+        assert not e.ldap.modify_s.called
+
+
+class TestAddUsers:
+
+    def test_adds_are_sent_before_results_are_collected(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.search_s.side_effect = [
+            [('ou=active,ou=people,dc=example,dc=com', {})],
+            [('uid=bob,ou=active,ou=people,dc=example,dc=com', {'uid': [b'bob']})],
+        ]
+        calls = []
+
+        def add(dn, modlist):
+            calls.append('add')
+            return len(calls)
+
+        def result3(msgid):
+            calls.append('result')
+            if msgid == 2:
+                raise ldap.ALREADY_EXISTS({'desc': 'Already exists'})
+            return ldap.RES_ADD, [], msgid, []
+
+        e.ldap.add.side_effect = add
+        e.ldap.result3.side_effect = result3
+        users = [dict(uid=uid, name='Name', surname='Surname', password='secret', mail=f'{uid}@example.com')
+                 for uid in ('alice', 'bob', 'carol')]
+        results = e.add_users(users)
+        # asserts
+        assert results == {'alice': None, 'bob': "User of uid 'bob' already exists.", 'carol': 'Already exists'}
+        assert calls == ['add', 'add', 'result', 'result']
+
+
+class TestSearchCache:
+
+    def test_identical_searches_are_sent_once(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.enable_search_cache()
+        e.ldap.search_s.side_effect = lambda base, scope, search, attrlist=None: \
+            [] if search == '(memberUid=alice)' else [(base, {})]
+        for _ in range(3):
+            e.make_uid_member_of('alice', 'cn=pl,ou=franchises,dc=example,dc=com')
+        found = e.search_s('cn=pl,ou=franchises,dc=example,dc=com', ldap.SCOPE_BASE, '(objectClass=posixGroup)',
+                           attrlist=['memberUid'])
+        found[0][1]['memberUid'] = [b'mallory']
+        # asserts
+        # people ou and user are checked once, the group again after every change of it
+        searched = [c[0][:3] for c in e.ldap.search_s.call_args_list]
+        assert searched.count(('ou=active,ou=people,dc=example,dc=com', ldap.SCOPE_BASE,
+                               '(objectClass=organizationalUnit)')) == 1
+        assert searched.count(('ou=active,ou=people,dc=example,dc=com', ldap.SCOPE_ONELEVEL, '(uid=alice)')) == 1
+        assert e.ldap.modify_s.call_count == 3
+        assert e.search_s('cn=pl,ou=franchises,dc=example,dc=com', ldap.SCOPE_BASE, '(objectClass=posixGroup)',
+                          attrlist=['memberUid'])[0][1] == {}
+
+    def test_writes_drop_results_that_may_include_them(self):
+        cache = edap.SearchCache()
+        call = MagicMock(return_value=[])
+        cache.search(call, 'ou=teams,dc=example,dc=com', ldap.SCOPE_ONELEVEL)
+        cache.search(call, 'cn=pl,ou=teams,dc=example,dc=com', ldap.SCOPE_BASE)
+        cache.search(call, 'cn=de,ou=teams,dc=example,dc=com', ldap.SCOPE_BASE)
+        cache.search(call, 'ou=people,dc=example,dc=com', ldap.SCOPE_SUBTREE)
+        call.side_effect = ldap.NO_SUCH_OBJECT({'desc': 'No such object'})
+        with pytest.raises(ldap.NO_SUCH_OBJECT):
+            cache.search(call, 'cn=fr,ou=teams,dc=example,dc=com', ldap.SCOPE_BASE)
+        with pytest.raises(ldap.NO_SUCH_OBJECT):
+            cache.search(call, 'cn=fr,ou=teams,dc=example,dc=com', ldap.SCOPE_BASE)
+        # asserts
+        assert call.call_count == 5 and cache.hits == 1
+        cache.invalidate('cn=PL, ou=teams,dc=example,dc=com')
+        assert len(cache) == 3
+        cache.invalidate('cn=fr,ou=teams,dc=example,dc=com')
+        assert len(cache) == 2
+        cache.invalidate('dc=example,dc=com')
+        assert len(cache) == 0
+
+
+class TestPipeline:
+
+    def test_results_are_collected_in_order_of_sending(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.add.return_value = 1
+        e.ldap.delete.return_value = 2
+        e.ldap.result3.side_effect = [(ldap.RES_ADD, [], 1, []), ldap.NO_SUCH_OBJECT({'desc': 'No such object'})]
+        listener = MagicMock()
+        e.write_listeners.append(listener)
+        with e.pipeline() as pipeline:
+            pipeline.add('cn=a,dc=example,dc=com', [])
+            pipeline.delete('cn=b,dc=example,dc=com')
+            results = pipeline.results()
+        # asserts
+        assert [(r.operation, r.error is None) for r in results] == [('add', True), ('delete', False)]
+        assert isinstance(results[1].error, ldap.NO_SUCH_OBJECT)
+        listener.assert_called_once_with('cn=a,dc=example,dc=com')
+
+    def test_raise_errors_after_collecting_all_replies(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.result3.side_effect = [ldap.ALREADY_EXISTS({'desc': 'Already exists'}), (ldap.RES_ADD, [], 2, [])]
+        pipeline = e.pipeline()
+        pipeline.add('cn=a,dc=example,dc=com', [])
+        pipeline.add('cn=b,dc=example,dc=com', [])
+        # asserts
+        with pytest.raises(ldap.ALREADY_EXISTS):
+            pipeline.results(raise_errors=True)
+        assert e.ldap.result3.call_count == 2
+        assert len(pipeline) == 0
+
+    def test_ensure_structure_searches_once_and_adds_only_missing(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.search_s.return_value = [('ou=franchises,dc=example,dc=com', {}),
+                                        ('cn=PL,ou=franchises,dc=example,dc=com', {}),
+                                        ('ou=active,ou=people,dc=example,dc=com', {})]
+        e.ldap.result3.side_effect = [(ldap.RES_ADD, [], 1, []), (ldap.RES_ADD, [], 2, []),
+                                      ldap.INSUFFICIENT_ACCESS({'desc': 'Insufficient access'})]
+        report = e.ensure_structure(org_units=['franchises'],
+                                    groups=[('pl', 'franchises', 'Poland'), ('de', 'franchises', 'Germany'),
+                                            ('it', 'divisions', None)])
+        # asserts
+        e.ldap.search_s.assert_called_once()
+        assert [c[0][0] for c in e.ldap.add.call_args_list] == ['ou=divisions,dc=example,dc=com',
+                                                                'cn=de,ou=franchises,dc=example,dc=com',
+                                                                'cn=it,ou=divisions,dc=example,dc=com']
+        assert report == dict(created=['ou=divisions', 'cn=de,ou=franchises'],
+                              existing=['ou=franchises', 'cn=pl,ou=franchises'],
+                              failed={'cn=it,ou=divisions': 'Insufficient access'})
+
+    def test_create_group_creates_missing_org_unit(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.search_s.side_effect = ldap.NO_SUCH_OBJECT({'desc': 'No such object'})
+        e.create_group('pl', 'franchises', b'Poland')
+        e.ldap.search_s.side_effect = None
+        e.ldap.search_s.return_value = [('cn=pl,ou=franchises,dc=example,dc=com', {})]
+        # asserts
+        assert [c[0][0] for c in e.ldap.add_s.call_args_list] == ['ou=franchises,dc=example,dc=com',
+                                                                  'cn=pl,ou=franchises,dc=example,dc=com']
+        with pytest.raises(edap.ConstraintError):
+            e.create_group('pl', 'franchises')
+        assert e.ldap.search_s.call_count == 2
+
+    def test_ensure_org_units_exist_adds_only_missing(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.search_s.return_value = [('ou=people,dc=example,dc=com', {'ou': [b'people']})]
+        e.ldap.result3.side_effect = [(ldap.RES_ADD, [], 1, []), ldap.ALREADY_EXISTS({'desc': 'Already exists'})]
+        created = e.ensure_org_units_exist(['people', 'teams', 'franchises'])
+        # asserts
+        assert created == ['teams']
+        assert [c[0][0] for c in e.ldap.add.call_args_list] == ['ou=teams,dc=example,dc=com',
+                                                                'ou=franchises,dc=example,dc=com']
+        e.ldap.search_s.assert_called_once()
+
+
+class TestEnsureTeamsExist:
+
+    def test_creates_missing_teams_only(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.search_s.return_value = [('ou=teams,dc=example,dc=com', {'ou': [b'teams']})]
+        e.get_teams = MagicMock(return_value=[{'cn': [b'PL-PUB']}])
+        e.ldap.result3.side_effect = [
+            (ldap.RES_ADD, [], 1, []),
+            ldap.ALREADY_EXISTS({'desc': 'Already exists'}),
+            ldap.INSUFFICIENT_ACCESS({'desc': 'Insufficient access'}),
+        ]
+        summary = e.ensure_teams_exist([('PL-PUB', 'Poland Publishing'), ('DE-PUB', 'Germany Publishing'),
+                                        ('CZ-PUB', 'Czechia Publishing'), ('FR-PUB', 'France Publishing')])
+        # asserts
+        assert summary == {'created': ['DE-PUB'], 'existing': ['PL-PUB', 'CZ-PUB'],
+                           'failed': {'FR-PUB': 'Insufficient access'}}
+        assert e.ldap.add.call_count == 3
+        assert ('description', [b'Germany Publishing']) in e.ldap.add.call_args_list[0][0][1]
+
+
+def paged_result(entries, cookie):
+    control = MagicMock(controlType=SimplePagedResultsControl.controlType, cookie=cookie, size=0)
+    return ldap.RES_SEARCH_RESULT, entries, 1, [control]
+
+
+class TestPagedSearch:
+
+    def test_iter_users_follows_page_cookies(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.result3.side_effect = [
+            paged_result([('uid=alice,ou=active,ou=people,dc=example,dc=com', {'uid': [b'alice']})], b'page2'),
+            paged_result([('uid=bob,ou=active,ou=people,dc=example,dc=com', {'uid': [b'bob']}),
+                          (None, ['ldap://referral'])], b''),
+        ]
+        users = e.iter_users(page_size=1)
+        # asserts
+        assert next(users)['uid'] == [b'alice']
+        assert e.ldap.search_ext.call_count == 1
+        assert [each['fqdn'] for each in users] == ['uid=bob,ou=active,ou=people,dc=example,dc=com']
+        assert e.ldap.search_ext.call_count == 2
+        control = e.ldap.search_ext.call_args[1]['serverctrls'][0]
+        assert control.size == 1
+        assert control.cookie == b'page2'
+
+    def test_get_groups_without_paging_support(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.result3.return_value = (ldap.RES_SEARCH_RESULT, [(TestGroupMembersBulk.GROUP_FQDN, {})], 1, [])
+        # asserts
+        assert e.get_groups(organizational_unit='teams') == [{'fqdn': TestGroupMembersBulk.GROUP_FQDN}]
+        assert e.ldap.search_ext.call_args[0][0] == 'ou=teams,dc=example,dc=com'
+
+
+class TestAttributeProjection:
+
+    def test_getters_pass_attrlist(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.result3.return_value = (ldap.RES_SEARCH_RESULT, [('cn=pl,ou=franchises,dc=example,dc=com', {})], 1, [])
+        e.get_franchise('pl', attrlist=['cn', 'description'])
+        # asserts
+        assert e.ldap.search_ext.call_args[1]['attrlist'] == ['cn', 'description']
+
+    def test_existence_checks_request_no_attributes(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.search_s.return_value = [('uid=alice,ou=active,ou=people,dc=example,dc=com', {})]
+        e.user_of_uid_exists('alice')
+        # asserts
+        for each in e.ldap.search_s.call_args_list:
+            assert each[1]['attrlist'] == ['1.1']
+
+    def test_schema_declares_its_attributes(self):
+        from backend.ldap.serializers import USER_ATTRIBUTES
+        # asserts
+        assert sorted(USER_ATTRIBUTES) == ['givenName', 'mail', 'sn', 'uid']
+
+
+def user_entry(uid, sn):
+    return f'uid={uid},ou=active,ou=people,dc=example,dc=com', {'uid': [uid.encode()], 'sn': [sn.encode()]}
+
+
+class TestUsersPage:
+
+    def test_offset_is_skipped_with_a_page_of_its_size(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.result3.side_effect = [
+            paged_result([user_entry('alice', 'Zed'), user_entry('bob', 'Young')], b'page2'),
+            paged_result([user_entry('carol', 'Xu')], b'page3'),
+        ]
+        users, total = e.get_users_page(offset=2, limit=1, sort='-sn', query='a*')
+        # asserts
+        assert [user['uid'] for user in users] == [[b'carol']]
+        assert total == 4
+        assert e.ldap.search_ext.call_count == 2
+        page_control, sort_control = e.ldap.search_ext.call_args[1]['serverctrls']
+        assert (page_control.size, page_control.cookie) == (1, b'page2')
+        assert sort_control.ordering_rules == ['-sn']
+        assert '(uid=*a\\2a*)' in e.ldap.search_ext.call_args_list[0][0][2]
+
+    def test_sorting_unsupported_by_server(self, edap_with_mocked_ldap):
+        e = edap_with_mocked_ldap
+        e.ldap.search_ext.side_effect = [ldap.UNAVAILABLE_CRITICAL_EXTENSION, 2]
+        e.ldap.result3.return_value = paged_result([user_entry('alice', 'Zed'), user_entry('bob', 'Young')], b'')
+        users, total = e.get_users_page(limit=1, sort='sn')
+        # asserts
+        assert [user['uid'] for user in users] == [[b'bob']]
+        assert total == 2
+
+
+def group(cn, description=None):
+    entry = {'fqdn': f'cn={cn},dc=example,dc=com', 'cn': [cn.encode()]}
+    if description:
+        entry['description'] = [description.encode()]
+    return entry
+
+
+def test_teams_consistency_is_computed_from_three_searches():
+    e = MagicMock(make_team_display_name=edap.Edap.make_team_display_name,
+                  make_team_machine_name=edap.Edap.make_team_machine_name)
+    e.get_franchises.return_value = [group('PL', 'Poland'), group('DE', 'Germany')]
+    e.get_divisions.return_value = [group('PUB', 'Publishing'), group('IT', 'IT'), group('it', 'Other IT')]
+    e.get_teams.return_value = [group('PL-PUB', 'Poland Publishing'), group('DE-PUB', 'German Publishing'),
+                                group('CZ-PUB', 'Czechia Publishing'), group('PL-IT', 'Poland IT'),
+                                group('everybody', 'Everybody')]
+    consistency = edap.get_teams_consistency(e, ignore=['everybody'])
+    # asserts
+    assert [t['cn'][0] for t in consistency['orphans']] == [b'CZ-PUB', b'PL-IT']
+    assert [t['cn'][0] for t in consistency['mismatched']] == [b'DE-PUB']
+    assert consistency['missing'] == []
+    e.get_divisions.return_value = [group('PUB', 'Publishing'), group('HR', 'Human Resources')]
+    assert edap.get_teams_consistency(e, ignore=['everybody'])['missing'] == [
+        ('PL-HR', 'Poland Human Resources'), ('DE-HR', 'Germany Human Resources')]
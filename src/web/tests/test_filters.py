@@ -0,0 +1,30 @@
+from backend.filters import and_, any_of, compile_filter, contains, eq, not_, or_, prefix, to_filter
+
+
+def test_values_are_escaped():
+    # asserts
+    assert str(eq('cn', 'a*)(uid=*')) == r'(cn=a\2a\29\28uid=\2a)'
+    assert str(prefix('description', 'Pol*')) == r'(description=Pol\2a*)'
+    assert str(contains('sn', '\\')) == r'(sn=*\5c*)'
+    assert str(prefix('description', '')) == '(description=*)'
+
+
+def test_filters_are_normalized():
+    search = and_(contains('sn', 'ov'), and_(eq('objectClass', 'inetOrgPerson'), prefix('uid', 'a')),
+                  None, eq('objectClass', 'inetOrgPerson'))
+    # asserts
+    assert str(search) == '(&(objectClass=inetOrgPerson)(uid=a*)(sn=*ov*))'
+    assert and_(None, 'cn=pl') == to_filter('(cn=pl)')
+    assert or_() is None
+    assert str(any_of('uid', ['alice', 'bob'])) == '(|(uid=alice)(uid=bob))'
+    assert not_(not_(eq('uid', 'alice'))) == eq('uid', 'alice')
+    assert str(eq('uid', 'alice') | ~eq('uid', 'bob')) == '(|(uid=alice)(!(uid=bob)))'
+
+
+def test_compiled_filters_are_cached():
+    compile_filter.cache_clear()
+    for _ in range(3):
+        str(and_(eq('objectClass', 'posixGroup'), eq('memberUid', 'alice')))
+    # asserts
+    assert compile_filter.cache_info().hits == 2
+    assert eq('cn', 'pl') != prefix('cn', 'pl')
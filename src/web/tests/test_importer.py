@@ -0,0 +1,69 @@
+import io
+
+import pytest
+
+from unittest.mock import patch, MagicMock
+
+from backend.ldap.importer import UserImporter, parse_rows, FORMAT_CSV, FORMAT_JSONL
+
+PASSWORD = 'correct horse battery staple 42'
+CSV = f"""uid,name,surname,mail,password,teams
+alice,Alice,Doe,alice@example.com,{PASSWORD},pl-pub; de-pub
+bob,Bob,Doe,not-an-email,{PASSWORD},
+carol,Carol,Doe,carol@example.com,{PASSWORD},pl-pub
+alice,Alice,Again,alice2@example.com,{PASSWORD},
+"""
+
+
+@pytest.fixture(scope='function')
+def edap_mock():
+    mock = MagicMock(TEAMS_GROUP='ou=teams,dc=example,dc=com')
+    mock.get_teams.return_value = [{'cn': [b'everybody']}, {'cn': [b'pl-pub']}, {'cn': [b'de-pub']}]
+    mock.add_users.side_effect = lambda users: {user['uid']: 'Already exists' if user['uid'] == 'carol' else None
+                                                for user in users}
+    with patch('backend.ldap.importer.LdapTeam.get_everybody_team'), \
+            patch('backend.ldap.importer.get_nextcloud'), \
+            patch('backend.ldap.importer.flush_nextcloud_ldap_cache') as flush_mock:
+        mock.flush = flush_mock
+        yield mock
+
+
+def test_parse_rows():
+    rows = list(parse_rows(io.StringIO(CSV), FORMAT_CSV))
+    # asserts
+    assert rows[0]['teams'] == ['pl-pub', 'de-pub']
+    assert 'teams' not in rows[1]
+    assert isinstance(list(parse_rows(['{"uid": "a"}', '', '{'], FORMAT_JSONL))[1], ValueError)
+
+
+class TestUserImporter:
+
+    def test_rows_are_imported_in_batches(self, edap_mock):
+        importer = UserImporter(edap_mock, batch_size=2, create_chat_accounts=False)
+        *results, summary = importer.run(parse_rows(io.StringIO(CSV), FORMAT_CSV))
+        # asserts
+        assert [r['status'] for r in results] == ['created', 'invalid', 'failed', 'invalid']
+        assert results[3]['errors'] == ["uid 'alice' appears more than once"]
+        assert edap_mock.add_users.call_count == 2
+        assert sorted(c[0][0] for c in edap_mock.add_group_members.call_args_list) == [
+            'cn=de-pub,ou=teams,dc=example,dc=com', 'cn=everybody,ou=teams,dc=example,dc=com',
+            'cn=pl-pub,ou=teams,dc=example,dc=com']
+        assert summary['rows'] == 4 and summary['created'] == 1
+        edap_mock.flush.assert_called_once()
+
+    def test_unknown_team_and_weak_password_are_invalid(self, edap_mock):
+        rows = [{'uid': 'dave', 'name': 'Dave', 'surname': 'Doe', 'mail': 'dave@example.com', 'password': 'dave',
+                 'teams': ['xx-yy']}]
+        *results, summary = UserImporter(edap_mock, create_chat_accounts=False).run(rows)
+        # asserts
+        assert results[0]['status'] == 'invalid'
+        assert results[0]['errors'][0] == "teams: team 'xx-yy' doesn't exist"
+        assert not edap_mock.add_users.called
+        assert not edap_mock.flush.called
+
+    def test_invalid_row_does_not_take_its_uid(self, edap_mock):
+        row = {'uid': 'dave', 'name': 'Dave', 'surname': 'Doe', 'mail': 'dave@example.com', 'password': PASSWORD}
+        rows = [dict(row, teams=['xx-yy']), dict(row, teams=['pl-pub'])]
+        *results, summary = UserImporter(edap_mock, create_chat_accounts=False).run(rows)
+        # asserts
+        assert [r['status'] for r in results] == ['invalid', 'created']
@@ -0,0 +1,107 @@
+import pytest
+
+from unittest.mock import MagicMock
+
+from backend.jobs.queue import JobQueue, JobStepError, STEPS, STATUS_DONE, STATUS_FAILED, STATUS_PENDING, \
+    STATUS_RUNNING, job_step
+from backend.jobs.store import JobStore
+
+
+@pytest.fixture(scope='function')
+def steps():
+    calls = dict(ok=0, flaky=0, broken=0)
+
+    @job_step('test.ok')
+    def ok(args, secrets):
+        calls['ok'] += 1
+        return args['name'] + secrets.get('password', '')
+
+    @job_step('test.flaky')
+    def flaky(args, secrets):
+        calls['flaky'] += 1
+        if calls['flaky'] < 2:
+            raise ConnectionError('service unavailable')
+        return 'created'
+
+    @job_step('test.broken')
+    def broken(args, secrets):
+        calls['broken'] += 1
+        raise JobStepError('folder was not created')
+
+    yield calls
+    for name in ('test.ok', 'test.flaky', 'test.broken'):
+        STEPS.pop(name)
+
+
+@pytest.fixture(scope='function')
+def job_queue(tmp_path):
+    yield JobQueue(MagicMock(), JobStore(str(tmp_path / 'jobs.db')), max_attempts=3, retry_delay=0)
+
+
+class TestJobQueue:
+
+    def test_steps_run_in_order_with_secrets(self, job_queue, steps):
+        job = job_queue.submit('user', {'name': 'alice'}, ['test.ok', 'test.flaky'], secrets={'password': '!'},
+                               wait=True)
+        # asserts
+        assert job['status'] == STATUS_DONE
+        assert [step['result'] for step in job['steps']] == ['alice!', 'created']
+        assert job['steps'][1]['attempts'] == 2
+        assert 'password' not in str(job_queue.store.get(job['id']))
+
+    def test_failed_step_stops_job_and_is_not_retried(self, job_queue, steps):
+        job = job_queue.submit('franchise', {'name': 'pl'}, ['test.broken', 'test.ok'], wait=True)
+        # asserts
+        assert job['status'] == STATUS_FAILED
+        assert steps['broken'] == 1
+        assert job['steps'][0]['error'] == 'folder was not created'
+        assert job['steps'][1]['attempts'] == 0
+
+    def test_retry_resumes_from_failed_step(self, job_queue, steps):
+        job_queue.max_attempts = 1
+        job = job_queue.submit('franchise', {'name': 'pl'}, ['test.ok', 'test.flaky'], wait=True)
+        assert job['status'] == STATUS_FAILED
+        job = job_queue.retry(job['id'], wait=True)
+        # asserts
+        assert job['status'] == STATUS_DONE
+        assert job['steps'][0]['attempts'] == 1
+        assert job['steps'][1]['result'] == 'created'
+
+    def test_secrets_are_dropped_when_job_fails(self, job_queue, steps):
+        job_queue.max_attempts = 1
+        job = job_queue.submit('user', {'name': 'alice'}, ['test.flaky', 'test.ok'], secrets={'password': '!'},
+                               wait=True)
+        assert job['status'] == STATUS_FAILED
+        assert job_queue._secrets == {}
+        job = job_queue.retry(job['id'], secrets={'password': '?'}, wait=True)
+        # asserts
+        assert job['status'] == STATUS_DONE
+        assert job['steps'][1]['result'] == 'alice?'
+        assert job_queue._secrets == {}
+
+    def test_queued_job_runs_once(self, job_queue, steps):
+        job = job_queue.submit('user', {'name': 'alice'}, ['test.ok'], secrets={'password': '!'})
+        job_queue._queue.put(job['id'])
+        job_queue._queue.join()
+        # asserts
+        assert steps['ok'] == 1
+        job = job_queue.get(job['id'])
+        assert job['status'] == STATUS_DONE
+        assert job['steps'][0]['result'] == 'alice!'
+
+    def test_recover_queues_interrupted_jobs_only(self, job_queue, steps):
+        store = job_queue.store
+        pending = store.create('user', {'name': 'alice'}, ['test.ok'], STATUS_PENDING)
+        stale = store.create('user', {'name': 'bob'}, ['test.ok'], STATUS_RUNNING)
+        live = store.create('user', {'name': 'carol'}, ['test.ok'], STATUS_RUNNING)
+        submitted = store.create('user', {'name': 'dave'}, ['test.ok'], STATUS_PENDING)
+        store._connection().execute('UPDATE jobs SET updated = 0 WHERE id IN (?, ?)', (pending['id'], stale['id']))
+        job_queue.recover(stale_after=60)
+        job_queue.recover(stale_after=0)
+        job_queue._queue.join()
+        # asserts
+        assert steps['ok'] == 2
+        assert job_queue.get(pending['id'])['status'] == STATUS_DONE
+        assert job_queue.get(stale['id'])['status'] == STATUS_DONE
+        assert job_queue.get(live['id'])['status'] == STATUS_RUNNING
+        assert job_queue.get(submitted['id'])['status'] == STATUS_PENDING
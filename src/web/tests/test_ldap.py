@@ -1,4 +1,8 @@
-from backend.ldap.utils import merge_divisions
+from unittest.mock import MagicMock
+
+import pytest
+
+from backend.ldap.utils import decode_cursor, encode_cursor, merge_divisions
 
 
 def test_merge_divisions():
@@ -35,4 +39,63 @@ def test_merge_divisions():
             raise Exception('Unknown division')
 
 
+def test_membership_cache_is_invalidated_by_writes():
+    from backend.ldap.authcache import MembershipCache
+    cache = MembershipCache(ttl=60)
+    cache.set('alice', 'HR-Admins', True)
+    cache.set('alice', 'board', False)
+    cache.set('bob', 'hr-admins', False)
+    # asserts
+    assert cache.get('alice', 'hr-admins') is True and cache.get('alice', 'board') is False
+    cache.invalidate('cn=hr-admins,ou=special,dc=example,dc=com')
+    assert cache.get('alice', 'hr-admins') is None and cache.get('bob', 'hr-admins') is None
+    assert cache.get('alice', 'board') is False
+    cache.invalidate('uid=alice,ou=active,ou=people,dc=example,dc=com')
+    assert len(cache) == 0
+    cache.ttl = -1
+    cache.set('alice', 'board', True)
+    assert cache.get('alice', 'board') is None
+
+
+def test_login_guard_throttles_uid_after_failures():
+    from backend.ldap.login import LoginGuard, LOGIN_OK, LOGIN_INVALID, LOGIN_THROTTLED
+    guard = LoginGuard(max_failures=2, window=60)
+    check = MagicMock(side_effect=lambda uid, password: password == 'secret')
+    # asserts
+    assert guard.verify('alice', 'wrong', check) == LOGIN_INVALID
+    assert guard.verify('Alice', 'secret', check) == LOGIN_OK
+    assert guard.verify('alice', 'wrong', check) == LOGIN_INVALID
+    assert guard.verify('alice', 'wrong', check) == LOGIN_INVALID
+    assert guard.verify('alice', 'secret', check) == LOGIN_THROTTLED
+    assert guard.verify('bob', 'secret', check) == LOGIN_OK
+    assert check.call_count == 5
+    stats = guard.stats()
+    assert stats['ok'] == 2 and stats['invalid'] == 3 and stats['throttled'] == 1 and stats['throttled_uids'] == 1
+    assert stats['latency_max'] is not None
+    guard.window = -1
+    assert guard.verify('alice', 'secret', check) == LOGIN_OK
+
+
+def test_sorted_password_file_finds_exactly_listed_passwords(tmp_path):
+    import gzip
+    from backend.ldap.passwords import open_frequent_passwords
+    source = tmp_path / 'passwords.txt.gz'
+    with gzip.open(source, 'wt') as f:
+        f.write('qwerty\npassword\n123456\npassword\nzzz\nletmein  \n')
+    passwords = open_frequent_passwords(str(source))
+    # asserts
+    assert all(pw in passwords for pw in ('123456', 'letmein', 'password', 'qwerty', 'zzz'))
+    assert not any(pw in passwords for pw in ('', '1234567', 'passwor', 'a', 'zzzz', 'pass\nword'))
+    assert (tmp_path / 'passwords.txt.gz.sorted').read_bytes() == b'123456\nletmein\npassword\nqwerty\nzzz'
+
 
+def test_decode_cursor_rejects_malformed_positions():
+    # asserts
+    assert decode_cursor(encode_cursor({'offset': 50, 'sort': '-uid', 'query': None})) == \
+        {'offset': 50, 'sort': '-uid', 'query': None}
+    for position in ({'offset': None}, {'offset': '50'}, {'offset': True}, {'offset': 0, 'sort': 1},
+                     {'offset': 0, 'query': ['a']}, [0]):
+        with pytest.raises(ValueError):
+            decode_cursor(encode_cursor(position))
+    with pytest.raises(ValueError):
+        decode_cursor('not a cursor')
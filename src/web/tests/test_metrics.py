@@ -0,0 +1,59 @@
+import pytest
+
+from unittest.mock import MagicMock
+
+import ldap
+
+from backend.metrics import CallMetrics, CallTracker, InstrumentedClient, ldap_call_shape
+
+
+def test_ldap_call_shape_drops_values():
+    # asserts
+    assert ldap_call_shape('search_s', ('cn=pl,ou=franchises,dc=example,dc=com', ldap.SCOPE_BASE,
+                                        '(&(objectClass=posixGroup)(memberUid=alice))')) == \
+        'cn=*,ou=franchises,dc=example,dc=com base (&(objectClass=posixGroup)(memberUid=*))'
+    assert ldap_call_shape('modify', ('uid=alice,ou=active,ou=people,dc=example,dc=com', [])) == \
+        'uid=*,ou=active,ou=people,dc=example,dc=com'
+
+
+def test_edap_calls_are_recorded_and_repeats_found(edap_with_mocked_ldap):
+    e = edap_with_mocked_ldap
+    metrics = CallMetrics()
+    tracker = CallTracker(metrics, view='franchises_api', debug=True)
+    e.call_listeners.append(tracker.ldap_listener)
+    e.ldap.search_s.return_value = [('cn=pl,ou=franchises,dc=example,dc=com', {'cn': [b'pl']})]
+    for code in ('pl', 'de', 'fr'):
+        e.subobject_exists_at(f'cn={code},ou=franchises', 'posixGroup')
+    e.ldap.delete_s.side_effect = ldap.NO_SUCH_OBJECT
+    with pytest.raises(ldap.NO_SUCH_OBJECT):
+        e.delete_s('cn=pl,ou=franchises,dc=example,dc=com')
+    # asserts
+    assert tracker.totals['ldap'][0] == 4
+    assert tracker.repeated_calls(3) == [
+        (('ldap', 'search_s', 'cn=*,ou=franchises,dc=example,dc=com base (objectClass=posixGroup)'), 3)]
+    assert metrics.calls[('ldap', 'search_s', 'franchises_api')] == 3
+    assert metrics.errors[('ldap', 'delete_s')] == 1
+    assert metrics.response_bytes[('ldap', 'search_s')] == 3 * len('cn=pl,ou=franchises,dc=example,dc=com' + 'pl')
+    assert 'ldap;dur=' in tracker.server_timing() and 'desc="4 calls"' in tracker.server_timing()
+    text = metrics.render()
+    assert 'teap_service_calls_total{service="ldap",operation="search_s",view="franchises_api"} 3' in text
+    assert 'teap_service_call_seconds_count{service="ldap",operation="search_s"} 3' in text
+    assert 'teap_service_call_seconds_bucket{service="ldap",operation="search_s",le="+Inf"} 3' in text
+
+
+def test_instrumented_client_records_calls():
+    client = MagicMock()
+    client.users_list.return_value = MagicMock(content=b'{"users": []}')
+    client.groups_invite.side_effect = RuntimeError('Connection refused')
+    client.server_url = 'http://rocket.chat'
+    metrics = CallMetrics()
+    rocket = InstrumentedClient(client, 'rocket', CallTracker(metrics))
+    rocket.users_list(query='{}')
+    with pytest.raises(RuntimeError):
+        rocket.groups_invite('room', 'user')
+    # asserts
+    assert rocket.server_url == 'http://rocket.chat'
+    client.users_list.assert_called_once_with(query='{}')
+    assert metrics.calls[('rocket', 'users_list', '')] == 1
+    assert metrics.response_bytes[('rocket', 'users_list')] == len(b'{"users": []}')
+    assert metrics.errors == {('rocket', 'groups_invite'): 1}
@@ -1,7 +1,11 @@
+import time
+
 import pytest
 
 from unittest.mock import patch, MagicMock
 
+from backend.nextcloud.utils import GroupFolderIndex, LdapCacheFlusher
+
 
 @pytest.fixture(scope='function')
 def nextcloud_mock():
@@ -306,3 +310,53 @@ class TestGroupWithFolderApi:
         nextcloud_mock.add_group.assert_called_once_with(data['group_name'])
         nextcloud_mock.create_group_folder.assert_called_once_with('/'.join([data['group_type'], data['group_name']]))
         nextcloud_mock.delete_group.assert_called_once_with(data['group_name'])
+
+
+class TestGroupFolderIndex:
+
+    def test_one_fetch_serves_all_lookups(self):
+        nxc = MagicMock()
+        nxc.get_group_folders.return_value.data = {'1': {'mount_point': 'Franchises'},
+                                                   '2': {'mount_point': 'Franchises/pl'}}
+        index = GroupFolderIndex(ttl=60)
+        # asserts
+        assert index.get(nxc, 'Franchises/pl') == '2'
+        assert index.get(nxc, 'Franchises') == '1'
+        assert index.get(nxc, 'Divisions') is None
+        index.put('Divisions', 3)
+        assert index.get(nxc, 'Divisions') == '3'
+        nxc.get_group_folders.assert_called_once_with()
+
+    def test_expired_index_is_fetched_again(self):
+        nxc = MagicMock()
+        nxc.get_group_folders.return_value.data = []
+        index = GroupFolderIndex(ttl=0)
+        index.get(nxc, 'Franchises')
+        index.get(nxc, 'Franchises')
+        # asserts
+        assert nxc.get_group_folders.call_count == 2
+
+
+class TestLdapCacheFlusher:
+
+    def test_requests_within_window_are_coalesced(self):
+        nxc = MagicMock()
+        flusher = LdapCacheFlusher(MagicMock(), window=0.05)
+        with patch('backend.nextcloud.utils.get_nextcloud', return_value=nxc):
+            for _ in range(10):
+                flusher.request()
+            time.sleep(0.2)
+        # asserts
+        assert flusher.requests == 10 and flusher.flushes == 1
+        nxc.ldap_cache_flush.assert_called_once_with(nxc.get_ldap_lowest_existing_config_id.return_value)
+
+    def test_flush_now_cancels_scheduled_flush_and_caches_config_id(self):
+        nxc = MagicMock()
+        flusher = LdapCacheFlusher(MagicMock(), window=60)
+        flusher.request()
+        flusher.flush_now(nxc)
+        flusher.flush_now(nxc)
+        # asserts
+        assert flusher._pending is None
+        assert nxc.ldap_cache_flush.call_count == 2
+        nxc.get_ldap_lowest_existing_config_id.assert_called_once_with()
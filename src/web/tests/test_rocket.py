@@ -0,0 +1,134 @@
+import time
+
+from unittest.mock import MagicMock
+
+from backend.rocket_chat.directory import RocketDirectory, RoomIndex, TTLCache
+from backend.rocket_chat.reconcile import HostRateLimiter, RoomReconciler
+
+
+def response(ok=True, **data):
+    return MagicMock(ok=ok, status_code=200 if ok else 400, reason='', json=MagicMock(return_value=data))
+
+
+def make_rocket(groups, members, users):
+    rocket = MagicMock()
+    rocket.rocket.server_url = 'https://chat.entint.org'
+    rocket.get_group_id.side_effect = groups.get
+    rocket.create_group.side_effect = lambda name: groups.setdefault(name, f'id-{name}')
+    rocket.get_all_group_members.side_effect = lambda group_id, call: [{'username': u} for u in members[group_id]]
+    rocket.get_user_id.side_effect = users.get
+    rocket.invite_user_to_group.return_value = response()
+    rocket.kick_user_from_group.return_value = response()
+    return rocket
+
+
+class TestRoomReconciler:
+
+    def test_reconcile_invites_and_kicks(self):
+        rocket = make_rocket(groups={'Franchise-Poland': 'g1'}, members={'g1': ['alice', 'carol'], 'id-Staff': []},
+                             users={'alice': 'u1', 'bob': 'u2', 'carol': 'u3'})
+        report = RoomReconciler(rocket, workers=4, rate=0).reconcile({
+            'Franchise-Poland': {'alice', 'bob'},
+            'Staff': {'bob', 'dave'},
+        })
+        # asserts
+        rocket.create_group.assert_called_once_with('Staff')
+        assert sorted(c[0] for c in rocket.invite_user_to_group.call_args_list) == [('g1', 'u2'), ('id-Staff', 'u2')]
+        rocket.kick_user_from_group.assert_called_once_with('g1', 'u3')
+        assert rocket.get_user_id.call_count == 3
+        rocket.prefetch_users.assert_called_once_with()
+        assert report['invited'] == 2 and report['kicked'] == 1 and report['errors'] == 1
+        assert set(report['timings']) == {'ensure', 'fetch', 'resolve', 'apply'}
+
+    def test_failed_fetch_skips_room(self):
+        rocket = make_rocket(groups={'Staff': 'g1'}, members={}, users={'bob': 'u2'})
+        report = RoomReconciler(rocket, rate=0).reconcile({'Staff': {'bob'}})
+        # asserts
+        assert not rocket.invite_user_to_group.called
+        assert report['errors'] == 1
+
+
+def test_rate_limiter_spaces_requests_per_host():
+    limiter = HostRateLimiter(rate=50)
+    start = time.monotonic()
+    for host in ('chat', 'chat', 'chat', 'cloud'):
+        limiter.wait(host)
+    # asserts
+    assert time.monotonic() - start >= 0.04
+    assert time.monotonic() - start < 0.5
+
+
+def users_page(offset, count, fields):
+    users = [{'_id': f'u{i}', 'username': f'user{i}'} for i in range(5)]
+    return response(users=users[offset:offset + count], total=len(users))
+
+
+class TestRocketDirectory:
+
+    def test_users_are_prefetched_by_pages(self):
+        client = MagicMock()
+        client.users_list.side_effect = users_page
+        lookup = MagicMock(return_value={'_id': 'u9'})
+        directory = RocketDirectory(page_size=2)
+        # asserts
+        assert directory.get_user_id(client, 'user3', lookup) == 'u3'
+        assert directory.get_user_id(client, 'user0', lookup) == 'u0'
+        assert client.users_list.call_count == 3
+        assert directory.get_user_id(client, 'user9', lookup) == 'u9'
+        lookup.assert_called_once_with('user9')
+        assert client.users_list.call_count == 3
+
+
+def groups_page(offset, count, fields):
+    groups = [{'_id': f'g{i}', 'fname': f'Room-{i}', 't': 'p'} for i in range(3)]
+    return response(groups=groups[offset:offset + count], total=len(groups))
+
+
+class TestRoomIndex:
+
+    def test_index_is_built_by_pages_and_served_from_memory(self):
+        client = MagicMock()
+        client.groups_list_all.side_effect = groups_page
+        index = RoomIndex(page_size=2)
+        # asserts
+        assert index.get(client, 'Room-2')['_id'] == 'g2'
+        assert index.get(client, 'Room-0')['_id'] == 'g0'
+        assert client.groups_list_all.call_count == 2
+        assert not client.rooms_get.called
+
+    def test_missing_room_is_refreshed_incrementally(self):
+        client = MagicMock()
+        client.groups_list_all.side_effect = groups_page
+        client.rooms_get.return_value = response(
+            update=[{'_id': 'g9', 'fname': 'Room-9', 't': 'p'}, {'_id': 'c1', 'fname': 'Channel', 't': 'c'}],
+            remove=[{'_id': 'g0'}])
+        index = RoomIndex(page_size=5)
+        index.get(client, 'Room-1')
+        # asserts
+        assert index.get(client, 'Room-9')['_id'] == 'g9'
+        assert client.rooms_get.call_args[1]['updatedSince'].endswith('Z')
+        assert index.get(client, 'Channel') is None
+        assert 'Room-0' not in index.rooms
+        assert client.groups_list_all.call_count == 1
+
+    def test_created_room_is_put_into_index(self):
+        index = RoomIndex()
+        index.put({'_id': 'g1', 'fname': 'Staff'})
+        index.put({'_id': 'g1', 'fname': 'Staff-renamed'})
+        # asserts
+        assert list(index.rooms) == ['Staff-renamed']
+
+
+def test_ttl_cache_evicts_least_recently_used_and_expired():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    # asserts
+    assert cache.get('b') is None and cache.get('a') == 1
+    cache.pop_value(1)
+    assert cache.get('a') is None
+    cache.ttl = -1
+    cache.set('d', 4)
+    assert cache.get('d') is None
@@ -0,0 +1,215 @@
+import pytest
+
+from unittest.mock import patch, MagicMock
+
+import ldap
+
+from backend import edap
+from backend.edap import ObjectDoesNotExist
+from backend.filters import prefix
+from backend.ldap.snapshot import DirectorySnapshot, UnsupportedSearch, parse_simple_search
+from backend.ldap.sync import DirectorySync, SYNC_FILTER, csn_from_cookie
+
+PERSON = [b'inetOrgPerson']
+POSIX_GROUP = [b'posixGroup']
+PEOPLE = [
+    ('uid=alice,ou=active,ou=people,dc=entint,dc=org', {'objectClass': PERSON, 'uid': [b'alice'],
+                                                        'givenName': [b'Alice']}),
+    ('uid=bob,ou=active,ou=people,dc=entint,dc=org', {'objectClass': PERSON, 'uid': [b'bob'],
+                                                      'givenName': [b'Bob']}),
+]
+GROUPS = [
+    ('cn=pl-pub,ou=teams,dc=entint,dc=org', {'objectClass': POSIX_GROUP, 'cn': [b'pl-pub'],
+                                             'description': [b'Poland Publishing'], 'memberUid': [b'alice']}),
+    ('cn=pl,ou=franchises,dc=entint,dc=org', {'objectClass': POSIX_GROUP, 'cn': [b'pl'], 'description': [b'Poland'],
+                                              'memberUid': [b'alice', b'bob']}),
+]
+
+
+@pytest.fixture(scope='function')
+def edap_mock():
+    mock = MagicMock(ACTIVE_PEOPLE_GROUP='ou=active,ou=people,dc=entint,dc=org', BASE_DN='dc=entint,dc=org',
+                     TEAMS_GROUP_NAME='teams', FRANCHISES_GROUP_NAME='franchises')
+    mock.search_s.side_effect = lambda base, scope, search, attrlist: {
+        '(objectClass=inetOrgPerson)': PEOPLE,
+        '(objectClass=posixGroup)': GROUPS,
+    }.get(search, [])
+    yield mock
+
+
+def test_parse_simple_search():
+    assert parse_simple_search(None) is None
+    assert parse_simple_search('cn=PL-PUB') == ('cn', 'PL-PUB', False)
+    assert parse_simple_search('(description=Pol*)') == ('description', 'Pol', True)
+    assert parse_simple_search(prefix('description', 'R&D (')) == ('description', 'R&D (', True)
+    with pytest.raises(UnsupportedSearch):
+        parse_simple_search('(&(cn=a)(cn=b))')
+
+
+class TestDirectorySnapshot:
+
+    def test_reads_are_served_from_snapshot(self, edap_mock):
+        reader = DirectorySnapshot(ttl=60).reader(edap_mock)
+        # asserts
+        assert len(reader.get_users()) == 2
+        assert [g['fqdn'] for g in reader.get_user_groups('bob')] == ['cn=pl,ou=franchises,dc=entint,dc=org']
+        assert reader.get_teams('memberUid=alice')[0]['cn'] == [b'pl-pub']
+        assert reader.get_franchises('description=pol*')[0]['cn'] == [b'pl']
+        with pytest.raises(ObjectDoesNotExist):
+            reader.get_user('carol')
+        assert edap_mock.search_s.call_count == 3
+
+    def test_unsupported_search_falls_back_to_edap(self, edap_mock):
+        reader = DirectorySnapshot(ttl=60).reader(edap_mock)
+        reader.get_groups('(|(cn=a)(cn=b))')
+        # asserts
+        edap_mock.get_groups.assert_called_once_with('(|(cn=a)(cn=b))', organizational_unit=None, attrlist=None)
+
+    def test_projection_beyond_snapshot_falls_back_to_edap(self, edap_mock):
+        reader = DirectorySnapshot(ttl=60).reader(edap_mock)
+        reader.get_user('alice', attrlist=['uid', 'givenName'])
+        reader.get_user('alice', attrlist=['jpegPhoto'])
+        # asserts
+        edap_mock.get_user.assert_called_once_with('alice', attrlist=['jpegPhoto'])
+
+    def test_invalidation_reloads_snapshot(self, edap_mock):
+        snapshot = DirectorySnapshot(ttl=60)
+        reader = snapshot.reader(edap_mock)
+        reader.get_users()
+        snapshot.invalidate('cn=pl,ou=franchises,dc=entint,dc=org')
+        reader.get_users()
+        # asserts
+        assert edap_mock.search_s.call_count == 6
+
+    def test_failed_reload_is_retried(self, edap_mock):
+        snapshot = DirectorySnapshot(ttl=60)
+        reader = snapshot.reader(edap_mock)
+        reader.get_users()
+        snapshot.invalidate('uid=bob,ou=active,ou=people,dc=entint,dc=org')
+        search = edap_mock.search_s.side_effect
+        edap_mock.search_s.side_effect = ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+        with pytest.raises(ldap.SERVER_DOWN):
+            reader.get_users()
+        edap_mock.search_s.side_effect = search
+        # asserts
+        assert not snapshot.is_fresh()
+        assert len(reader.get_users()) == 2
+        assert snapshot.is_fresh()
+        assert edap_mock.search_s.call_count == 7
+
+    def test_users_page_from_sorted_index(self, edap_mock):
+        reader = DirectorySnapshot(ttl=60).reader(edap_mock)
+        users, total = reader.get_users_page(offset=0, limit=1, sort='-givenName', query='B')
+        # asserts
+        assert [user['uid'] for user in users] == [[b'bob']]
+        assert total == 1
+        assert [user['uid'] for user in reader.get_users_page(offset=1, limit=5)[0]] == [[b'bob']]
+
+    def test_returned_entries_are_copies(self, edap_mock):
+        reader = DirectorySnapshot(ttl=60).reader(edap_mock)
+        reader.get_users()[0]['uid'] = 'changed'
+        # asserts
+        assert reader.get_user('alice')['uid'] == [b'alice']
+
+
+@pytest.fixture(scope='function')
+def sync_conn():
+    conn = MagicMock()
+    with patch('backend.ldap.sync.ldap.initialize', return_value=conn):
+        yield conn
+
+
+def make_sync(snapshot, mode=DirectorySync.MODE_TIMESTAMP, **kwargs):
+    return DirectorySync(snapshot, 'ldap://localhost', 'cn=admin,dc=entint,dc=org', 'admin', 'dc=entint,dc=org',
+                         'ou=active,ou=people,dc=entint,dc=org', mode=mode, **kwargs)
+
+
+def stamped(entries, timestamp):
+    return [(dn, {**attrs, 'modifyTimestamp': [timestamp]}) for dn, attrs in entries]
+
+
+class TestDirectorySync:
+
+    def test_timestamp_poll_fetches_only_changes(self, sync_conn):
+        snapshot = DirectorySnapshot(ttl=60)
+        directory_sync = make_sync(snapshot)
+        sync_conn.search_s.return_value = stamped(PEOPLE + GROUPS, b'20200101120000Z')
+        directory_sync.poll()
+        carol = ('uid=carol,ou=active,ou=people,dc=entint,dc=org', {'objectClass': PERSON, 'uid': [b'carol']})
+        sync_conn.search_s.return_value = stamped([carol], b'20200101130000Z')
+        directory_sync.poll()
+        # asserts
+        assert sync_conn.search_s.call_args[0][2] == \
+            f'(&{SYNC_FILTER}(modifyTimestamp>=20200101120000Z))'
+        assert sorted(snapshot.users) == ['alice', 'bob', 'carol']
+        assert 'modifyTimestamp' not in snapshot.users['carol']
+        assert directory_sync.status()['last_timestamp'] == '20200101130000Z'
+        assert snapshot.is_fresh()
+
+    def test_timestamp_reconcile_removes_deleted_entries(self, sync_conn):
+        snapshot = DirectorySnapshot(ttl=60)
+        directory_sync = make_sync(snapshot, reconcile_every=1)
+        sync_conn.search_s.side_effect = [
+            stamped(PEOPLE + GROUPS, b'20200101120000Z'),
+            [],
+            [(dn, {}) for dn, _ in PEOPLE[:1] + GROUPS[:1]],
+        ]
+        directory_sync.poll()
+        directory_sync.poll()
+        # asserts
+        assert sync_conn.search_s.call_args[1]['attrlist'] == ['1.1']
+        assert list(snapshot.users) == ['alice']
+        assert list(snapshot.groups) == ['cn=pl-pub,ou=teams,dc=entint,dc=org']
+        assert snapshot.memberships['bob'] == set()
+
+    def test_invalidated_snapshot_is_updated_incrementally(self, sync_conn, edap_mock):
+        snapshot = DirectorySnapshot(ttl=60)
+        directory_sync = make_sync(snapshot)
+        sync_conn.search_s.return_value = stamped(PEOPLE + GROUPS, b'20200101120000Z')
+        directory_sync.poll()
+        snapshot.invalidate('uid=alice,ou=active,ou=people,dc=entint,dc=org')
+        snapshot.reader(edap_mock).get_users()
+        # asserts
+        assert directory_sync.polls == 2
+        assert not edap_mock.search_s.called
+
+    def test_entry_deleted_through_edap_is_gone_before_reconcile(self, sync_conn, edap_mock):
+        snapshot = DirectorySnapshot(ttl=60)
+        directory_sync = make_sync(snapshot)
+        sync_conn.search_s.return_value = stamped(PEOPLE + GROUPS, b'20200101120000Z')
+        directory_sync.poll()
+        with patch('backend.edap.ldap.initialize', return_value=MagicMock()):
+            e = edap.Edap('localhost', 'cn=admin', 'admin')
+        e.write_listeners.append(snapshot.invalidate)
+        e.delete_s('uid=bob,ou=active,ou=people,dc=entint,dc=org')
+
+        def search_s(base, scope, search, attrlist):
+            if scope == ldap.SCOPE_BASE:
+                raise ldap.NO_SUCH_OBJECT({'desc': 'No such object'})
+            return []
+        sync_conn.search_s.side_effect = search_s
+        users = snapshot.reader(edap_mock).get_users()
+        # asserts
+        assert [user['uid'] for user in users] == [[b'alice']]
+        assert snapshot.is_fresh() and snapshot.written_dns() == set()
+        assert not edap_mock.search_s.called
+
+    def test_syncrepl_present_phase_removes_missing_entries(self):
+        snapshot = DirectorySnapshot(ttl=60)
+        directory_sync = make_sync(snapshot, mode=DirectorySync.MODE_SYNCREPL)
+        directory_sync._begin_refresh()
+        for uuid, (dn, attrs) in enumerate(PEOPLE):
+            directory_sync.syncrepl_entry(dn, attrs, uuid)
+        directory_sync._finish_refresh(initial=True)
+        directory_sync._begin_refresh()
+        directory_sync.syncrepl_present([0])
+        directory_sync.syncrepl_present(None)
+        directory_sync._finish_refresh(initial=False)
+        # asserts
+        assert list(snapshot.users) == ['alice']
+
+    def test_csn_from_cookie(self):
+        # asserts
+        assert csn_from_cookie(b'rid=000,csn=20200101120000.000000Z#000000#000#000000') == \
+            '20200101120000.000000Z#000000#000#000000'
+        assert csn_from_cookie(None) is None